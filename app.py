@@ -1,15 +1,52 @@
 import os
 import tempfile
+import shutil
 import subprocess
 import requests
-from flask import Flask, request, jsonify, send_file, abort, Response
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from http.cookiejar import DefaultCookiePolicy
+from flask import Flask, request, jsonify, send_file, abort, redirect, g, Response
 from flask_cors import CORS
+from werkzeug.wsgi import ClosingIterator
 import yt_dlp
 import threading
 import time
 import random
-import glob
-from urllib.parse import urlparse
+import re
+import socket
+import json
+import base64
+import copy
+import fcntl
+import io
+import sys
+import bisect
+import gzip
+import hashlib
+import hmac
+import heapq
+import uuid
+import unicodedata
+import contextvars
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from urllib.parse import urlparse, parse_qs, quote, urljoin
+from xml.sax.saxutils import escape
+
+try:
+    import orjson
+except ImportError:  # plain json fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
@@ -50,7 +87,1553 @@ def sizeof_fmt(num, suffix="B"):
         num /= 1024
     return f"{num:.2f} P{suffix}"
 
+# PROMETHEUS METRICS (per-worker registries, merged across gunicorn workers at scrape time)
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Streaming loops add to byte counters once per this many bytes, not once per chunk
+METRICS_BYTES_BATCH = int(os.environ.get('METRICS_BYTES_BATCH', 4 * 1024 * 1024))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FFMPEG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+METRIC_DEFINITIONS = {
+    # name: (type, help, histogram buckets)
+    'downloader_request_duration_seconds': (
+        'histogram', 'Time from request start to response headers by route', LATENCY_BUCKETS),
+    'downloader_extraction_attempts_total': (
+        'counter', 'yt-dlp extraction attempts by platform, strategy and outcome', None),
+    'downloader_extraction_success_index_total': (
+        'counter', 'Position in the strategy ladder of the attempt that succeeded', None),
+    'downloader_upstream_responses_total': (
+        'counter', 'Upstream HTTP responses by host and status (error = no response)', None),
+    'downloader_rate_limit_rejections_total': (
+        'counter', 'Upstream requests failed fast by a host limiter', None),
+    'downloader_circuit_opened_total': (
+        'counter', 'Times a host circuit breaker opened', None),
+    'downloader_proxied_bytes_total': (
+        'counter', 'Bytes streamed to clients by route', None),
+    'downloader_ffmpeg_seconds': (
+        'histogram', 'ffmpeg wall time by merge mode and outcome', FFMPEG_BUCKETS),
+}
+
+def _label_string(labels):
+    return ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+
+def _series(name, labels):
+    return f'{name}{{{labels}}}' if labels else name
+
+def _worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_snapshot(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class Metrics:
+    """Counters and histograms for /metrics; each worker flushes to TEMP_DIR/metrics and a scrape merges them"""
+
+    def __init__(self, definitions, interval):
+        self.definitions = definitions
+        self.interval = interval
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+
+    def _directory(self):
+        return os.path.join(TEMP_DIR, 'metrics')
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+            self._thread.start()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_string(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+            self._ensure_thread()
+
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = (name, _label_string(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # one count per bucket plus +Inf, then the sum
+                histogram = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+            self._dirty = True
+            self._ensure_thread()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(h)] for (name, labels), h in self._histograms.items()],
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Metrics flush failed: {e}")
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        os.makedirs(self._directory(), exist_ok=True)
+        path = os.path.join(self._directory(), f'{_worker_name()}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def _worker_snapshots(self):
+        """This worker's live registry, the last flush of every other live worker and the dead workers' counters"""
+        snapshots = [self.snapshot()]
+        directory = self._directory()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            lock = open(os.path.join(directory, 'dead.lock'), 'a')
+        except OSError:
+            return snapshots
+        with lock:
+            # One scrape at a time, so a dead worker is folded in exactly once and never read twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead_path = os.path.join(directory, 'dead.json')
+            dead = _read_snapshot(dead_path) or {'counters': [], 'histograms': []}
+            host, folded = socket.gethostname(), []
+            for name in os.listdir(directory):
+                worker = name[:-len('.json')]
+                if not name.endswith('.json') or '-' not in worker or worker == _worker_name():
+                    continue
+                path = os.path.join(directory, name)
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                worker_host, pid = worker.rsplit('-', 1)
+                # Pids are only meaningful on our own host (containers sharing TEMP_DIR each have one)
+                if worker_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+                    # Counters must never go down, so a dead worker's totals are kept; its histograms are dropped
+                    totals = {(n, labels): value for n, labels, value in dead['counters']}
+                    for n, labels, value in snapshot['counters']:
+                        totals[(n, labels)] = totals.get((n, labels), 0) + value
+                    dead['counters'] = [[n, labels, value] for (n, labels), value in totals.items()]
+                    folded.append(path)
+                else:
+                    snapshots.append(snapshot)
+            if folded:
+                with open(f'{dead_path}.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(dead, f)
+                os.replace(f'{dead_path}.tmp', dead_path)
+                for path in folded:
+                    os.remove(path)
+        snapshots.append(dead)
+        return snapshots
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of every worker's metrics plus scrape-time gauges"""
+        counters, histograms = {}, {}
+        for snapshot in self._worker_snapshots():
+            for name, labels, value in snapshot['counters']:
+                counters[(name, labels)] = counters.get((name, labels), 0) + value
+            for name, labels, values in snapshot['histograms']:
+                merged = histograms.setdefault((name, labels), [0] * len(values))
+                for index, value in enumerate(values):
+                    merged[index] += value
+
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (series, labels), value in sorted(counters.items()):
+                    if series == name:
+                        lines.append(f'{_series(name, labels)} {value}')
+                continue
+            for (series, labels), values in sorted(histograms.items()):
+                if series != name:
+                    continue
+                prefix = f'{labels},' if labels else ''
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{_series(name + "_sum", labels)} {values[-1]}')
+                lines.append(f'{_series(name + "_count", labels)} {cumulative}')
+        for name, help_text, samples in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                lines.append(f'{_series(name, _label_string(labels))} {value}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics(METRIC_DEFINITIONS, METRICS_FLUSH_INTERVAL)
+
+def count_proxied_bytes(route, sent, counted):
+    """Report bytes sent since the last mark to the proxied-bytes counter; returns the new mark"""
+    if sent > counted:
+        METRICS.inc('downloader_proxied_bytes_total', sent - counted, route=route)
+    return sent
+
+# SERVER-TIMING SPANS (where a slow request spent its time)
+class ServerTiming:
+    """Named spans for one request, sent back as a Server-Timing header (`desc` tells repeated names apart)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, seconds, desc=None):
+        self.spans.append((name, seconds, desc))  # list.append is atomic, spans may come from helper threads
+
+    def header(self):
+        entries = []
+        for name, seconds, desc in list(self.spans):
+            entry = f'{name};dur={seconds * 1000:.1f}'
+            if desc is not None:
+                entry += ';desc="{}"'.format(str(desc).replace('"', "'"))
+            entries.append(entry)
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+# The current request's spans; unset outside requests (jobs, batch threads), where span() does nothing
+CURRENT_TIMING = contextvars.ContextVar('server_timing', default=None)
+
+def add_span(name, seconds, desc=None):
+    timing = CURRENT_TIMING.get()
+    if timing is not None:
+        timing.add(name, seconds, desc)
+
+@contextmanager
+def span(name, desc=None):
+    timing = CURRENT_TIMING.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started, desc)
+
+def submit_timed(executor, name, desc, fn, *args):
+    """executor.submit() that records fn's run time as a span of the submitting request"""
+    timing = CURRENT_TIMING.get()
+
+    def run():
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if timing is not None:
+                timing.add(name, time.perf_counter() - started, desc)
+
+    return executor.submit(run)
+
+def log_send_timing(response, label):
+    """Add a 'send' span once the body is out and log the whole breakdown.
+
+    Headers are gone by then, so the full picture (including the send) only
+    reaches the log, not the Server-Timing header.
+    """
+    timing = CURRENT_TIMING.get()
+    if timing is None:
+        return response
+    started = time.perf_counter()
+
+    def finished():
+        timing.add('send', time.perf_counter() - started)
+        print(f"⏱️ {label}: {timing.header()}")
+
+    return cleanup_on_close(response, finished)
+
+# SAMPLING PROFILER (opt-in at runtime, collapsed stacks for flame graphs)
+# Runtime settings live in TEMP_DIR/profiler.json so every worker picks them up without a restart
+PROFILER_SAMPLE_INTERVAL = float(os.environ.get('PROFILER_SAMPLE_INTERVAL', 0.005))
+PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP', 50))
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN', '')  # /profiler is disabled until this is set
+PROFILER_MIN_INTERVAL = 0.001
+PROFILER_MAX_EVERY = 1000000
+
+class SamplingProfiler:
+    """Samples the stacks of every `every`-th request into TEMP_DIR/profiles/*.folded"""
+
+    def __init__(self):
+        self.every = 0
+        self.interval = PROFILER_SAMPLE_INTERVAL
+        self._settings_checked = 0.0
+        self._settings_mtime = None
+        self._requests = 0
+        self._active = {}  # thread id -> {stack: count}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.profiles_written = 0
+
+    def _settings_path(self):
+        return os.path.join(TEMP_DIR, 'profiler.json')
+
+    def directory(self):
+        return os.path.join(TEMP_DIR, 'profiles')
+
+    def _refresh_settings(self):
+        now = time.monotonic()
+        if now - self._settings_checked < 1.0:
+            return
+        self._settings_checked = now
+        try:
+            mtime = os.stat(self._settings_path()).st_mtime
+        except OSError:
+            self.every = 0
+            return
+        if mtime != self._settings_mtime:
+            try:
+                with open(self._settings_path(), encoding='utf-8') as f:
+                    settings = json.load(f)
+                self.every, self.interval = self.clamp(settings.get('every'), settings.get('interval'))
+                self._settings_mtime = mtime
+            except (OSError, ValueError, TypeError, OverflowError):
+                pass
+
+    @staticmethod
+    def clamp(every, interval):
+        """(every, interval) bounded so a bad setting can't make the sampler spin"""
+        every = min(max(int(every or 0), 0), PROFILER_MAX_EVERY)
+        interval = min(max(PROFILER_MIN_INTERVAL, float(interval or PROFILER_SAMPLE_INTERVAL)), 1.0)
+        return every, interval
+
+    def configure(self, every, interval=None):
+        """Turn sampling on (every N-th request) or off (0) for all workers"""
+        every, interval = self.clamp(every, interval)
+        settings = {'every': every, 'interval': interval}
+        tmp = f'{self._settings_path()}.{os.getpid()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(tmp, self._settings_path())
+        self._settings_checked = 0.0
+        self._refresh_settings()
+        return settings
+
+    def start(self):
+        """Profile the calling thread if this request is sampled; returns a token for stop()"""
+        if not PROFILER_TOKEN:
+            return None
+        self._refresh_settings()
+        if not self.every:
+            return None
+        with self._cond:
+            self._requests += 1
+            if self._requests % self.every:
+                return None
+            ident = threading.get_ident()
+            self._active[ident] = {'#': self._requests}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return ident
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                idents = list(self._active)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                with self._cond:
+                    counts = self._active.get(ident)
+                    if counts is not None:
+                        counts[key] = counts.get(key, 0) + 1
+            del frames
+            time.sleep(self.interval)
+
+    def stop(self, ident, label):
+        """Stop sampling a thread and write its folded stacks; returns the file name or None"""
+        with self._cond:
+            counts = self._active.pop(ident, None)
+        if not counts:
+            return None
+        number = counts.pop('#')
+        if not counts:
+            return None
+        os.makedirs(self.directory(), exist_ok=True)
+        name = '{}-{}-{}-{}.folded'.format(
+            time.strftime('%Y%m%dT%H%M%S'), re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_') or 'root',
+            os.getpid(), number)
+        path = os.path.join(self.directory(), name)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f'{stack} {count}\n')
+        os.replace(f'{path}.tmp', path)
+        self.profiles_written += 1
+        # Keep the newest PROFILER_KEEP dumps
+        dumps = sorted(entry for entry in os.listdir(self.directory()) if entry.endswith('.folded'))
+        for old in dumps[:-PROFILER_KEEP]:
+            try:
+                os.remove(os.path.join(self.directory(), old))
+            except OSError:
+                pass
+        print(f"🔬 Profile written: {name} ({sum(counts.values())} samples)")
+        return name
+
+PROFILER = SamplingProfiler()
+
+# SHARED POOLED HTTP CLIENT (keep-alive for googlevideo/fbcdn/cdninstagram)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+# host suffix=connections kept alive per upstream host
+HTTP_POOL_SIZES = dict(
+    (host.strip(), int(size))
+    for host, size in (
+        item.split('=') for item in os.environ.get(
+            'HTTP_POOL_SIZES', 'googlevideo.com=32,fbcdn.net=16,cdninstagram.com=16,pinimg.com=8'
+        ).split(',') if item.strip()
+    )
+)
+
+class _CountingPoolMixin:
+    """Counts new TCP(+TLS) connections opened by a urllib3 host pool"""
+    stats = None
+
+    def _new_conn(self):
+        with self.stats['lock']:
+            self.stats['connections'] += 1
+        return super()._new_conn()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose host pools report connection churn into `stats`"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (_CountingPoolMixin, HTTPConnectionPool), {'stats': stats}),
+            'https': type('CountingHTTPSConnectionPool', (_CountingPoolMixin, HTTPSConnectionPool), {'stats': stats}),
+        }
+
+    def send(self, request, **kwargs):
+        with self.stats['lock']:
+            self.stats['requests'] += 1
+        return super().send(request, **kwargs)
+
+def _new_http_session(pool_size):
+    stats = {'lock': threading.Lock(), 'requests': 0, 'connections': 0, 'pool_size': pool_size}
+    session = requests.Session()
+    # Sessions are shared across threads; never let upstream Set-Cookie leak between requests
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = PooledHTTPAdapter(stats, pool_connections=64, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session, stats
+
+HTTP_SESSIONS = {host: _new_http_session(size) for host, size in HTTP_POOL_SIZES.items()}
+HTTP_SESSIONS['default'] = _new_http_session(HTTP_POOL_SIZE)
+
+def http_session_for(url):
+    host = (urlparse(url).hostname or '').lower()
+    for suffix, entry in HTTP_SESSIONS.items():
+        if host == suffix or host.endswith('.' + suffix):
+            return entry[0]
+    return HTTP_SESSIONS['default'][0]
+
+def http_request(method, url, headers=None, read_timeout=HTTP_READ_TIMEOUT, stream=True, **kwargs):
+    """Send a request through the shared keep-alive pool for the URL's host.
+
+    Every request takes a token from the host's limiter first and reports
+    its outcome back, so a 429 or Retry-After seen by one thread slows every
+    thread talking to that host. Raises HostThrottled instead of waiting
+    longer than RATE_LIMIT_MAX_WAIT. Streamed responses must be fully read
+    or close()d to hand their connection back to the pool.
+    """
+    limiter = HOST_LIMITS.for_url(url)
+    limiter.acquire()
+    try:
+        response = http_session_for(url).request(
+            method,
+            url,
+            headers=headers,
+            stream=stream,
+            timeout=(HTTP_CONNECT_TIMEOUT, read_timeout),
+            allow_redirects=True,
+            **kwargs
+        )
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        limiter.record(failed=True)
+        METRICS.inc('downloader_upstream_responses_total', host=limiter.label, status='error')
+        raise
+    limiter.record(response.status_code, response.headers.get('Retry-After'))
+    METRICS.inc('downloader_upstream_responses_total', host=limiter.label, status=response.status_code)
+    return response
+
+def http_get(url, headers=None, read_timeout=HTTP_READ_TIMEOUT, stream=True, **kwargs):
+    return http_request('GET', url, headers=headers, read_timeout=read_timeout, stream=stream, **kwargs)
+
+def http_pool_stats():
+    result = {}
+    for host, (_, stats) in HTTP_SESSIONS.items():
+        with stats['lock']:
+            result[host] = {
+                'pool_size': stats['pool_size'],
+                'requests': stats['requests'],
+                'connections_opened': stats['connections'],
+                'connections_reused': max(stats['requests'] - stats['connections'], 0),
+            }
+    return result
+
+# PER-HOST RATE LIMITS AND CIRCUIT BREAKERS (back off when upstream asks, without parking threads)
+# host suffix=requests per second:burst; unlisted hosts get RATE_LIMIT_DEFAULT each
+RATE_LIMITS = dict(
+    (host.strip(), tuple(float(v) for v in limit.split(':')))
+    for host, limit in (
+        item.split('=') for item in os.environ.get(
+            'RATE_LIMITS',
+            'googlevideo.com=200:400,youtube.com=5:10,instagram.com=2:5,cdninstagram.com=20:40,'
+            'facebook.com=2:5,fbcdn.net=20:40,pinterest.com=3:6,pinimg.com=20:40'
+        ).split(',') if item.strip()
+    )
+)
+RATE_LIMIT_DEFAULT = tuple(float(v) for v in os.environ.get('RATE_LIMIT_DEFAULT', '10:20').split(':'))
+# Longest a request thread waits for a token; beyond that it fails fast with 503 + Retry-After
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 2.0))
+RATE_LIMIT_MAX_HOSTS = int(os.environ.get('RATE_LIMIT_MAX_HOSTS', 1024))
+# Consecutive throttles/failures that open a host's breaker, and how long it stays open
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 30))
+BREAKER_MAX_COOLDOWN = float(os.environ.get('BREAKER_MAX_COOLDOWN', 300))
+# yt-dlp talks to the sites itself, so extraction is limited per platform under the site's host
+PLATFORM_HOSTS = {'youtube': 'youtube.com', 'insta': 'instagram.com', 'facebook': 'facebook.com',
+                  'pinterest': 'pinterest.com'}
+
+class HostThrottled(Exception):
+    """A host's limiter would make the caller wait longer than it is allowed to"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f'{host} is rate limiting us, retry in {retry_after:.0f}s')
+        self.host = host
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), BREAKER_MAX_COOLDOWN)
+
+class HostLimiter:
+    """Token bucket plus circuit breaker for one upstream host; blocks are shared by all workers under TEMP_DIR"""
+
+    def __init__(self, key, rate, burst, label=None):
+        self.key = key
+        self.label = label or key  # metrics label; unlisted hosts share one
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.state = 'closed'  # closed -> open -> half_open -> closed
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self._lock = threading.Lock()
+        self._shared_mtime = None
+        self.granted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.errors = 0
+        self.opened = 0
+
+    def _shared_path(self):
+        return os.path.join(TEMP_DIR, 'limits', self.key)
+
+    def _load_shared(self):
+        try:
+            mtime = os.stat(self._shared_path()).st_mtime
+            if mtime == self._shared_mtime:
+                return
+            with open(self._shared_path(), encoding='utf-8') as f:
+                shared = json.load(f)
+            self._shared_mtime = mtime
+        except (OSError, ValueError):
+            return
+        if shared['blocked_until'] > self.blocked_until:
+            self.blocked_until = shared['blocked_until']
+            if shared['open']:
+                self.state = 'open'
+
+    def _store_shared(self):
+        path = self._shared_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.{os.getpid()}', 'w', encoding='utf-8') as f:
+                json.dump({'blocked_until': self.blocked_until, 'open': self.state == 'open'}, f)
+            os.replace(f'{path}.{os.getpid()}', path)
+        except OSError as e:
+            print(f"⚠️ Could not share rate limit for {self.key}: {e}")
+
+    def reserve(self, max_wait=None):
+        """Take a token; returns how long to wait before sending, or raises HostThrottled"""
+        max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        with self._lock:
+            self._load_shared()
+            now = time.time()
+            if self.state == 'open':
+                if now < self.blocked_until:
+                    self.rejected += 1
+                    METRICS.inc('downloader_rate_limit_rejections_total', host=self.label)
+                    raise HostThrottled(self.key, self.blocked_until - now)
+                self.state = 'half_open'
+
+            mono = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (mono - self.updated) * self.rate)
+            self.updated = mono
+            wait = max(0.0, (1 - self.tokens) / self.rate, self.blocked_until - now)
+            if wait > max_wait:
+                self.rejected += 1
+                METRICS.inc('downloader_rate_limit_rejections_total', host=self.label)
+                raise HostThrottled(self.key, wait)
+            self.tokens -= 1
+            self.granted += 1
+            if wait > 0:
+                self.delayed += 1
+            return wait
+
+    def acquire(self, max_wait=None):
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            with span('ratelimit', self.key):
+                time.sleep(wait)
+
+    def record(self, status=None, retry_after=None, failed=False):
+        """Feed back a response status (or a connection failure) from this host"""
+        failed = failed or status == 429 or (status or 0) >= 500
+        with self._lock:
+            if not failed:
+                if self.state != 'closed' or self.failures:
+                    if self.state != 'closed':
+                        print(f"✅ Circuit closed for {self.key}")
+                    self.state, self.failures, self.cooldown = 'closed', 0, BREAKER_COOLDOWN
+                return
+
+            if status:
+                self.throttled += 1
+            else:
+                self.errors += 1
+            self.failures += 1
+            backoff = parse_retry_after(retry_after)
+            if backoff is None:
+                backoff = min(0.5 * 2 ** (self.failures - 1), BREAKER_MAX_COOLDOWN) * random.uniform(0.5, 1.0)
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= BREAKER_THRESHOLD):
+                if self.state == 'half_open':
+                    self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+                self.state = 'open'
+                self.opened += 1
+                METRICS.inc('downloader_circuit_opened_total', host=self.label)
+                backoff = max(backoff, self.cooldown)
+                print(f"🧯 Circuit open for {self.key} for {backoff:.0f}s after {self.failures} failures")
+            self.blocked_until = max(self.blocked_until, time.time() + backoff)
+            self._store_shared()
+
+    def idle(self):
+        with self._lock:
+            return self.state == 'closed' and not self.failures and self.blocked_until < time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate), 2),
+                'blocked_for': round(max(self.blocked_until - time.time(), 0.0), 1),
+                'consecutive_failures': self.failures,
+                'granted': self.granted,
+                'delayed': self.delayed,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'opened': self.opened,
+            }
+
+class HostLimits:
+    """HostLimiter per configured host suffix, or per hostname for everything else"""
+
+    def __init__(self, limits, default, max_hosts):
+        self.limits = limits
+        self.default = default
+        self.max_hosts = max_hosts
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, limit, label=None):
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                if len(self._limiters) >= self.max_hosts:
+                    # Forget hosts with nothing to remember before growing further
+                    for stale in [k for k, v in self._limiters.items() if v.idle()]:
+                        del self._limiters[stale]
+                limiter = self._limiters[key] = HostLimiter(key, *limit, label=label)
+            return limiter
+
+    def for_url(self, url):
+        host = (urlparse(url).hostname or '').lower()
+        for suffix, limit in self.limits.items():
+            if host == suffix or host.endswith('.' + suffix):
+                return self._get(suffix, limit)
+        return self._get(host, self.default, label='other')
+
+    def for_platform(self, platform):
+        host = PLATFORM_HOSTS.get(platform, platform)
+        return self._get(host, self.limits.get(host, self.default), label=host if host in self.limits else 'other')
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.key: limiter.stats() for limiter in limiters}
+
+HOST_LIMITS = HostLimits(RATE_LIMITS, RATE_LIMIT_DEFAULT, RATE_LIMIT_MAX_HOSTS)
+
+def ydl_throttled(error):
+    """True when a yt-dlp error means the site is rate limiting or bot-checking us"""
+    message = str(error)
+    return 'HTTP Error 429' in message or 'Too Many Requests' in message or 'not a bot' in message
+
+def throttled_response(error):
+    """503 with Retry-After for a request a host limiter refused"""
+    retry_after = max(int(error.retry_after + 0.999), 1)
+    print(f"🧯 {error}")
+    return jsonify({'error': str(error), 'retry_after': retry_after}), 503, {'Retry-After': str(retry_after)}
+
+# PARALLEL SEGMENTED RANGE DOWNLOADER (googlevideo throttles per connection)
+def _parse_size(value):
+    value = value.strip().upper()
+    for suffix, factor in (('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+# host suffix=connections:segment_size; hosts not listed download over one connection
+SEGMENT_HOSTS = dict(
+    (host.strip(), (int(conns), _parse_size(size)))
+    for host, conns, size in (
+        (item.split('=')[0], *item.split('=')[1].split(':')) for item in os.environ.get(
+            'SEGMENT_HOSTS', 'googlevideo.com=4:4M,fbcdn.net=4:4M,cdninstagram.com=4:4M'
+        ).split(',') if item.strip()
+    )
+)
+SEGMENT_RETRIES = int(os.environ.get('SEGMENT_RETRIES', 3))
+
+def segment_settings(url):
+    """(connections, segment_size) for a URL's host, or None if not segmented"""
+    host = (urlparse(url).hostname or '').lower()
+    for suffix, settings in SEGMENT_HOSTS.items():
+        if (host == suffix or host.endswith('.' + suffix)) and settings[0] > 1:
+            return settings
+    return None
+
+def _range_headers(headers, start, end):
+    return {**headers, 'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+
+def open_download(url, headers, read_timeout=HTTP_READ_TIMEOUT):
+    """Open a download, probing with the first segment when the host is segmented.
+
+    Returns (response, total). For segmented hosts the request asks for the
+    first segment only; a 206 with a Content-Range total means the rest can
+    be fetched in parallel (total is set and the response body is segment 0).
+    Otherwise total is None and the response is a plain GET.
+    """
+    settings = segment_settings(url)
+    if not settings:
+        return http_get(url, headers=headers, read_timeout=read_timeout), None
+    _, segment_size = settings
+    response = http_get(url, headers=_range_headers(headers, 0, segment_size - 1), read_timeout=read_timeout)
+    match = re.match(r'bytes 0-\d+/(\d+)', response.headers.get('Content-Range', ''))
+    if response.status_code == 206 and match:
+        return response, int(match.group(1))
+    return response, None
+
+def _segments(total, segment_size):
+    """Byte ranges after segment 0, which the probe response already carries"""
+    return [(start, min(start + segment_size, total) - 1) for start in range(segment_size, total, segment_size)]
+
+def fetch_segment(url, headers, start, end, sink, read_timeout=HTTP_READ_TIMEOUT, stop=None):
+    """Fetch bytes [start, end] into sink(offset, chunk), resuming after failures.
+
+    A dropped connection retries only the bytes of this segment not yet
+    received, so one bad segment never restarts the whole transfer. Setting
+    the `stop` event abandons the segment at the next chunk.
+    """
+    offset = start
+    for attempt in range(SEGMENT_RETRIES + 1):
+        if stop is not None and stop.is_set():
+            return
+        try:
+            with http_get(url, headers=_range_headers(headers, offset, end), read_timeout=read_timeout) as r:
+                if r.status_code != 206 or not r.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                    raise IOError(f'segment {start}-{end}: unexpected status {r.status_code}')
+                for chunk in r.iter_content(chunk_size=65536):
+                    if stop is not None and stop.is_set():
+                        return  # leaving the with block closes r
+                    if chunk:
+                        sink(offset, chunk)
+                        offset += len(chunk)
+            if offset > end:
+                return
+            raise IOError(f'segment {start}-{end}: short read at {offset}')
+        except HostThrottled:
+            raise
+        except Exception as e:
+            if attempt == SEGMENT_RETRIES:
+                raise
+            print(f"🔁 Segment {start}-{end} retry {attempt + 1}: {e}")
+
+def download_segments_to_file(url, headers, path, first_response, total, read_timeout=HTTP_READ_TIMEOUT,
+                              on_bytes=None):
+    """Parallel Range download into a preallocated file. Returns bytes written.
+
+    on_bytes(count) is called for every chunk written, from any segment thread.
+    """
+    connections, segment_size = segment_settings(url)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, total)
+
+        def sink(offset, chunk):
+            os.pwrite(fd, chunk, offset)
+            if on_bytes:
+                on_bytes(len(chunk))
+
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=connections)
+        futures = [
+            executor.submit(fetch_segment, url, headers, start, end, sink, read_timeout, stop)
+            for start, end in _segments(total, segment_size)
+        ]
+        try:
+            # Segment 0 streams in on the probe connection while the rest run in parallel
+            offset = 0
+            with first_response:
+                for chunk in first_response.iter_content(chunk_size=65536):
+                    if chunk:
+                        sink(offset, chunk)
+                        offset += len(chunk)
+            if offset != min(segment_size, total):
+                fetch_segment(url, headers, offset, min(segment_size, total) - 1, sink, read_timeout)
+            for future in futures:
+                future.result()
+        except Exception:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            # Running segments still hold fd; wait for them before closing it
+            executor.shutdown(wait=True)
+    finally:
+        os.close(fd)
+    return total
+
+def iter_segments(url, headers, first_response, total, read_timeout=HTTP_READ_TIMEOUT):
+    """Yield a file in order while fetching up to `connections` segments ahead.
+
+    Memory is bounded by connections x segment_size.
+    """
+    connections, segment_size = segment_settings(url)
+
+    stop = threading.Event()
+
+    def fetch_bytes(start, end):
+        buf = bytearray()
+        fetch_segment(url, headers, start, end, lambda offset, chunk: buf.extend(chunk), read_timeout, stop)
+        return bytes(buf)
+
+    ranges = iter(_segments(total, segment_size))
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=connections)
+
+    def submit_next():
+        segment = next(ranges, None)
+        if segment:
+            pending.append(executor.submit(fetch_bytes, *segment))
+
+    try:
+        for _ in range(connections):
+            submit_next()
+        sent = 0
+        with first_response:
+            for chunk in first_response.iter_content(chunk_size=65536):
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+        if sent != min(segment_size, total):
+            yield fetch_bytes(sent, min(segment_size, total) - 1)
+        while pending:
+            data = pending.popleft().result()
+            submit_next()
+            yield data
+    finally:
+        # The client may be gone: drop queued segments and end running ones at their next chunk
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# CONTENT-ADDRESSED ARTIFACT CACHE (finished downloads and merges)
+TEMP_DIR = os.environ.get('TEMP_DIR', tempfile.gettempdir())
+ARTIFACT_CACHE_DIR = os.environ.get('ARTIFACT_CACHE_DIR', os.path.join(TEMP_DIR, 'artifacts'))
+ARTIFACT_CACHE_MAX_BYTES = _parse_size(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', '2G'))
+
+def canonical_media_key(url):
+    """Stable identity of an upstream media file across re-signed URLs, or None.
+
+    googlevideo URLs are re-signed on every extraction, but itag + clen + lmt
+    (format, byte length, encode timestamp) pin down the exact file. fbcdn /
+    cdninstagram paths are content-addressed already. Anything else is only
+    reusable for the exact same URL.
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if host.endswith('googlevideo.com'):
+        query = parse_qs(parsed.query)
+        if not all(query.get(k) for k in ('itag', 'clen', 'lmt')):
+            return None
+        return f"googlevideo:{query['itag'][0]}:{query['clen'][0]}:{query['lmt'][0]}"
+    if host.endswith(('fbcdn.net', 'cdninstagram.com')):
+        return f'fbcdn:{parsed.path}'
+    return url
+
+class ArtifactCache:
+    """Byte-budgeted, content-addressed LRU of finished files on disk, shared by all workers (recency in mtimes)"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.publishes = 0
+        self.evictions = 0
+        self.bytes_cached = 0
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(*parts):
+        """Digest of a cache key; None if any part has no stable identity"""
+        if any(part is None for part in parts):
+            return None
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def _meta_path(self, digest):
+        return os.path.join(self.root, f'{digest}.json')
+
+    def lookup(self, digest):
+        """Return (path, meta) for a cached artifact and mark it recently used"""
+        if not (self.enabled and digest):
+            return None, None
+        try:
+            with open(self._meta_path(digest), encoding='utf-8') as f:
+                meta = json.load(f)
+            path = os.path.join(self.root, meta['file'])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None, None
+        with self._lock:
+            self.hits += 1
+        return path, meta
+
+    def temp_path(self, ext):
+        """A path inside the cache dir to write a future artifact to (same filesystem for rename)"""
+        fd, path = tempfile.mkstemp(dir=self.root, prefix='.partial-', suffix=f'.{ext}')
+        os.close(fd)
+        return path
+
+    def publish(self, digest, src_path, download_name, mimetype=None):
+        """Move a finished file into the cache. Returns its cached path, or None if not cached.
+
+        On success src_path no longer exists; on None it is left untouched.
+        """
+        if not (self.enabled and digest):
+            return None
+        try:
+            size = os.path.getsize(src_path)
+            if size > self.max_bytes:
+                return None
+            ext = os.path.splitext(download_name)[1].lstrip('.') or 'bin'
+            name = f'{digest}.{ext}'
+            path = os.path.join(self.root, name)
+            if os.path.dirname(os.path.abspath(src_path)) != os.path.abspath(self.root):
+                # Stage next to the target first; rename is only atomic within a filesystem
+                staged = self.temp_path(ext)
+                shutil.copyfile(src_path, staged)
+                os.replace(staged, path)
+                self.discard(src_path)
+            else:
+                os.replace(src_path, path)
+            meta = {'file': name, 'download_name': download_name, 'mimetype': mimetype, 'size': size}
+            meta_tmp = self.temp_path('json')
+            with open(meta_tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_tmp, self._meta_path(digest))
+        except OSError as e:
+            print(f"Artifact cache publish error: {e}")
+            return None
+        with self._lock:
+            self.publishes += 1
+        print(f"📦 Cached artifact {digest[:12]} ({sizeof_fmt(size)})")
+        self.enforce_budget()
+        return path
+
+    def annotate(self, path, **fields):
+        """Add fields to a published artifact's sidecar"""
+        meta_path = self._meta_path(os.path.splitext(os.path.basename(path))[0])
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta.update(fields)
+            meta_tmp = self.temp_path('json')
+            with open(meta_tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_tmp, meta_path)
+        except (OSError, ValueError) as e:
+            print(f"Artifact cache annotate error: {e}")
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def enforce_budget(self, max_bytes=None):
+        """Evict least-recently-used artifacts until the cache fits its byte budget"""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.root) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith('.partial-'):
+                    # Abandoned by a crashed writer
+                    if now - stat.st_mtime > 3600:
+                        self.discard(entry.path)
+                    continue
+                if entry.name.endswith('.json'):
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        evicted = 0
+        while total > max_bytes and entries:
+            _, size, path = entries.pop(0)
+            self.discard(path)
+            self.discard(self._meta_path(os.path.splitext(os.path.basename(path))[0]))
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+            self.bytes_cached = total
+
+    def send(self, path, meta, download_name=None):
+        """send_file with the digest as a strong ETag.
+
+        Conditional and Range handling only applies to GET/HEAD, so POST
+        routes also point at the GET /artifacts/<digest> URL for revalidation
+        and resumed downloads.
+        """
+        digest = os.path.splitext(os.path.basename(path))[0]
+        response = send_file(
+            path,
+            as_attachment=True,
+            download_name=download_name or meta.get('download_name') or os.path.basename(path),
+            mimetype=meta.get('mimetype'),
+            conditional=True,
+            etag=digest,
+        )
+        response.headers['Content-Location'] = f'/artifacts/{digest}'
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_bytes': self.max_bytes,
+                'bytes_cached': self.bytes_cached,
+                'hits': self.hits,
+                'misses': self.misses,
+                'publishes': self.publishes,
+                'evictions': self.evictions,
+            }
+
+ARTIFACTS = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
+
+# PER-REQUEST WORK DIRECTORIES
+def make_work_dir(prefix):
+    """Private scratch directory for one request, under TEMP_DIR"""
+    return tempfile.mkdtemp(prefix=prefix, dir=TEMP_DIR)
+
+def cleanup_on_close(response, func):
+    """Run func once the server has finished sending response"""
+    if not response.direct_passthrough:
+        response.call_on_close(func)
+        return response
+    # Passthrough bodies (send_file's wsgi.file_wrapper) go straight to the server, which only calls
+    # their close(). Patch that on the same object so gunicorn can still sendfile() it
+    body = response.response
+    close = getattr(body, 'close', None)
+
+    def closing():
+        try:
+            if close is not None:
+                close()
+        finally:
+            func()
+
+    try:
+        body.close = closing
+    except AttributeError:  # generators
+        response.response = ClosingIterator(body, func)
+    return response
+
+# JANITOR (one thread owns every pending temp-file deletion)
+JANITOR_INTERVAL = float(os.environ.get('JANITOR_INTERVAL', 30))
+# Fraction of the TEMP_DIR filesystem in use that triggers early reclamation
+JANITOR_HIGH_WATER = float(os.environ.get('JANITOR_HIGH_WATER', 0.9))
+# Work dirs older than this with no pending entry were orphaned by a dead worker
+JANITOR_ORPHAN_AGE = float(os.environ.get('JANITOR_ORPHAN_AGE', 6 * 3600))
+WORK_DIR_PREFIXES = ('ytdl-', 'merge-', 'dl-', 'job-')
+
+class Janitor:
+    """Time-ordered heap of paths to delete; a held path is deleted when its last holder releases it"""
+
+    def __init__(self, root, high_water, interval):
+        self.root = root
+        self.high_water = high_water
+        self.interval = interval
+        self._heap = []
+        self._seq = 0
+        self._holds = {}
+        self._deferred = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.scheduled = 0
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        self.high_water_sweeps = 0
+        self.orphans_removed = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+            self._thread.start()
+
+    def schedule(self, path, delay=0):
+        """Delete path (file or directory) after delay seconds"""
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, path))
+            self.scheduled += 1
+            self._ensure_thread()
+            self._cond.notify()
+
+    def hold(self, path):
+        with self._cond:
+            self._holds[path] = self._holds.get(path, 0) + 1
+
+    def release(self, path):
+        with self._cond:
+            count = self._holds.get(path, 0) - 1
+            if count > 0:
+                self._holds[path] = count
+                return
+            self._holds.pop(path, None)
+            if path in self._deferred:
+                self._deferred.discard(path)
+                self._push_now(path)
+
+    def _push_now(self, path):
+        self._seq += 1
+        heapq.heappush(self._heap, (time.monotonic(), self._seq, path))
+        self._ensure_thread()
+        self._cond.notify()
+
+    def pin(self, response, path):
+        """Hold path until response has been fully sent"""
+        self.hold(path)
+        return cleanup_on_close(response, lambda: self.release(path))
+
+    def delete_after(self, response, path):
+        """Delete path as soon as response has been fully sent"""
+        self.hold(path)  # before scheduling, so the janitor can never see it unheld
+        self.schedule(path)
+        return cleanup_on_close(response, lambda: self.release(path))
+
+    def _run(self):
+        last_sweep = 0.0
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                wait = self.interval - (now - last_sweep)
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                if wait > 0:
+                    self._cond.wait(wait)
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, path = heapq.heappop(self._heap)
+                    if self._holds.get(path):
+                        self._deferred.add(path)
+                    else:
+                        due.append(path)
+            for path in due:
+                self._remove(path)
+            if time.monotonic() - last_sweep >= self.interval:
+                last_sweep = time.monotonic()
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Janitor sweep error: {e}")
+
+    def _remove(self, path):
+        size = 0
+        try:
+            if os.path.isdir(path):
+                for dirpath, _, filenames in os.walk(path):
+                    for name in filenames:
+                        try:
+                            size += os.path.getsize(os.path.join(dirpath, name))
+                        except OSError:
+                            pass
+                shutil.rmtree(path)
+            else:
+                size = os.path.getsize(path)
+                os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Cleanup error: {e}")
+            return
+        print(f"🧹 Cleaned up: {path} ({sizeof_fmt(size)})")
+        with self._cond:
+            self.reclaimed_files += 1
+            self.reclaimed_bytes += size
+
+    def disk_usage(self):
+        usage = shutil.disk_usage(self.root)
+        return usage.used / usage.total if usage.total else 0.0
+
+    def sweep(self):
+        """Reap orphaned work dirs; above the high-water mark, reclaim early"""
+        now = time.time()
+        with self._cond:
+            pending = {path for _, _, path in self._heap} | set(self._holds)
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.name.startswith(WORK_DIR_PREFIXES) or entry.path in pending:
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > JANITOR_ORPHAN_AGE:
+                        self._remove(entry.path)
+                        with self._cond:
+                            self.orphans_removed += 1
+                except OSError:
+                    pass
+
+        if self.disk_usage() < self.high_water:
+            return
+        with self._cond:
+            self.high_water_sweeps += 1
+            # Drop every pending deletion that nobody is reading any more
+            early = [path for _, _, path in self._heap if not self._holds.get(path)]
+            self._heap = [item for item in self._heap if self._holds.get(item[2])]
+            heapq.heapify(self._heap)
+        print(f"🚨 Disk above {self.high_water:.0%} high-water mark, reclaiming early")
+        for path in early:
+            self._remove(path)
+        usage = self.disk_usage()
+        if usage >= self.high_water and ARTIFACTS.enabled:
+            # Still over: shrink the artifact cache by the overshoot
+            total = shutil.disk_usage(self.root).total
+            overshoot = int((usage - self.high_water) * total)
+            ARTIFACTS.enforce_budget(max(ARTIFACTS.bytes_cached - overshoot, 0))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._heap),
+                'held': len(self._holds),
+                'deferred': len(self._deferred),
+                'scheduled': self.scheduled,
+                'reclaimed_files': self.reclaimed_files,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'high_water': self.high_water,
+                'high_water_sweeps': self.high_water_sweeps,
+                'orphans_removed': self.orphans_removed,
+                'disk_usage': round(self.disk_usage(), 4),
+            }
+
+JANITOR = Janitor(TEMP_DIR, JANITOR_HIGH_WATER, JANITOR_INTERVAL)
+
+# LIVE PROGRESS (state files any worker, or the relay, can serve as Server-Sent Events)
+PROGRESS_DIR = os.path.join(TEMP_DIR, 'progress')
+# Minimum seconds between progress writes; phase changes always write
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 0.5))
+PROGRESS_POLL = float(os.environ.get('PROGRESS_POLL', 0.25))
+# Relay SSE streams end after this long and the client reconnects
+PROGRESS_STREAM_SECONDS = float(os.environ.get('PROGRESS_STREAM_SECONDS', 60))
+# EventSource reconnect delay; without the relay every event-stream request is one-shot
+PROGRESS_RETRY_MS = int(os.environ.get('PROGRESS_RETRY_MS', 1000))
+PROGRESS_TTL = float(os.environ.get('PROGRESS_TTL', 600))
+PROGRESS_ID_RE = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+def progress_path(op_id):
+    return os.path.join(PROGRESS_DIR, f'{op_id}.json')
+
+def read_progress(op_id):
+    try:
+        with open(progress_path(op_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def progress_finished(state):
+    return state['phase'] in ('done', 'failed')
+
+def progress_event_id(state):
+    return repr(state.get('updated_at'))
+
+def progress_event(state):
+    """One SSE event for a progress state; terminal states use their phase as the event name"""
+    event = state['phase'] if progress_finished(state) else 'progress'
+    return f"id: {progress_event_id(state)}\nevent: {event}\ndata: {json.dumps(state)}\n\n"
+
+class Progress:
+    """Progress of one operation, written to its state files at most every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, board=None, key=None):
+        self._board = board
+        self._key = key
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self.ids = []
+        self.state = {'phase': 'starting', 'streams': {}, 'ffmpeg': {}, 'error': None}
+
+    def attach(self, op_id):
+        with self._lock:
+            if op_id and op_id not in self.ids:
+                self.ids.append(op_id)
+                self._write()
+
+    def _write(self):
+        # Caller holds self._lock
+        self._last_write = time.monotonic()
+        if not self.ids:
+            return
+        state = self.state
+        state['updated_at'] = time.time()
+        streams = state['streams'].values()
+        state['bytes'] = sum(s['bytes'] for s in streams)
+        totals = [s['total'] for s in streams]
+        state['total'] = sum(totals) if totals and all(totals) else None
+        duration, position = state['ffmpeg'].get('duration'), state['ffmpeg'].get('out_seconds')
+        if state['phase'] in ('merging', 'transcoding') and duration and position is not None:
+            state['percent'] = round(min(100.0, 100.0 * position / duration), 1)
+        elif state['total']:
+            state['percent'] = round(100.0 * state['bytes'] / state['total'], 1)
+        else:
+            state['percent'] = None
+        try:
+            os.makedirs(PROGRESS_DIR, exist_ok=True)
+            payload = json.dumps(state)
+            for op_id in self.ids:
+                tmp = f'{progress_path(op_id)}.{threading.get_ident()}.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp, progress_path(op_id))
+        except OSError as e:
+            print(f"Progress write error: {e}")
+
+    def _maybe_write(self):
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self._write()
+
+    def phase(self, name, **fields):
+        with self._lock:
+            self.state['phase'] = name
+            self.state.update(fields)
+            self._write()
+
+    def start_stream(self, label, total=None):
+        """(Re)start a byte counter; retries reset it to zero"""
+        with self._lock:
+            self.state['streams'][label] = {'bytes': 0, 'total': total}
+            self._maybe_write()
+
+    def add_bytes(self, label, count):
+        with self._lock:
+            self.state['streams'].setdefault(label, {'bytes': 0, 'total': None})['bytes'] += count
+            self._maybe_write()
+
+    def set_bytes(self, label, done, total=None):
+        with self._lock:
+            self.state['streams'][label] = {'bytes': done or 0, 'total': total}
+            self._maybe_write()
+
+    def ffmpeg_duration(self, seconds):
+        with self._lock:
+            self.state['ffmpeg']['duration'] = float(seconds) if seconds else None
+
+    def ffmpeg_line(self, line):
+        """Feed one key=value line of ffmpeg's -progress output"""
+        key, _, value = line.decode(errors='replace').strip().partition('=')
+        with self._lock:
+            if key in ('out_time_us', 'out_time_ms'):
+                # Both are microseconds; out_time_ms is misnamed in ffmpeg
+                if value.isdigit():
+                    self.state['ffmpeg']['out_seconds'] = int(value) / 1e6
+            elif key == 'speed':
+                self.state['ffmpeg']['speed'] = value.rstrip('x') or None
+            elif key == 'progress':
+                self._maybe_write()
+
+    def finish(self, error=None):
+        with self._lock:
+            self.state['phase'] = 'failed' if error else 'done'
+            self.state['error'] = error
+            self._write()
+            ids = list(self.ids)
+        if self._board is not None:
+            self._board.release(self._key, self)
+        for op_id in ids:
+            JANITOR.schedule(progress_path(op_id), PROGRESS_TTL)
+
+class ProgressBoard:
+    """Progress trackers for operations in flight, keyed like their SingleFlight so coalesced waiters share one"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+
+    def track(self, key, op_id):
+        with self._lock:
+            progress = self._active.get(key) if key is not None else None
+            if progress is None:
+                progress = Progress(self, key)
+                if key is not None:
+                    self._active[key] = progress
+        progress.attach(op_id)
+        return progress
+
+    def release(self, key, progress):
+        with self._lock:
+            if key is not None and self._active.get(key) is progress:
+                del self._active[key]
+
+PROGRESS = ProgressBoard()
+
+def request_progress_id(data):
+    """Client-chosen progress id from a request body, if it is well-formed"""
+    op_id = (data or {}).get('progress_id')
+    return op_id if op_id and PROGRESS_ID_RE.fullmatch(str(op_id)) else None
+
+def run_ffmpeg(cmd, progress=None, timeout=300):
+    """subprocess.run() for ffmpeg that feeds -progress output to a tracker.
+
+    Returns (returncode, stderr). Raises subprocess.TimeoutExpired like
+    subprocess.run(timeout=...) does.
+    """
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    started = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        for line in proc.stdout:
+            if progress:
+                progress.ffmpeg_line(line)
+        proc.wait()
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    reader.join()
+    outcome = 'timeout' if timed_out.is_set() else 'ok' if proc.returncode == 0 else 'error'
+    METRICS.observe('downloader_ffmpeg_seconds', time.time() - started, mode='file', outcome=outcome)
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return proc.returncode, b''.join(stderr)
+
+def follow_ffmpeg_progress(read_fd, progress):
+    """Drain a -progress pipe into a tracker (pipe-mode merges)"""
+    with os.fdopen(read_fd, 'rb') as pipe:
+        for line in pipe:
+            if progress:
+                progress.ffmpeg_line(line)
+
 # SUPER ENHANCED YT-DLP CONFIG FOR ALL PLATFORMS
+# YouTube HLS/DASH formats (playable through /manifest). Off by default: the manifests cost extra
+# requests per extraction, and clients that download a format's `url` directly can't use them
+ADAPTIVE_FORMATS = os.environ.get('ADAPTIVE_FORMATS', '0') == '1'
+
 def get_enhanced_ydl_opts(platform='youtube'):
     """Enhanced yt-dlp options for all platforms with special YouTube optimizations"""
     
@@ -92,7 +1675,7 @@ def get_enhanced_ydl_opts(platform='youtube'):
             # YouTube anti-throttling
             'extractor_args': {
                 'youtube': {
-                    'skip': ['dash', 'hls'],
+                    'skip': [] if ADAPTIVE_FORMATS else ['dash', 'hls'],
                     'player_client': ['android', 'web'],
                     'player_skip': ['js'],
                 }
@@ -144,257 +1727,1494 @@ def get_enhanced_ydl_opts(platform='youtube'):
     
     return base_opts
 
-@app.route('/get_info', methods=['POST'])
-def get_info():
-    video_url = request.json.get('url')
-    if not video_url:
-        return jsonify({'error': 'No URL provided.'}), 400
+# URL NORMALISATION + PLATFORM DETECTION
+def detect_platform(video_url):
+    # Platform detection with enhanced logic
+    if "youtube.com" in video_url or "youtu.be" in video_url:
+        return 'youtube'
+    elif "instagram.com" in video_url:
+        return 'insta'
+    elif "facebook.com" in video_url or "fb.watch" in video_url:
+        return 'facebook'
+    elif "pinterest.com" in video_url:
+        return 'pinterest'
+    return 'other'
 
-    original_url = video_url
-    
+def normalize_video_url(video_url):
+    """Rewrite Shorts/youtu.be links and detect the platform.
+
+    Returns (video_url, platform, canonical_id). The canonical ID is the bare
+    YouTube video ID, or host+path for other platforms, so tracking params and
+    URL variants of the same video share one cache entry.
+    """
     # Enhanced URL preprocessing for ALL PLATFORMS
     if "youtube.com/shorts/" in video_url:
-        import re
         match = re.search(r'youtube.com/shorts/([a-zA-Z0-9_-]+)', video_url)
         if match:
             video_id = match.group(1)
             video_url = f"https://www.youtube.com/watch?v={video_id}"
             print(f"Converted Shorts URL: {video_url}")
     elif "youtu.be/" in video_url:
-        import re
         match = re.search(r'youtu.be/([a-zA-Z0-9_-]+)', video_url)
         if match:
             video_id = match.group(1)
             video_url = f"https://www.youtube.com/watch?v={video_id}"
             print(f"Converted youtu.be URL: {video_url}")
 
-    # Platform detection with enhanced logic
-    if "youtube.com" in video_url or "youtu.be" in video_url:
-        platform = 'youtube'
-    elif "instagram.com" in video_url:
-        platform = 'insta'
-    elif "facebook.com" in video_url or "fb.watch" in video_url:
-        platform = 'facebook'
-    elif "pinterest.com" in video_url:
-        platform = 'pinterest'
+    platform = detect_platform(video_url)
+    parsed = urlparse(video_url)
+    query = parse_qs(parsed.query)
+    if platform == 'youtube' and query.get('v'):
+        canonical_id = query['v'][0]
     else:
-        platform = 'other'
+        host = parsed.netloc.lower()
+        for prefix in ('www.', 'm.'):
+            if host.startswith(prefix):
+                host = host[len(prefix):]
+        canonical_id = host + parsed.path.rstrip('/')
+        if query.get('v'):
+            # facebook.com/watch/?v=<id>
+            canonical_id += f"?v={query['v'][0]}"
 
-    print(f"Processing {platform.upper()} URL: {video_url}")
+    return video_url, platform, canonical_id
 
-    # Enhanced extraction with multiple attempts for ALL PLATFORMS
-    extraction_strategies = []
-    
-    if platform == 'youtube':
-        # Special YouTube strategies (like yt1d.com)
-        strategies = [
-            get_enhanced_ydl_opts('youtube'),
-            {**get_enhanced_ydl_opts('youtube'), 'user_agent': USER_AGENTS[1]},
-            {**get_enhanced_ydl_opts('youtube'), 'geo_bypass_country': 'GB'},
-            {**get_enhanced_ydl_opts('youtube'), 'extractor_args': {'youtube': {'player_client': ['android']}}},
-            {**get_enhanced_ydl_opts('youtube'), 'format': 'worst'},  # Fallback
-        ]
-        extraction_strategies.extend(strategies)
-    else:
-        # Other platforms strategies
-        extraction_strategies.extend([
-            get_enhanced_ydl_opts(platform),
-            {**get_enhanced_ydl_opts(platform), 'user_agent': random.choice(USER_AGENTS)},
-            {**get_enhanced_ydl_opts(platform), 'geo_bypass_country': 'GB'},
-        ])
-    
-    for attempt, opts in enumerate(extraction_strategies):
-        try:
-            print(f"[{platform.upper()}] Extraction attempt {attempt + 1}")
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                if attempt > 0:
-                    delay = random.uniform(0.5, 2.0)
-                    print(f"Adding delay: {delay:.1f}s")
-                    time.sleep(delay)
-                
-                info = ydl.extract_info(video_url, download=False)
+# /get_info RESPONSE CACHE (TTL + LRU)
+INFO_CACHE_MAX_ENTRIES = int(os.environ.get('INFO_CACHE_MAX_ENTRIES', 2048))
+INFO_CACHE_DEFAULT_TTL = int(os.environ.get('INFO_CACHE_DEFAULT_TTL', 300))
+INFO_CACHE_MAX_TTL = int(os.environ.get('INFO_CACHE_MAX_TTL', 3 * 3600))
+INFO_CACHE_EXPIRY_MARGIN = int(os.environ.get('INFO_CACHE_EXPIRY_MARGIN', 600))
+
+class InfoCache:
+    """Thread-safe, size-bounded LRU of /get_info responses with per-entry expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl):
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+INFO_CACHE = InfoCache(INFO_CACHE_MAX_ENTRIES)
+
+# SINGLE-FLIGHT REQUEST COALESCING
+class _Flight:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution; do() returns (result, shared)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+            }
+
+INFO_FLIGHTS = SingleFlight()
+MERGE_FLIGHTS = SingleFlight()
+
+def info_cache_ttl(formats):
+    """Seconds a response may be cached, bounded by the earliest signed URL expiry.
+
+    googlevideo URLs carry a unix `expire` param, fbcdn/cdninstagram URLs a hex
+    `oe` param. A safety margin is subtracted so cached links are never dead
+    by the time a client starts downloading.
+    """
+    now = time.time()
+    earliest = None
+    for f in formats:
+        url = f.get('url')
+        if not url:
+            continue
+        query = parse_qs(urlparse(url).query)
+        try:
+            if 'expire' in query:
+                expires = int(query['expire'][0])
+            elif 'oe' in query:
+                expires = int(query['oe'][0], 16)
+            else:
+                continue
+        except ValueError:
+            continue
+        if earliest is None or expires < earliest:
+            earliest = expires
+
+    if earliest is None:
+        return INFO_CACHE_DEFAULT_TTL
+    return min(int(earliest - now - INFO_CACHE_EXPIRY_MARGIN), INFO_CACHE_MAX_TTL)
+
+# FORMAT SELECTION ENGINE (normalise once, rank with precomputed keys, query + pair)
+class MediaFormat:
+    """One yt-dlp format, normalised once with its ranking keys precomputed"""
+    __slots__ = (
+        'format_id', 'ext', 'protocol', 'url', 'vcodec', 'acodec', 'video', 'audio', 'has_video', 'has_audio',
+        'height', 'width', 'fps', 'tbr', 'abr', 'asr', 'filesize', 'size_estimated', 'area',
+        'video_rank', 'audio_rank', 'raw',
+    )
+
+    def __init__(self, f, duration=None):
+        self.raw = f
+        self.format_id = f.get('format_id', '')
+        self.ext = f.get('ext')
+        self.protocol = f.get('protocol')
+        self.url = f.get('url')
+        self.vcodec = f.get('vcodec')
+        self.acodec = f.get('acodec')
+        self.video = codec_family(self.vcodec, VIDEO_CODEC_FAMILIES)
+        self.audio = codec_family(self.acodec, AUDIO_CODEC_FAMILIES)
+        # Missing codec keys mean "none"; a present-but-null codec still counts as a stream
+        self.has_video = f.get('vcodec', 'none') != 'none'
+        self.has_audio = f.get('acodec', 'none') != 'none'
+        self.height = f.get('height')
+        self.width = f.get('width')
+        self.fps = f.get('fps')
+        self.tbr = f.get('tbr')
+        self.abr = f.get('abr')
+        self.asr = f.get('asr')
+        self.filesize = f.get('filesize') or f.get('filesize_approx')
+        self.size_estimated = False
+        if not self.filesize and self.tbr and duration:
+            self.filesize = int(self.tbr * 125 * duration)  # kbit/s -> bytes
+            self.size_estimated = True
+        self.area = (self.height or 0) * (self.width or 0)
+        self.video_rank = (self.height or 0, self.fps or 0, self.tbr or 0)
+        self.audio_rank = (float(self.abr) if self.abr else 0, self.tbr or 0)
+
+    @property
+    def kind(self):
+        if self.has_video:
+            return 'muxed' if self.has_audio else 'video'
+        return 'audio' if self.has_audio else 'none'
+
+    def summary(self):
+        fields = {
+            'format_id': self.format_id, 'ext': self.ext, 'kind': self.kind, 'vcodec': self.vcodec,
+            'acodec': self.acodec, 'height': self.height, 'width': self.width, 'fps': self.fps, 'tbr': self.tbr,
+            'abr': self.abr, 'filesize': self.filesize, 'protocol': self.protocol, 'url': self.url,
+        }
+        summary = {key: value for key, value in fields.items() if value is not None}
+        if self.size_estimated:
+            summary['size_estimated'] = True
+        return summary
+
+def normalize_formats(formats, duration=None):
+    """MediaFormats for every downloadable (url-bearing) yt-dlp format"""
+    return [MediaFormat(f, duration) for f in formats or () if f.get('url')]
+
+def _query_number(value):
+    value = value.strip().lower().rstrip('p')
+    for suffix, factor in (('k', 1024), ('m', 1024 ** 2), ('g', 1024 ** 3)):
+        if value.endswith(suffix):
+            return float(value[:-1]) * factor
+    return float(value)
+
+_QUERY_TERM = re.compile(r'([a-z_]+)(<=|>=|!=|=|<|>)(\S+)')
+_QUERY_NUMERIC = {
+    'height': 'height', 'width': 'width', 'fps': 'fps', 'tbr': 'tbr', 'abr': 'abr', 'asr': 'asr',
+    'size': 'filesize',
+}
+_QUERY_TEXT = {'ext': 'ext', 'protocol': 'protocol', 'format_id': 'format_id', 'kind': 'kind',
+               'vcodec': 'vcodec', 'acodec': 'acodec'}
+_QUERY_OPS = {
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b, '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+}
+
+# Query terms are field<op>value separated by spaces. With a '+', the left side filters video-only
+# and the right side audio-only formats (ranked pairs); without one, muxed formats unless kind= says
+# otherwise. Terms after ';' apply to the whole choice: size (K/M/G; unknown sizes never match),
+# container (what /merge would produce) and copy=yes. Codecs match a family (h264, vp9, av1, aac,
+# opus) or a raw prefix (avc1, mp4a); text terms accept comma-separated alternatives.
+class FormatQuery:
+    """Constraints like `height<=1080 vcodec=h264 + ext=m4a ; size<200M container=mp4`"""
+
+    def __init__(self, text):
+        text = (text or '').strip()
+        text, _, pair_text = text.partition(';')
+        video_text, plus, audio_text = text.partition('+')
+        self.paired = bool(plus)
+        self.video_terms = self._parse(video_text)
+        self.audio_terms = self._parse(audio_text)
+        self.pair_terms = self._parse(pair_text, pair=True)
+
+    @staticmethod
+    def _parse(text, pair=False):
+        terms = []
+        for token in text.split():
+            match = _QUERY_TERM.fullmatch(token.lower())
+            if not match:
+                raise ValueError(f'Bad query term {token!r}')
+            field, op, value = match.groups()
+            allowed = ('size', 'container', 'copy') if pair else tuple(_QUERY_NUMERIC) + tuple(_QUERY_TEXT)
+            if field not in allowed:
+                raise ValueError(f'Unknown field {field!r}' + (' after ;' if pair else ''))
+            if field in _QUERY_NUMERIC:
+                try:
+                    value = _query_number(value)
+                except ValueError:
+                    raise ValueError(f'Bad number in {token!r}')
+            else:
+                if op not in ('=', '!='):
+                    raise ValueError(f'{field} only supports = and !=')
+                value = tuple(value.split(','))
+            terms.append((field, op, value))
+        return terms
+
+    @staticmethod
+    def _text_value(fmt, field, wanted):
+        if field == 'vcodec':
+            raw, family = (fmt.vcodec or 'none').lower(), fmt.video
+        elif field == 'acodec':
+            raw, family = (fmt.acodec or 'none').lower(), fmt.audio
+        else:
+            return str(getattr(fmt, field) or '').lower() in wanted
+        return family in wanted or any(raw.startswith(prefix) for prefix in wanted)
+
+    def match(self, fmt, terms):
+        for field, op, value in terms:
+            if field in _QUERY_NUMERIC:
+                actual = getattr(fmt, _QUERY_NUMERIC[field])
+                if actual is None or not _QUERY_OPS[op](actual, value):
+                    return False
+            elif self._text_value(fmt, field, value) != (op == '='):
+                return False
+        return True
+
+    def match_choice(self, size, container, copy):
+        for field, op, value in self.pair_terms:
+            if field == 'size':
+                if size is None or not _QUERY_OPS[op](size, value):
+                    return False
+            elif field == 'container':
+                if (container in value) != (op == '='):
+                    return False
+            elif field == 'copy':
+                if (('yes' if copy else 'no') in value or ('true' if copy else 'false') in value) != (op == '='):
+                    return False
+        return True
+
+    @property
+    def wants_kind(self):
+        return any(field == 'kind' for field, _, _ in self.video_terms)
+
+def select_formats(formats, query, duration=None, limit=5):
+    """Best choices for a FormatQuery over yt-dlp formats, best first.
+
+    Paired queries return each qualifying video (by height, fps, tbr) with
+    the best audio (by abr, tbr) that satisfies the choice terms, plus the
+    /merge request body for it. Raises ValueError for a bad query.
+    """
+    query = FormatQuery(query)
+    normalized = normalize_formats(formats, duration)
+    choices = []
+
+    if not query.paired:
+        candidates = [
+            f for f in normalized
+            if (query.wants_kind or f.kind == 'muxed') and query.match(f, query.video_terms)
+        ]
+        candidates.sort(key=lambda f: (f.video_rank, f.audio_rank), reverse=True)
+        for f in candidates:
+            if query.match_choice(f.filesize, f.ext, True):
+                choices.append({'format': f.summary(), 'filesize': f.filesize, 'url': f.url})
+                if len(choices) >= limit:
+                    break
+        return choices
+
+    videos, audios = [], []
+    for f in normalized:
+        if f.kind == 'video' and query.match(f, query.video_terms):
+            videos.append(f)
+        elif f.kind == 'audio' and query.match(f, query.audio_terms):
+            audios.append(f)
+    videos.sort(key=lambda f: f.video_rank, reverse=True)
+    audios.sort(key=lambda f: f.audio_rank, reverse=True)
+
+    for video in videos:
+        for audio in audios:
+            plan = plan_merge(video.vcodec, audio.acodec, 'auto', duration)
+            size = video.filesize + audio.filesize if video.filesize and audio.filesize else None
+            copy = plan['video'] == 'copy' and plan['audio'] == 'copy'
+            if not query.match_choice(size, plan['container'], copy):
+                continue
+            merge = {'video_url': video.url, 'audio_url': audio.url, 'container': plan['container']}
+            merge.update((key, value) for key, value in (
+                ('vcodec', video.vcodec), ('acodec', audio.acodec), ('duration', duration)) if value)
+            choices.append({
+                'video': video.summary(),
+                'audio': audio.summary(),
+                'filesize': size,
+                'size_estimated': video.size_estimated or audio.size_estimated,
+                'container': plan['container'],
+                'stream_copy': copy,
+                'merge': merge,
+            })
+            break
+        if len(choices) >= limit:
+            break
+    return choices
+
+def build_info_response(info, platform):
+    """Build the /get_info response dict from a yt-dlp info dict"""
+    # Build enhanced response
+    resp = {
+        'title': info.get('title', ''),
+        'thumbnail': info.get('thumbnail', ''),
+        'duration': int(info.get('duration') or 0),
+        'formats': info.get('formats', []),
+        'formats_raw': info.get('formats', []),
+        'width': None,
+        'height': None,
+        'aspect_ratio': None,
+        'uploader': info.get('uploader', ''),
+        'view_count': info.get('view_count', 0),
+        'like_count': info.get('like_count', 0),
+        'upload_date': info.get('upload_date', ''),
+    }
+
+    # Enhanced dimension detection
+    width = info.get('width')
+    height = info.get('height')
+    formats = resp['formats']
+
+    if not width or not height:
+        best_format = None
+        for f in formats:
+            if 'width' in f and 'height' in f and f.get('url'):
+                if not best_format or (f.get('width', 0) * f.get('height', 0)) > (best_format.get('width', 0) * best_format.get('height', 0)):
+                    best_format = f
+        if best_format:
+            width = best_format['width']
+            height = best_format['height']
+
+    if width and height:
+        resp['width'] = width
+        resp['height'] = height
+        resp['aspect_ratio'] = f"{width}:{height}"
+
+    # Enhanced format processing for ALL PLATFORMS
+    normalized = normalize_formats(formats)
+    if platform == 'youtube':
+        # SUPER ENHANCED YOUTUBE FORMAT PROCESSING
+        audio_formats = []
+        video_formats = []
+
+        for f in normalized:
+            raw = f.raw
+            out = {
+                'format_id': f.format_id,
+                'format_note': raw.get('format_note', ''),
+                'extension': raw.get('ext', ''),
+                'filesize': sizeof_fmt(f.filesize) if f.filesize else "Unknown",
+                'filesize_bytes': f.filesize,
+                'resolution': str(f.height or raw.get('format_note') or 'audio'),
+                'acodec': f.acodec,
+                'vcodec': f.vcodec,
+                'abr': f.abr,
+                'tbr': f.tbr,
+                'fps': f.fps,
+                'url': f.url,
+                'quality': raw.get('quality'),
+                'protocol': f.protocol,
+            }
+            manifest = adaptive_manifest_path(raw)
+            if manifest:
+                out['manifest_proxy'] = manifest
+
+            if f.kind == 'audio':
+                audio_formats.append((f.audio_rank, out))
+            elif f.has_video:
+                video_formats.append((f.video_rank, out))
+
+        # Ranking keys were computed once per format; sort on them, not on the output strings
+        video_formats.sort(key=lambda item: item[0], reverse=True)
+        audio_formats.sort(key=lambda item: item[0], reverse=True)
+
+        resp['audio_formats'] = [out for _, out in audio_formats]
+        resp['video_formats'] = [out for _, out in video_formats]
+
+        print(f"YouTube: Found {len(video_formats)} video formats, {len(audio_formats)} audio formats")
+
+    else:
+        # ENHANCED NON-YOUTUBE PLATFORM PROCESSING (Facebook, Instagram, Pinterest)
+        best_muxed = None
+        best_video = None
+        best_audio = None
+
+        # One pass; first format wins ties, as before
+        for f in normalized:
+            if f.has_video and f.has_audio and (not best_muxed or f.area > best_muxed.area):
+                best_muxed = f
+            if f.has_video and (not best_video or f.area > best_video.area):
+                best_video = f
+            if f.kind == 'audio' and (not best_audio or (f.abr or 0) > (best_audio.abr or 0)):
+                best_audio = f
+
+        if best_muxed:
+            resp['video_muxed'] = {
+                'resolution': str(best_muxed.height) + "p" if best_muxed.height else "HD",
+                'extension': best_muxed.ext,
+                'filesize': sizeof_fmt(best_muxed.filesize) if best_muxed.filesize else "Unknown",
+                'filesize_bytes': best_muxed.filesize,
+                'url': best_muxed.url,
+                'tbr': best_muxed.tbr,
+                'fps': best_muxed.fps,
+                'width': best_muxed.width,
+                'height': best_muxed.height,
+            }
+
+        if best_video and (not best_muxed or best_video.url != best_muxed.url):
+            resp['video_only'] = {
+                'resolution': str(best_video.height) + "p" if best_video.height else "HD",
+                'extension': best_video.ext,
+                'filesize': sizeof_fmt(best_video.filesize) if best_video.filesize else "Unknown",
+                'filesize_bytes': best_video.filesize,
+                'url': best_video.url,
+                'tbr': best_video.tbr,
+                'fps': best_video.fps,
+                'width': best_video.width,
+                'height': best_video.height,
+            }
+
+        if best_audio:
+            resp['audio'] = {
+                'extension': best_audio.ext,
+                'filesize': sizeof_fmt(best_audio.filesize) if best_audio.filesize else "Unknown",
+                'filesize_bytes': best_audio.filesize,
+                'url': best_audio.url,
+                'abr': best_audio.abr,
+                'tbr': best_audio.tbr,
+            }
+
+        print(f"{platform.upper()}: Processed formats successfully")
+
+    return resp
+
+def build_extraction_strategies(platform):
+    """Return the named (strategy, ydl_opts) retry ladder for a platform"""
+    if platform == 'youtube':
+        # Special YouTube strategies (like yt1d.com)
+        return [
+            ('default', get_enhanced_ydl_opts('youtube')),
+            ('alt_user_agent', {**get_enhanced_ydl_opts('youtube'), 'user_agent': USER_AGENTS[1]}),
+            ('geo_gb', {**get_enhanced_ydl_opts('youtube'), 'geo_bypass_country': 'GB'}),
+            ('android_client', {**get_enhanced_ydl_opts('youtube'), 'extractor_args': {'youtube': {'player_client': ['android']}}}),
+            ('worst_format', {**get_enhanced_ydl_opts('youtube'), 'format': 'worst'}),  # Fallback
+        ]
+    # Other platforms strategies
+    return [
+        ('default', get_enhanced_ydl_opts(platform)),
+        ('random_user_agent', {**get_enhanced_ydl_opts(platform), 'user_agent': random.choice(USER_AGENTS)}),
+        ('geo_gb', {**get_enhanced_ydl_opts(platform), 'geo_bypass_country': 'GB'}),
+    ]
+
+# ADAPTIVE STRATEGY ORDERING
+STRATEGY_WINDOW = int(os.environ.get('STRATEGY_WINDOW', 50))
+STRATEGY_EXPLORE_RATE = float(os.environ.get('STRATEGY_EXPLORE_RATE', 0.1))
+
+class StrategyRanker:
+    """Sliding-window success rate and latency per (platform, strategy), best first with some exploration"""
+
+    def __init__(self, window, explore_rate):
+        self.window = window
+        self.explore_rate = explore_rate
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, platform, name, ok, latency):
+        with self._lock:
+            samples = self._samples.get((platform, name))
+            if samples is None:
+                samples = self._samples[(platform, name)] = deque(maxlen=self.window)
+            samples.append((ok, latency))
+
+    def _score(self, platform, name):
+        samples = self._samples.get((platform, name), ())
+        attempts = len(samples)
+        successes = sum(1 for ok, _ in samples if ok)
+        success_rate = (successes + 1) / (attempts + 2)  # Laplace smoothing
+        avg_latency = sum(lat for _, lat in samples) / attempts if attempts else 0.0
+        return attempts, successes, success_rate, avg_latency
+
+    def order(self, platform, strategies):
+        with self._lock:
+            scores = {name: self._score(platform, name) for name, _ in strategies}
+        # sorted() is stable, so ties keep the hand-written ladder order
+        ranked = sorted(strategies, key=lambda s: (-scores[s[0]][2], scores[s[0]][3]))
+        if len(ranked) > 1 and random.random() < self.explore_rate:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def ranking(self):
+        with self._lock:
+            platforms = {}
+            for platform, name in self._samples:
+                platforms.setdefault(platform, []).append(name)
+            result = {}
+            for platform, names in platforms.items():
+                rows = []
+                for name in names:
+                    attempts, successes, success_rate, avg_latency = self._score(platform, name)
+                    rows.append({
+                        'strategy': name,
+                        'attempts': attempts,
+                        'successes': successes,
+                        'success_rate': round(success_rate, 4),
+                        'avg_latency_ms': round(avg_latency * 1000, 1),
+                    })
+                rows.sort(key=lambda r: (-r['success_rate'], r['avg_latency_ms']))
+                result[platform] = rows
+            return result
+
+STRATEGY_RANKER = StrategyRanker(STRATEGY_WINDOW, STRATEGY_EXPLORE_RATE)
+
+# PRE-WARMED YOUTUBEDL POOL + PRECOMPUTED OPTION TEMPLATES
+PLATFORMS = ['youtube', 'insta', 'facebook', 'pinterest', 'other']
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 4))
+COOKIE_CHECK_INTERVAL = float(os.environ.get('COOKIE_CHECK_INTERVAL', 5))
+
+def cookie_file_for(platform):
+    return f'cookies_{platform}.txt'
+
+def _cookie_mtime(platform):
+    try:
+        return os.stat(cookie_file_for(platform)).st_mtime_ns
+    except OSError:
+        return None
+
+# Strategies that pick a new User-Agent for every attempt, not once per template
+RANDOM_UA_STRATEGIES = {'random_user_agent'}
+
+def with_user_agent(opts, user_agent):
+    """ydl_opts sending user_agent (yt-dlp only sends what is in http_headers)"""
+    return {**opts, 'user_agent': user_agent,
+            'http_headers': {**(opts.get('http_headers') or {}), 'User-Agent': user_agent}}
+
+class YDLPool:
+    """Per-(platform, strategy) pool of ready-to-use YoutubeDL instances, rebuilt when cookies change"""
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._versions = {}
+        self._cookie_mtimes = {}
+        self._checked_at = {}
+        self._idle = {}
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def templates(self, platform):
+        """Return the named (strategy, ydl_opts) ladder for a platform"""
+        self._check_cookies(platform)
+        with self._lock:
+            templates = self._templates.get(platform)
+        if templates is None:
+            templates = build_extraction_strategies(platform)
+            with self._lock:
+                self._templates.setdefault(platform, templates)
+                self._versions.setdefault(platform, 0)
+                self._cookie_mtimes.setdefault(platform, _cookie_mtime(platform))
+                templates = self._templates[platform]
+        return templates
+
+    def _check_cookies(self, platform):
+        now = time.time()
+        with self._lock:
+            if now - self._checked_at.get(platform, 0) < COOKIE_CHECK_INTERVAL:
+                return
+            self._checked_at[platform] = now
+            known = self._cookie_mtimes.get(platform)
+        if platform in self._templates and _cookie_mtime(platform) != known:
+            self.reload(platform)
+
+    def reload(self, platform):
+        """Rebuild templates and drop idle instances after a cookie change"""
+        templates = build_extraction_strategies(platform)
+        with self._lock:
+            self._templates[platform] = templates
+            self._versions[platform] = self._versions.get(platform, 0) + 1
+            self._cookie_mtimes[platform] = _cookie_mtime(platform)
+            self._checked_at[platform] = time.time()
+            stale = []
+            for key in [k for k in self._idle if k[0] == platform]:
+                stale.extend(ydl for _, ydl in self._idle.pop(key))
+        for ydl in stale:
+            self._discard(ydl)
+        print(f"🍪 Reloaded {platform.upper()} extractor templates ({len(stale)} idle instances dropped)")
+
+    def _create(self, opts):
+        ydl = yt_dlp.YoutubeDL(opts)
+        ydl.cookiejar  # parse the cookie file once, up front
+        with self._lock:
+            self.created += 1
+        return ydl
+
+    def _discard(self, ydl):
+        # close() writes the in-memory jar back to the cookie file; never let
+        # a stale instance overwrite freshly uploaded cookies
+        ydl.params.pop('cookiefile', None)
+        try:
+            ydl.close()
+        except Exception as e:
+            print(f"YoutubeDL close error: {e}")
+        with self._lock:
+            self.discarded += 1
+
+    @contextmanager
+    def checkout(self, platform, strategy, opts):
+        key = (platform, strategy)
+        if strategy in RANDOM_UA_STRATEGIES:
+            # One pooled variant per user agent: instances are built with theirs and never changed
+            user_agent = random.choice(USER_AGENTS)
+            key, opts = (platform, strategy, user_agent), with_user_agent(opts, user_agent)
+        ydl = None
+        with self._lock:
+            version = self._versions.get(platform, 0)
+            idle = self._idle.get(key)
+            while idle and ydl is None:
+                idle_version, candidate = idle.pop()
+                if idle_version == version:
+                    ydl = candidate
+                    self.reused += 1
+        if ydl is None:
+            ydl = self._create(opts)
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                keep = self._versions.get(platform, 0) == version
+                idle = self._idle.setdefault(key, [])
+                if keep and len(idle) < self.max_idle:
+                    idle.append((version, ydl))
+                    ydl = None
+            if ydl is not None:
+                self._discard(ydl)
+
+    def warm(self, platforms=PLATFORMS):
+        """Build templates and one idle instance per strategy ahead of traffic"""
+        for platform in platforms:
+            for strategy, opts in self.templates(platform):
+                with self.checkout(platform, strategy, opts):
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': sum(len(v) for v in self._idle.values()),
+                'max_idle_per_strategy': self.max_idle,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'template_versions': dict(self._versions),
+            }
+
+YDL_POOL = YDLPool(YDL_POOL_SIZE)
+
+def extract_video_info(video_url, platform):
+    """Run the extraction strategy ladder. Returns (resp, error_message)"""
+    # Enhanced extraction with multiple attempts for ALL PLATFORMS
+    extraction_strategies = STRATEGY_RANKER.order(platform, YDL_POOL.templates(platform))
+    limiter = HOST_LIMITS.for_platform(platform)
+    
+    for attempt, (strategy, opts) in enumerate(extraction_strategies):
+        try:
+            print(f"[{platform.upper()}] Extraction attempt {attempt + 1} ({strategy})")
+            
+            with YDL_POOL.checkout(platform, strategy, opts) as ydl:
+                limiter.acquire()
+                started = time.time()
+                try:
+                    with span('attempt', f'{attempt + 1} {strategy}'):
+                        info = ydl.extract_info(video_url, download=False)
+                except Exception as e:
+                    STRATEGY_RANKER.record(platform, strategy, False, time.time() - started)
+                    METRICS.inc('downloader_extraction_attempts_total', platform=platform, strategy=strategy,
+                                outcome='error')
+                    if ydl_throttled(e):
+                        limiter.record(429)
+                    raise
+                limiter.record(200)
                 
-                if not info:
-                    print(f"No info extracted on attempt {attempt + 1}")
-                    continue
-                    
-                if 'entries' in info and isinstance(info['entries'], list):
+                if info and 'entries' in info and isinstance(info['entries'], list):
                     info = info['entries'][0] if info['entries'] else {}
                 
+                STRATEGY_RANKER.record(platform, strategy, bool(info), time.time() - started)
+                METRICS.inc('downloader_extraction_attempts_total', platform=platform, strategy=strategy,
+                            outcome='ok' if info else 'empty')
+                
                 if not info:
-                    print(f"Empty info after processing on attempt {attempt + 1}")
+                    print(f"No info extracted on attempt {attempt + 1}")
                     continue
 
-                print(f"✅ Successfully extracted info on attempt {attempt + 1}")
-                
-                # Build enhanced response
-                resp = {
-                    'title': info.get('title', ''),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': int(info.get('duration') or 0),
-                    'formats': info.get('formats', []),
-                    'formats_raw': info.get('formats', []),
-                    'width': None,
-                    'height': None,
-                    'aspect_ratio': None,
-                    'uploader': info.get('uploader', ''),
-                    'view_count': info.get('view_count', 0),
-                    'like_count': info.get('like_count', 0),
-                    'upload_date': info.get('upload_date', ''),
-                }
-
-                # Enhanced dimension detection
-                width = info.get('width')
-                height = info.get('height')
-                formats = resp['formats']
-
-                if not width or not height:
-                    best_format = None
-                    for f in formats:
-                        if 'width' in f and 'height' in f and f.get('url'):
-                            if not best_format or (f.get('width', 0) * f.get('height', 0)) > (best_format.get('width', 0) * best_format.get('height', 0)):
-                                best_format = f
-                    if best_format:
-                        width = best_format['width']
-                        height = best_format['height']
-
-                if width and height:
-                    resp['width'] = width
-                    resp['height'] = height
-                    resp['aspect_ratio'] = f"{width}:{height}"
-
-                # Enhanced format processing for ALL PLATFORMS
-                if platform == 'youtube':
-                    # SUPER ENHANCED YOUTUBE FORMAT PROCESSING
-                    audio_formats = []
-                    video_formats = []
-                    
-                    for f in formats:
-                        if not f.get('url'):
-                            continue
-                            
-                        size_val = f.get('filesize') or f.get('filesize_approx')
-                        readable_size = sizeof_fmt(size_val) if size_val else "Unknown"
-                        
-                        out = {
-                            'format_id': f.get('format_id', ''),
-                            'format_note': f.get('format_note', ''),
-                            'extension': f.get('ext', ''),
-                            'filesize': readable_size,
-                            'filesize_bytes': size_val,
-                            'resolution': str(f.get('height') or f.get('format_note') or 'audio'),
-                            'acodec': f.get('acodec'),
-                            'vcodec': f.get('vcodec'),
-                            'abr': f.get('abr'),
-                            'tbr': f.get('tbr'),
-                            'fps': f.get('fps'),
-                            'url': f.get('url'),
-                            'quality': f.get('quality'),
-                            'protocol': f.get('protocol'),
-                        }
-                        
-                        if f.get('vcodec', 'none') == 'none' and f.get('acodec', 'none') != 'none':
-                            audio_formats.append(out)
-                        elif f.get('vcodec', 'none') != 'none':
-                            video_formats.append(out)
-                    
-                    # Enhanced sorting
-                    video_formats = sorted(video_formats, key=lambda x: (
-                        int(x['resolution']) if x['resolution'].isdigit() else 0,
-                        x.get('fps', 0) or 0,
-                        x.get('tbr', 0) or 0
-                    ), reverse=True)
-                    
-                    audio_formats = sorted(audio_formats, key=lambda x: (
-                        float(x['abr']) if x['abr'] else 0,
-                        x.get('tbr', 0) or 0
-                    ), reverse=True)
-                    
-                    resp['audio_formats'] = audio_formats
-                    resp['video_formats'] = video_formats
-                    
-                    print(f"YouTube: Found {len(video_formats)} video formats, {len(audio_formats)} audio formats")
-                
-                else:
-                    # ENHANCED NON-YOUTUBE PLATFORM PROCESSING (Facebook, Instagram, Pinterest)
-                    best_muxed = None
-                    best_video = None
-                    best_audio = None
-
-                    for f in formats:
-                        if not f.get('url'):
-                            continue
-                            
-                        # Mixed format (video + audio)
-                        if f.get('vcodec', 'none') != 'none' and f.get('acodec', 'none') != 'none':
-                            if not best_muxed or (f.get('height', 0) * f.get('width', 0)) > (best_muxed.get('height', 0) * best_muxed.get('width', 0)):
-                                best_muxed = f
-                        
-                        # Video only
-                        if f.get('vcodec', 'none') != 'none':
-                            if not best_video or (f.get('height', 0) * f.get('width', 0)) > (best_video.get('height', 0) * best_video.get('width', 0)):
-                                best_video = f
-                        
-                        # Audio only
-                        if f.get('acodec', 'none') != 'none' and f.get('vcodec', 'none') == 'none':
-                            if not best_audio or (f.get('abr', 0) or 0) > (best_audio.get('abr', 0) or 0):
-                                best_audio = f
-
-                    if best_muxed:
-                        size_val = best_muxed.get('filesize') or best_muxed.get('filesize_approx')
-                        resp['video_muxed'] = {
-                            'resolution': str(best_muxed.get('height', '')) + "p" if best_muxed.get('height') else "HD",
-                            'extension': best_muxed.get('ext'),
-                            'filesize': sizeof_fmt(size_val) if size_val else "Unknown",
-                            'filesize_bytes': size_val,
-                            'url': best_muxed.get('url'),
-                            'tbr': best_muxed.get('tbr'),
-                            'fps': best_muxed.get('fps'),
-                            'width': best_muxed.get('width'),
-                            'height': best_muxed.get('height'),
-                        }
-
-                    if best_video and (not best_muxed or best_video['url'] != best_muxed['url']):
-                        size_val = best_video.get('filesize') or best_video.get('filesize_approx')
-                        resp['video_only'] = {
-                            'resolution': str(best_video.get('height', '')) + "p" if best_video.get('height') else "HD",
-                            'extension': best_video.get('ext'),
-                            'filesize': sizeof_fmt(size_val) if size_val else "Unknown",
-                            'filesize_bytes': size_val,
-                            'url': best_video.get('url'),
-                            'tbr': best_video.get('tbr'),
-                            'fps': best_video.get('fps'),
-                            'width': best_video.get('width'),
-                            'height': best_video.get('height'),
-                        }
-
-                    if best_audio:
-                        size_val = best_audio.get('filesize') or best_audio.get('filesize_approx')
-                        resp['audio'] = {
-                            'extension': best_audio.get('ext'),
-                            'filesize': sizeof_fmt(size_val) if size_val else "Unknown",
-                            'filesize_bytes': size_val,
-                            'url': best_audio.get('url'),
-                            'abr': best_audio.get('abr'),
-                            'tbr': best_audio.get('tbr'),
-                        }
-                    
-                    print(f"{platform.upper()}: Processed formats successfully")
-
-                return jsonify(resp)
+                print(f"✅ Successfully extracted info on attempt {attempt + 1} ({strategy})")
+                METRICS.inc('downloader_extraction_success_index_total', platform=platform, index=attempt)
+                with span('formats'):
+                    return build_info_response(info, platform), None
                 
+        except HostThrottled:
+            raise
         except Exception as e:
             print(f"[{platform.upper()}] Attempt {attempt + 1} failed: {str(e)}")
             if attempt == len(extraction_strategies) - 1:
-                return jsonify({'error': f'All extraction attempts failed. Platform: {platform}. Error: {str(e)}'}), 400
+                return None, f'All extraction attempts failed. Platform: {platform}. Error: {str(e)}'
             continue
     
-    return jsonify({'error': f'Failed to extract {platform} info after all attempts.'}), 400
+    return None, f'Failed to extract {platform} info after all attempts.'
+
+def get_video_info(video_url):
+    """Cached, single-flight extraction behind /get_info. Returns (resp, error)"""
+    with span('normalize'):
+        video_url, platform, canonical_id = normalize_video_url(video_url)
+    cache_key = (platform, canonical_id)
+
+    cached = INFO_CACHE.get(cache_key)
+    if cached is not None:
+        print(f"⚡ Cache hit for {platform.upper()} {canonical_id}")
+        add_span('cache', 0.0, 'hit')
+        return cached, None
+
+    def extract():
+        # A flight that finished just before we joined has already filled the cache
+        cached = INFO_CACHE.get(cache_key)
+        if cached is not None:
+            return cached, None
+        print(f"Processing {platform.upper()} URL: {video_url}")
+        resp, error = extract_video_info(video_url, platform)
+        if resp is not None:
+            INFO_CACHE.put(cache_key, resp, info_cache_ttl(resp['formats']))
+        return resp, error
+
+    started = time.perf_counter()
+    (resp, error), shared = INFO_FLIGHTS.do(cache_key, extract)
+    add_span('extract', time.perf_counter() - started, 'shared' if shared else platform)
+    if shared:
+        print(f"🤝 Shared in-flight extraction for {platform.upper()} {canonical_id}")
+    return resp, error
+
+# COMPACT /get_info RESPONSES (projection, de-duplicated formats, fast encode, compression)
+COMPACT_FORMAT_FIELDS = (
+    'format_id', 'ext', 'format_note', 'vcodec', 'acodec', 'width', 'height', 'fps', 'tbr', 'abr', 'asr',
+    'filesize', 'filesize_approx', 'dynamic_range', 'protocol', 'url',
+)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+def _field_list(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(field).strip() for field in value if str(field).strip()]
+
+def compact_info_response(resp, fields=None, format_fields=None):
+    """Slim view of a /get_info response.
+
+    formats becomes one list of trimmed format dicts (no fragments or
+    http_headers, no None values) and formats_raw is dropped. YouTube's
+    video_formats/audio_formats become ordered lists of format_ids into it,
+    so no format is sent twice. fields/format_fields project top-level and
+    per-format keys; format_id is always kept.
+    """
+    keep = tuple(format_fields) if format_fields else COMPACT_FORMAT_FIELDS
+    if 'format_id' not in keep:
+        keep = ('format_id',) + keep
+    formats = []
+    for f in resp.get('formats') or []:
+        if not f.get('url'):
+            continue
+        entry = {key: f[key] for key in keep if f.get(key) is not None}
+        if not format_fields or 'manifest_proxy' in format_fields:
+            manifest = adaptive_manifest_path(f)
+            if manifest:
+                entry['manifest_proxy'] = manifest
+        formats.append(entry)
+
+    compact = {key: value for key, value in resp.items() if key not in ('formats', 'formats_raw')}
+    compact['formats'] = formats
+    for key in ('video_formats', 'audio_formats'):
+        if key in compact:
+            compact[key] = [f['format_id'] for f in compact[key]]
+    if fields:
+        compact = {key: compact[key] for key in fields if key in compact}
+    return compact
+
+def encode_json(payload):
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:  # e.g. ints beyond 64 bits in a raw yt-dlp dict
+            pass
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+def json_response(payload, status=200):
+    """JSON response, brotli/gzip compressed when the client accepts it"""
+    with span('serialize'):
+        body = encode_json(payload)
+    headers = {'Vary': 'Accept-Encoding'}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accept = request.accept_encodings
+        with span('compress'):
+            if brotli is not None and accept.quality('br'):
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+                headers['Content-Encoding'] = 'br'
+            elif accept.quality('gzip'):
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+                headers['Content-Encoding'] = 'gzip'
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+@app.route('/get_info', methods=['POST'])
+def get_info():
+    data = request.json
+    video_url = data.get('url')
+    if not video_url:
+        return jsonify({'error': 'No URL provided.'}), 400
+    g.metrics_platform = detect_platform(video_url)
+
+    try:
+        resp, error = get_video_info(video_url)
+    except HostThrottled as e:
+        return throttled_response(e)
+    if error:
+        return jsonify({'error': error}), 400
+
+    fields, format_fields = _field_list(data.get('fields')), _field_list(data.get('format_fields'))
+    if data.get('view') == 'compact' or fields or format_fields:
+        with span('compact'):
+            resp = compact_info_response(resp, fields, format_fields)
+    return json_response(resp)
+
+@app.route('/select_format', methods=['POST'])
+def select_format():
+    """Ranked format choices for a FormatQuery; paired choices carry a ready /merge body"""
+    data = request.json or {}
+    video_url = data.get('url')
+    if not video_url:
+        return jsonify({'error': 'No URL provided.'}), 400
+    g.metrics_platform = detect_platform(video_url)
+
+    try:
+        resp, error = get_video_info(video_url)
+    except HostThrottled as e:
+        return throttled_response(e)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        limit = max(1, min(int(data.get('limit') or 5), 50))
+        with span('select'):
+            choices = select_formats(resp.get('formats'), data.get('query', ''), resp.get('duration') or None, limit)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    return json_response({'query': data.get('query', ''), 'choices': choices})
+
+# BATCH /get_info (NDJSON, one line per URL in completion order)
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 50))
+# Concurrent extractions per platform, shared by every batch in this worker
+BATCH_PLATFORM_PARALLELISM = dict(
+    (platform.strip(), int(limit))
+    for platform, limit in (
+        item.split('=') for item in os.environ.get(
+            'BATCH_PLATFORM_PARALLELISM', 'youtube=4,insta=2,facebook=2,pinterest=2,other=2'
+        ).split(',') if item.strip()
+    )
+)
+BATCH_SEMAPHORES = {
+    platform: threading.BoundedSemaphore(BATCH_PLATFORM_PARALLELISM.get(platform, 2)) for platform in PLATFORMS
+}
+
+def _batch_extract(index, url):
+    started = time.time()
+    retry_after = None
+    try:
+        _, platform, _ = normalize_video_url(url)
+        with BATCH_SEMAPHORES[platform]:
+            resp, error = get_video_info(url)
+    except Exception as e:
+        resp, error = None, str(e)
+        if isinstance(e, HostThrottled):
+            retry_after = e.retry_after
+    line = {'index': index, 'url': url, 'ok': error is None, 'seconds': round(time.time() - started, 3)}
+    if error is None:
+        line['info'] = resp
+    else:
+        line['error'] = error
+    if retry_after:
+        line['retry_after'] = round(retry_after, 1)
+    return line
+
+@app.route('/get_info/batch', methods=['POST'])
+def get_info_batch():
+    """Extract many URLs concurrently and stream results as NDJSON.
+
+    Lines arrive in completion order, so the caller matches them up by
+    index. A failed URL gets its own {"ok": false} line and never fails
+    the batch. The last line is a summary.
+    """
+    urls = (request.json or {}).get('urls')
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'Provide a non-empty "urls" list.'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'At most {BATCH_MAX_URLS} URLs per batch.'}), 400
+
+    print(f"📚 Batch info request for {len(urls)} URLs")
+
+    def generate():
+        started = time.time()
+        failed = 0
+        # The per-platform semaphores are the real limit; threads only need to cover them
+        executor = ThreadPoolExecutor(max_workers=min(len(urls), sum(BATCH_PLATFORM_PARALLELISM.values()) or 1))
+        try:
+            futures = [
+                executor.submit(_batch_extract, index, url) if isinstance(url, str) and url else None
+                for index, url in enumerate(urls)
+            ]
+            for index, future in enumerate(futures):
+                if future is None:
+                    failed += 1
+                    yield json.dumps({'index': index, 'url': urls[index], 'ok': False, 'error': 'No URL provided.'}) + '\n'
+            for future in as_completed([f for f in futures if f is not None]):
+                line = future.result()
+                failed += not line['ok']
+                yield json.dumps(line) + '\n'
+            yield json.dumps({'done': True, 'count': len(urls), 'failed': failed,
+                              'seconds': round(time.time() - started, 3)}) + '\n'
+        finally:
+            # A client that hangs up mid-batch doesn't leave queued extractions behind
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+@app.route('/artifacts/<digest>', methods=['GET', 'HEAD'])
+def get_artifact(digest):
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        return abort(404)
+    path, meta = ARTIFACTS.lookup(digest)
+    if not path:
+        return abort(404)
+    return ARTIFACTS.send(path, meta)
+
+@app.route('/strategies')
+def strategies():
+    return jsonify(STRATEGY_RANKER.ranking())
+
+# PAGINATED PLAYLISTS / CHANNELS (flat listing, formats resolved per entry via /get_info)
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', 50))
+PLAYLIST_MAX_PAGE_SIZE = int(os.environ.get('PLAYLIST_MAX_PAGE_SIZE', 200))
+# Live entry iterators kept per worker so the next page continues where this one stopped
+PLAYLIST_CURSOR_SLOTS = int(os.environ.get('PLAYLIST_CURSOR_SLOTS', 32))
+PLAYLIST_CURSOR_TTL = float(os.environ.get('PLAYLIST_CURSOR_TTL', 600))
+
+def playlist_ydl_opts(platform):
+    """The platform's default extractor options, switched to flat playlist listing"""
+    opts = dict(YDL_POOL.templates(platform)[0][1])
+    opts.pop('playlist_items', None)
+    opts.update({'noplaylist': False, 'extract_flat': 'in_playlist', 'lazy_playlist': True})
+    return opts
+
+def encode_cursor(url, offset, live_id):
+    raw = json.dumps({'u': url, 'o': offset, 'l': live_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(url, offset, live_id) from a cursor, or None if it is malformed"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(data['u']), int(data['o']), data.get('l')
+    except (ValueError, KeyError, TypeError):
+        return None
+
+class PlaylistPager:
+    """A flat listing plus its position. Entries are read page by page, never all at once"""
+
+    def __init__(self, ydl, info):
+        self.ydl = ydl
+        self.info = info
+        entries = info['entries']
+        self.random_access = isinstance(entries, (list, tuple, yt_dlp.utils.PagedList))
+        self.entries = entries if self.random_access else iter(entries)
+        self.position = 0
+
+    def page(self, offset, count):
+        """(entries[offset:offset+count], has_more)"""
+        if isinstance(self.entries, yt_dlp.utils.PagedList):
+            items = list(self.entries.getslice(offset, offset + count + 1))
+        elif self.random_access:
+            items = list(self.entries[offset:offset + count + 1])
+        else:
+            for _ in islice(self.entries, offset - self.position):
+                pass
+            items = list(islice(self.entries, count + 1))
+            if len(items) > count:
+                # Put the look-ahead entry back in front of the rest
+                self.entries = _chain_one(items[count], self.entries)
+            self.position = offset + min(len(items), count)
+        return items[:count], len(items) > count
+
+    def close(self):
+        self.ydl.params.pop('cookiefile', None)  # never write a stale jar back to disk
+        try:
+            self.ydl.close()
+        except Exception as e:
+            print(f"YoutubeDL close error: {e}")
+
+def _chain_one(first, rest):
+    yield first
+    yield from rest
+
+class PlaylistCursors:
+    """Small per-worker LRU of live pagers; a cursor that misses is rebuilt from the URL and offset"""
+
+    def __init__(self, slots, ttl):
+        self.slots = slots
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._live = OrderedDict()
+        self.resumed = 0
+        self.rebuilt = 0
+
+    def take(self, live_id, offset):
+        with self._lock:
+            entry = self._live.pop(live_id, None) if live_id else None
+            if entry is None or entry[1] != offset or entry[2] < time.time():
+                if offset:
+                    self.rebuilt += 1
+                stale = entry[0] if entry else None
+                pager = None
+            else:
+                self.resumed += 1
+                stale, pager = None, entry[0]
+        if stale:
+            stale.close()
+        return pager
+
+    def put(self, pager, offset):
+        live_id = uuid.uuid4().hex
+        evicted = []
+        with self._lock:
+            self._live[live_id] = (pager, offset, time.time() + self.ttl)
+            while len(self._live) > self.slots:
+                evicted.append(self._live.popitem(last=False)[1][0])
+        for old in evicted:
+            old.close()
+        return live_id
+
+    def stats(self):
+        with self._lock:
+            return {'live': len(self._live), 'resumed': self.resumed, 'rebuilt': self.rebuilt}
+
+PLAYLIST_CURSORS = PlaylistCursors(PLAYLIST_CURSOR_SLOTS, PLAYLIST_CURSOR_TTL)
+
+def open_playlist(ydl, url):
+    """Unprocessed extraction, following url redirects; entries stay lazy"""
+    info = ydl.extract_info(url, download=False, process=False)
+    for _ in range(3):
+        if not info or info.get('_type') not in ('url', 'url_transparent'):
+            break
+        info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    return info
+
+def playlist_entry(index, entry, platform):
+    url = entry.get('url') or entry.get('webpage_url')
+    if platform == 'youtube' and entry.get('ie_key') == 'Youtube' and entry.get('id'):
+        url = f"https://www.youtube.com/watch?v={entry['id']}"
+    thumbnails = entry.get('thumbnails') or []
+    nested = entry.get('_type') == 'playlist' or str(entry.get('ie_key', '')).endswith('Tab')
+    return {
+        'index': index,
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'url': url,
+        'duration': entry.get('duration'),
+        'thumbnail': entry.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None),
+        'uploader': entry.get('uploader') or entry.get('channel'),
+        # Nested playlists (channel tabs) are listed with /playlist again; videos go to /get_info
+        'kind': 'playlist' if nested else 'video',
+    }
+
+@app.route('/playlist', methods=['POST'])
+def playlist():
+    """One page of a playlist or channel, without resolving any formats.
+
+    Body: {"url": ...} for the first page, then {"cursor": next_cursor}.
+    Pass an entry's url to /get_info for its formats.
+    """
+    data = request.json or {}
+    try:
+        page_size = max(1, min(int(data.get('page_size') or PLAYLIST_PAGE_SIZE), PLAYLIST_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'page_size must be a number.'}), 400
+    if data.get('cursor'):
+        decoded = decode_cursor(data['cursor'])
+        if decoded is None:
+            return jsonify({'error': 'Invalid cursor.'}), 400
+        url, offset, live_id = decoded
+    elif data.get('url'):
+        url, offset, live_id = data['url'], 0, None
+    else:
+        return jsonify({'error': 'No URL provided.'}), 400
+
+    _, platform, _ = normalize_video_url(url)
+    pager = PLAYLIST_CURSORS.take(live_id, offset)
+    try:
+        if pager is None:
+            print(f"📃 Listing {platform.upper()} playlist from entry {offset}: {url}")
+            ydl = yt_dlp.YoutubeDL(playlist_ydl_opts(platform))
+            try:
+                info = open_playlist(ydl, url)
+            except Exception:
+                ydl.params.pop('cookiefile', None)
+                ydl.close()
+                raise
+            if not info or 'entries' not in info:
+                ydl.params.pop('cookiefile', None)
+                ydl.close()
+                if not info:
+                    return jsonify({'error': 'Could not list this URL.'}), 400
+                # A single video: one-entry page, formats still come from /get_info
+                return jsonify({'playlist': None, 'entries': [playlist_entry(0, info, platform)],
+                                'next_cursor': None})
+            pager = PlaylistPager(ydl, info)
+        items, has_more = pager.page(offset, page_size)
+    except Exception as e:
+        print(f"❌ Playlist error: {e}")
+        if pager is not None:
+            pager.close()
+        return jsonify({'error': f'Playlist listing failed: {str(e)}'}), 400
+
+    info = pager.info
+    next_cursor = None
+    if has_more:
+        next_offset = offset + page_size
+        next_cursor = encode_cursor(url, next_offset, PLAYLIST_CURSORS.put(pager, next_offset))
+    else:
+        pager.close()
+
+    return jsonify({
+        'playlist': {
+            'id': info.get('id'),
+            'title': info.get('title'),
+            'uploader': info.get('uploader') or info.get('channel'),
+            'entry_count': info.get('playlist_count'),
+        },
+        'entries': [playlist_entry(offset + i, entry, platform)
+                    for i, entry in enumerate(items) if isinstance(entry, dict)],
+        'next_cursor': next_cursor,
+    })
+
+# CACHE / SERVICE STATS
+@app.before_request
+def start_request_timer():
+    g.metrics_started = time.perf_counter()
+    g.timing_token = CURRENT_TIMING.set(ServerTiming())
+    if not request.path.startswith('/profiler'):
+        g.profile_ident = PROFILER.start()
+
+@app.after_request
+def observe_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        METRICS.observe('downloader_request_duration_seconds', time.perf_counter() - started, route=route,
+                        method=request.method, status=response.status_code, platform=g.get('metrics_platform', ''))
+    timing = CURRENT_TIMING.get()
+    if timing is not None:
+        response.headers['Server-Timing'] = timing.header()
+    return response
+
+@app.teardown_request
+def finish_request_timing(error=None):
+    ident = g.pop('profile_ident', None)
+    if ident is not None:
+        try:
+            PROFILER.stop(ident, request.url_rule.rule if request.url_rule else 'unmatched')
+        except OSError as e:
+            print(f"⚠️ Could not write profile: {e}")
+    token = g.pop('timing_token', None)
+    if token is not None:
+        CURRENT_TIMING.reset(token)
+
+def host_block_gauges():
+    """Seconds each configured host stays blocked and whether its breaker is open, across workers"""
+    blocked, open_ = [], []
+    now = time.time()
+    for host in sorted(set(RATE_LIMITS) | set(PLATFORM_HOSTS.values())):
+        try:
+            with open(os.path.join(TEMP_DIR, 'limits', host), encoding='utf-8') as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            continue
+        remaining = max(shared['blocked_until'] - now, 0.0)
+        blocked.append(({'host': host}, round(remaining, 1)))
+        open_.append(({'host': host}, int(bool(shared['open'] and remaining))))
+    return blocked, open_
+
+@app.route('/metrics')
+def metrics():
+    usage = shutil.disk_usage(TEMP_DIR)
+    blocked, open_ = host_block_gauges()
+    gauges = [
+        ('downloader_temp_disk_used_bytes', 'Used bytes on the TEMP_DIR filesystem', [({}, usage.used)]),
+        ('downloader_temp_disk_free_bytes', 'Free bytes on the TEMP_DIR filesystem', [({}, usage.free)]),
+        ('downloader_temp_disk_size_bytes', 'Size of the TEMP_DIR filesystem', [({}, usage.total)]),
+        ('downloader_artifact_cache_bytes', 'Bytes held by the artifact cache',
+         [({}, ARTIFACTS.stats()['bytes_cached'])]),
+        ('downloader_host_blocked_seconds', 'Seconds until a rate-limited host may be contacted again', blocked),
+        ('downloader_circuit_open', '1 while a host circuit breaker is open', open_),
+    ]
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def profiler_denied():
+    """Error response unless PROFILER_TOKEN is configured and sent in X-Profiler-Token, else None"""
+    if not PROFILER_TOKEN:
+        return jsonify({'error': 'Profiler disabled; set PROFILER_TOKEN to enable it'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Profiler-Token', ''), PROFILER_TOKEN):
+        return jsonify({'error': 'Invalid profiler token'}), 403
+    return None
+
+@app.route('/profiler', methods=['GET', 'POST'])
+def profiler():
+    """GET lists the settings and dumps; POST {"every": N, "interval": s} changes them (every=0 turns it off)"""
+    denied = profiler_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            PROFILER.configure(data.get('every', 0), data.get('interval'))
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'every must be an integer and interval a number of seconds'}), 400
+    try:
+        dumps = sorted((entry for entry in os.listdir(PROFILER.directory()) if entry.endswith('.folded')),
+                       reverse=True)
+    except OSError:
+        dumps = []
+    return jsonify({'every': PROFILER.every, 'interval': PROFILER.interval,
+                    'profiles_written': PROFILER.profiles_written, 'profiles': dumps})
+
+@app.route('/profiler/<name>')
+def profiler_dump(name):
+    """Collapsed stacks of one sampled request, ready for flamegraph.pl or speedscope"""
+    denied = profiler_denied()
+    if denied:
+        return denied
+    if not name.endswith('.folded') or os.path.basename(name) != name:
+        return jsonify({'error': 'Unknown profile'}), 404
+    path = os.path.join(PROFILER.directory(), name)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Unknown profile'}), 404
+    return send_file(path, mimetype='text/plain')
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'info_cache': INFO_CACHE.stats(),
+        'info_flights': INFO_FLIGHTS.stats(),
+        'merge_flights': MERGE_FLIGHTS.stats(),
+        'segments': SEGMENTS.stats(),
+        'ydl_pool': YDL_POOL.stats(),
+        'http_pools': http_pool_stats(),
+        'rate_limits': HOST_LIMITS.stats(),
+        'artifact_cache': ARTIFACTS.stats(),
+        'janitor': JANITOR.stats(),
+        'jobs': JOBS.stats(),
+        'playlist_cursors': PLAYLIST_CURSORS.stats(),
+        'ffmpeg': FFMPEG_SLOTS.stats(),
+    })
 
 # SUPER ENHANCED YOUTUBE DIRECT DOWNLOAD (Like yt1d.com)
+class DownloadTracker:
+    """Records the files yt-dlp reports through its hooks, so nothing has to be globbed"""
+
+    def __init__(self, progress=None):
+        self.paths = []
+        self.progress = progress
+
+    def _add(self, path):
+        if path and path not in self.paths:
+            self.paths.append(path)
+
+    def progress_hook(self, d):
+        if d.get('status') == 'finished':
+            self._add(d.get('filename') or d.get('info_dict', {}).get('filepath'))
+        if self.progress and d.get('status') in ('downloading', 'finished'):
+            # One counter per format, so video+audio downloads add up
+            label = d.get('info_dict', {}).get('format_id') or 'media'
+            self.progress.set_bytes(label, d.get('downloaded_bytes'),
+                                    d.get('total_bytes') or d.get('total_bytes_estimate'))
+
+    def postprocessor_hook(self, d):
+        # Postprocessors (merge, audio extraction, move) rewrite filepath as they go
+        if d.get('status') == 'finished':
+            self._add(d.get('info_dict', {}).get('filepath'))
+        elif d.get('status') == 'started' and self.progress:
+            self.progress.phase('postprocessing', postprocessor=d.get('postprocessor'))
+
+    def final_path(self, info, work_dir):
+        """Last reported file that still exists inside work_dir"""
+        candidates = [d.get('filepath') for d in info.get('requested_downloads') or []]
+        root = os.path.abspath(work_dir) + os.sep
+        for path in reversed(self.paths + candidates):
+            if path and os.path.abspath(path).startswith(root) and os.path.isfile(path):
+                return path
+        return None
+
+def youtube_artifact_key(video_url, format_id, audio_only):
+    _, platform, canonical_id = normalize_video_url(video_url)
+    return ArtifactCache.key('youtube_download', platform, canonical_id, format_id, bool(audio_only))
+
+def fetch_youtube_file(video_url, format_id, audio_only, progress=None):
+    """Run yt-dlp into a fresh work dir.
+
+    Returns (file_path, filename, work_dir); file_path is None when yt-dlp
+    reported nothing. The caller owns work_dir and must hand it to the
+    janitor. yt-dlp errors propagate after the work dir is scheduled.
+    """
+    # Enhanced yt-dlp configuration for download
+    work_dir = make_work_dir('ytdl-')
+    tracker = DownloadTracker(progress)
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': False,
+        'format': format_id if format_id != 'best' else 'best',
+        'paths': {'home': work_dir, 'temp': work_dir},
+        'outtmpl': '%(title)s.%(ext)s',
+        'retries': 5,
+        'fragment_retries': 10,
+        'socket_timeout': 30,
+        'user_agent': random.choice(USER_AGENTS),
+        'progress_hooks': [tracker.progress_hook],
+        'postprocessor_hooks': [tracker.postprocessor_hook],
+    }
+
+    if audio_only:
+        ydl_opts.update({
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }]
+        })
+
+    # Cookie support
+    cookie_file = 'cookies_youtube.txt'
+    if os.path.exists(cookie_file):
+        ydl_opts['cookiefile'] = cookie_file
+
+    if progress:
+        progress.phase('downloading')
+    limiter = HOST_LIMITS.for_platform('youtube')
+    try:
+        limiter.acquire()
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # One extraction, then download from the same info dict
+            info = ydl.extract_info(video_url, download=True)
+            if 'entries' in info:
+                info = next(iter(info['entries']))
+        limiter.record(200)
+    except Exception as e:
+        if ydl_throttled(e):
+            limiter.record(429)
+        JANITOR.schedule(work_dir)
+        raise
+
+    title = info.get('title', 'video')
+    safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()[:50]
+    file_path = tracker.final_path(info, work_dir)
+    if not file_path:
+        return None, None, work_dir
+
+    file_ext = os.path.splitext(file_path)[1][1:] or ('mp3' if audio_only else 'mp4')
+    filename = f"{safe_title}.{file_ext}"
+    print(f"✅ Download successful: {filename} ({sizeof_fmt(os.path.getsize(file_path))})")
+    return file_path, filename, work_dir
+
 @app.route('/youtube_download', methods=['POST'])
 def youtube_download():
+    progress = None
     try:
         data = request.json
         video_url = data.get('url')
@@ -403,106 +3223,63 @@ def youtube_download():
         
         if not video_url:
             return jsonify({'error': 'No URL provided'}), 400
+        g.metrics_platform = 'youtube'
+
+        if data.get('async'):
+            params = {'url': video_url, 'format_id': format_id, 'audio_only': bool(audio_only)}
+            return submit_job('youtube_download', params, youtube_job_cost(video_url))
 
         print(f"🚀 SUPER YOUTUBE DOWNLOAD: {video_url}")
         print(f"Format: {format_id}, Audio only: {audio_only}")
 
-        # Enhanced yt-dlp configuration for download
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': False,
-            'format': format_id if format_id != 'best' else 'best',
-            'outtmpl': os.path.join(tempfile.gettempdir(), '%(title)s.%(ext)s'),
-            'retries': 5,
-            'fragment_retries': 10,
-            'socket_timeout': 30,
-            'user_agent': random.choice(USER_AGENTS),
-        }
-        
-        if audio_only:
-            ydl_opts.update({
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
-            })
+        progress = PROGRESS.track(None, request_progress_id(data))
+        artifact_key = youtube_artifact_key(video_url, format_id, audio_only)
+        cached_path, cached_meta = ARTIFACTS.lookup(artifact_key)
+        if cached_path:
+            print("⚡ Serving cached artifact")
+            progress.finish()
+            return ARTIFACTS.send(cached_path, cached_meta)
 
-        # Cookie support
-        cookie_file = 'cookies_youtube.txt'
-        if os.path.exists(cookie_file):
-            ydl_opts['cookiefile'] = cookie_file
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Get info first for filename
-            info = ydl.extract_info(video_url, download=False)
-            if 'entries' in info:
-                info = info['entries'][0]
-            
-            title = info.get('title', 'video')
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()[:50]
-            
-            print(f"Downloading: {safe_title}")
-            
-            # Clear temp directory of old files
-            temp_dir = tempfile.gettempdir()
-            old_files = glob.glob(os.path.join(temp_dir, '*'))
-            
-            # Download the video
-            ydl.download([video_url])
-            
-            # Find the downloaded file
-            new_files = glob.glob(os.path.join(temp_dir, '*'))
-            downloaded_files = list(set(new_files) - set(old_files))
-            
-            # Alternative search methods
-            if not downloaded_files:
-                patterns = [
-                    os.path.join(temp_dir, f"*{safe_title[:20]}*"),
-                    os.path.join(temp_dir, f"{safe_title}.*"),
-                    os.path.join(temp_dir, "*.mp4"),
-                    os.path.join(temp_dir, "*.webm"),
-                    os.path.join(temp_dir, "*.mp3"),
-                    os.path.join(temp_dir, "*.m4a"),
-                ]
-                
-                for pattern in patterns:
-                    files = glob.glob(pattern)
-                    if files:
-                        # Get the most recent file
-                        downloaded_files = [max(files, key=os.path.getctime)]
-                        break
-            
-            if downloaded_files:
-                file_path = downloaded_files[0]
-                if os.path.exists(file_path):
-                    file_ext = os.path.splitext(file_path)[1][1:] or ('mp3' if audio_only else 'mp4')
-                    filename = f"{safe_title}.{file_ext}"
-                    
-                    print(f"✅ Download successful: {filename} ({sizeof_fmt(os.path.getsize(file_path))})")
-                    
-                    # Cleanup function
-                    def cleanup():
-                        time.sleep(30)  # Wait longer before cleanup
-                        try:
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                                print(f"🧹 Cleaned up: {file_path}")
-                        except Exception as e:
-                            print(f"Cleanup error: {e}")
-                    
-                    threading.Thread(target=cleanup).start()
-                    
-                    return send_file(file_path, as_attachment=True, download_name=filename)
-            
+        file_path, filename, work_dir = fetch_youtube_file(video_url, format_id, audio_only, progress)
+        if not file_path:
+            JANITOR.schedule(work_dir)
+            progress.finish('Downloaded file not found')
             return jsonify({'error': 'Downloaded file not found'}), 500
 
+        progress.finish()
+        cached_path = ARTIFACTS.publish(artifact_key, file_path, filename)
+        if cached_path:
+            JANITOR.schedule(work_dir)
+            return ARTIFACTS.send(cached_path, {'download_name': filename})
+
+        response = send_file(file_path, as_attachment=True, download_name=filename)
+        return JANITOR.delete_after(response, work_dir)
+
+    except HostThrottled as e:
+        if progress:
+            progress.finish(str(e))
+        return throttled_response(e)
     except Exception as e:
         print(f"❌ YouTube download error: {str(e)}")
+        if progress:
+            progress.finish(str(e))
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 # ENHANCED DOWNLOAD FOR ALL PLATFORMS
+# 'stream' pipes upstream chunks straight to the client, 'buffered' spools to a temp file first
+DOWNLOAD_FILE_MODE = os.environ.get('DOWNLOAD_FILE_MODE', 'stream')
+
+def set_attachment_filename(response, filename):
+    """Set Content-Disposition the way send_file does, with a UTF-8 fallback"""
+    try:
+        filename.encode('ascii')
+        names = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': "UTF-8''" + quote(filename, safe="!#$&+^`|~")}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    return response
+
 @app.route('/download_file', methods=['POST'])
 def download_file():
     try:
@@ -510,12 +3287,21 @@ def download_file():
         file_url = data.get('url')
         file_type = data.get('type', 'video')
         filename = data.get('filename', 'download.mp4')
+        mode = data.get('mode', DOWNLOAD_FILE_MODE)
         
-        print(f"🔽 Enhanced download request - URL: {file_url[:100]}...")
-        print(f"Filename: {filename}")
+        print(f"🔽 Enhanced download request - URL: {file_url[:100] if file_url else 'None'}...")
+        print(f"Filename: {filename}, Mode: {mode}")
         
         if not file_url:
             return jsonify({'error': 'No URL provided'}), 400
+        if mode not in ('stream', 'buffered'):
+            return jsonify({'error': "mode must be 'stream' or 'buffered'"}), 400
+
+        artifact_key = ArtifactCache.key('download_file', canonical_media_key(file_url))
+        cached_path, cached_meta = ARTIFACTS.lookup(artifact_key)
+        if cached_path:
+            print("⚡ Serving cached artifact")
+            return ARTIFACTS.send(cached_path, cached_meta, download_name=filename)
         
         # Enhanced download strategies for different platforms
         download_strategies = []
@@ -540,49 +3326,51 @@ def download_file():
             try:
                 print(f"📥 Download attempt {attempt + 1}")
                 
-                if attempt > 0:
-                    delay = random.uniform(1.0, 3.0)
-                    print(f"⏳ Adding delay: {delay:.1f}s")
-                    time.sleep(delay)
-                
-                response = requests.get(
-                    file_url, 
-                    headers=headers, 
-                    stream=True, 
-                    timeout=60,
-                    allow_redirects=True
-                )
+                response, segmented_total = open_download(file_url, headers, read_timeout=60)
                 
                 print(f"📊 Download response status: {response.status_code}")
+                if response.status_code != 200 and segmented_total is None:
+                    response.close()
                 
-                if response.status_code == 200:
-                    total_size = response.headers.get('content-length')
-                    if total_size:
-                        print(f"📦 File size: {sizeof_fmt(int(total_size))}")
+                if response.status_code == 200 or segmented_total is not None:
+                    if segmented_total is not None:
+                        total_size = str(segmented_total)
+                        print(f"📦 File size: {sizeof_fmt(segmented_total)} "
+                              f"(segmented, {segment_settings(file_url)[0]} connections)")
+                    else:
+                        total_size = response.headers.get('content-length')
+                        if total_size:
+                            print(f"📦 File size: {sizeof_fmt(int(total_size))}")
+                    
+                    if mode == 'stream':
+                        chunks = None
+                        if segmented_total is not None:
+                            chunks = iter_segments(file_url, headers, response, segmented_total, read_timeout=60)
+                        return stream_download(response, filename, total_size, chunks, artifact_key)
                     
                     file_ext = filename.split('.')[-1] if '.' in filename else 'mp4'
-                    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_ext}')
+                    tmp_file = tempfile.NamedTemporaryFile(delete=False, prefix='dl-', suffix=f'.{file_ext}', dir=TEMP_DIR)
                     tmp_file_path = tmp_file.name
                     
                     print("💾 Writing file to temporary location...")
                     downloaded_size = 0
                     
-                    for chunk in response.iter_content(chunk_size=32768):  # Larger chunks for speed
-                        if chunk:
-                            tmp_file.write(chunk)
-                            downloaded_size += len(chunk)
+                    if segmented_total is not None:
+                        tmp_file.close()
+                        downloaded_size = download_segments_to_file(
+                            file_url, headers, tmp_file_path, response, segmented_total, read_timeout=60)
+                    else:
+                        for chunk in response.iter_content(chunk_size=32768):  # Larger chunks for speed
+                            if chunk:
+                                tmp_file.write(chunk)
+                                downloaded_size += len(chunk)
                     
                     tmp_file.close()
                     print(f"✅ Download completed successfully. Size: {sizeof_fmt(downloaded_size)}")
-                    
-                    def cleanup_file():
-                        time.sleep(30)
-                        try:
-                            if os.path.exists(tmp_file_path):
-                                os.unlink(tmp_file_path)
-                                print("🧹 Temporary file cleaned up")
-                        except Exception as e:
-                            print(f"Cleanup error: {e}")
+
+                    cached_path = ARTIFACTS.publish(artifact_key, tmp_file_path, filename, 'application/octet-stream')
+                    if cached_path:
+                        return ARTIFACTS.send(cached_path, {'mimetype': 'application/octet-stream'}, download_name=filename)
                     
                     response_obj = send_file(
                         tmp_file_path, 
@@ -590,21 +3378,21 @@ def download_file():
                         download_name=filename,
                         mimetype='application/octet-stream'
                     )
-                    
-                    threading.Thread(target=cleanup_file).start()
-                    return response_obj
+                    return JANITOR.delete_after(response_obj, tmp_file_path)
                 
                 elif response.status_code == 403:
                     print(f"🚫 Attempt {attempt + 1}: Forbidden (403)")
                     continue
                 elif response.status_code == 429:
+                    # The host limiter now holds the Retry-After; the next attempt waits or fails fast
                     print(f"⏸️ Attempt {attempt + 1}: Rate limited (429)")
-                    time.sleep(random.uniform(5.0, 10.0))
                     continue
                 else:
                     print(f"❌ Attempt {attempt + 1}: Status {response.status_code}")
                     continue
                     
+            except HostThrottled as e:
+                return throttled_response(e)
             except requests.exceptions.Timeout:
                 print(f"⏰ Attempt {attempt + 1}: Timeout")
                 continue
@@ -621,80 +3409,194 @@ def download_file():
         print(f"💥 Download function error: {str(e)}")
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
+def stream_download(response, filename, total_size, chunks=None, artifact_key=None):
+    """Pipe an upstream download to the client.
+
+    `chunks` defaults to the response body; segmented downloads pass the
+    in-order iter_segments() reassembly instead. The first chunk is read
+    before the response is returned, so a connection that dies immediately
+    still raises inside download_file's retry ladder. Once bytes are on the
+    wire, errors can only end the stream. With an artifact key the stream is
+    also teed into the artifact cache and published only if it completes.
+    """
+    segmented = chunks is not None
+    if chunks is None:
+        chunks = response.iter_content(chunk_size=32768)
+    try:
+        first_chunk = next(chunks, b'')
+    except Exception:
+        response.close()
+        raise
+
+    tee_path = None
+    if ARTIFACTS.enabled and artifact_key:
+        tee_path = ARTIFACTS.temp_path(filename.rsplit('.', 1)[-1] if '.' in filename else 'bin')
+
+    def generate():
+        sent = len(first_chunk)
+        counted = 0
+        complete = False
+        tee = open(tee_path, 'wb') if tee_path else None
+        try:
+            if first_chunk:
+                if tee:
+                    tee.write(first_chunk)
+                yield first_chunk
+            for chunk in chunks:
+                if chunk:
+                    sent += len(chunk)
+                    if tee:
+                        tee.write(chunk)
+                    yield chunk
+                    if sent - counted >= METRICS_BYTES_BATCH:
+                        counted = count_proxied_bytes('/download_file', sent, counted)
+            complete = not total_size or sent == int(total_size)
+            print(f"✅ Streamed download completed. Size: {sizeof_fmt(sent)}")
+        except Exception as e:
+            print(f"🚨 Download stream interrupted after {sizeof_fmt(sent)}: {e}")
+        finally:
+            count_proxied_bytes('/download_file', sent, counted)
+            if segmented:
+                chunks.close()
+            response.close()
+            if tee:
+                tee.close()
+                if not (complete and ARTIFACTS.publish(artifact_key, tee_path, filename, 'application/octet-stream')):
+                    ARTIFACTS.discard(tee_path)
+
+    headers = {}
+    # iter_content() decodes gzip/br, so the upstream length only holds for identity bodies
+    if total_size and (segmented or not response.headers.get('Content-Encoding')):
+        headers['Content-Length'] = total_size
+    print("🚰 Streaming download straight to client...")
+    resp = Response(generate(), mimetype='application/octet-stream', headers=headers, direct_passthrough=True)
+    return set_attachment_filename(resp, filename)
+
+# RANGE-AWARE MEDIA RELAY (seeking fetches only the bytes the player asks for)
+STREAM_RANGE_CHUNK = int(os.environ.get('STREAM_RANGE_CHUNK', 8 * 1024 * 1024))
+RELAY_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Last-Modified', 'ETag')
+
+# Serve the relay routes from the asyncio relay (relay.py) when it is deployed alongside
+RELAY_URL = os.environ.get('RELAY_URL', '').rstrip('/')
+
+def relay_redirect():
+    """307 the current relay request to the asyncio relay, or None when it isn't configured"""
+    if not RELAY_URL:
+        return None
+    return redirect(RELAY_URL + request.full_path.rstrip('?'), code=307)
+
+def cap_range_header(range_header):
+    """Range header to forward upstream for a client Range header, or None.
+
+    Open-ended ranges (`bytes=N-`, what players send on every seek) are capped
+    at STREAM_RANGE_CHUNK bytes. The player gets a short 206 and asks for the
+    next range, so a seek never leaves a half-read upstream body behind and
+    the upstream connection goes back to the pool after every range.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r'bytes=(\d+)-', range_header.strip())
+    if match and STREAM_RANGE_CHUNK > 0:
+        start = int(match.group(1))
+        return f'bytes={start}-{start + STREAM_RANGE_CHUNK - 1}'
+    return range_header
+
+def client_range_header():
+    return cap_range_header(request.headers.get('Range'))
+
+def stream_header_strategies(file_url):
+    """Header sets /stream_media tries in order until the upstream accepts one"""
+    if 'googlevideo.com' in file_url or 'youtube.com' in file_url:
+        return [
+            {**get_random_headers(), 'Origin': 'https://www.youtube.com', 'Referer': 'https://www.youtube.com/'},
+            {**get_random_headers(), 'Origin': 'https://www.youtube.com'},
+            {**get_random_headers(), 'Connection': 'keep-alive', 'Origin': 'https://www.youtube.com'},
+        ]
+    return [
+        get_random_headers(),
+        get_random_headers(),
+        {**get_random_headers(), 'Connection': 'keep-alive'},
+    ]
+
+STREAM_MEDIA_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+    'Access-Control-Allow-Origin': '*',
+}
+
+def open_relay_upstream(file_url, headers, read_timeout):
+    """Open the upstream side of a relay for the current GET/HEAD request"""
+    headers = {**headers, 'Accept-Encoding': 'identity'}  # byte offsets must match the file
+    range_header = client_range_header()
+    if range_header:
+        headers['Range'] = range_header
+    else:
+        headers.pop('Range', None)
+    return http_request(request.method, file_url, headers=headers, read_timeout=read_timeout)
+
+def relay_response(upstream, default_content_type, chunk_size=32768, extra_headers=None):
+    """Mirror an upstream 200/206/416 (status, length and range headers) to the client"""
+    headers = {name: upstream.headers[name] for name in RELAY_RESPONSE_HEADERS if name in upstream.headers}
+    headers.setdefault('Content-Type', default_content_type)
+    headers['Accept-Ranges'] = 'bytes'
+    if extra_headers:
+        headers.update(extra_headers)
+
+    if request.method == 'HEAD' or upstream.status_code == 416:
+        upstream.close()
+        return Response(iter(()), status=upstream.status_code, headers=headers)
+
+    route = request.path
+
+    def generate():
+        sent = counted = 0
+        try:
+            for chunk in upstream.raw.stream(chunk_size, decode_content=False):
+                if chunk:
+                    yield chunk
+                    sent += len(chunk)
+                    if sent - counted >= METRICS_BYTES_BATCH:
+                        counted = count_proxied_bytes(route, sent, counted)
+        except Exception as e:
+            print(f"🚨 Streaming error: {e}")
+        finally:
+            count_proxied_bytes(route, sent, counted)
+            upstream.close()
+
+    return Response(generate(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
 # SUPER ENHANCED STREAMING (Works for all platforms including YouTube Shorts)
-@app.route('/stream_media')
+@app.route('/stream_media', methods=['GET', 'HEAD'])
 def stream_media():
     try:
         file_url = request.args.get('url')
         if not file_url:
             return abort(400)
+        redirected = relay_redirect()
+        if redirected:
+            return redirected
         
-        print(f"🎬 Enhanced streaming request for: {file_url[:100]}...")
-        
-        streaming_strategies = []
-        
-        if 'googlevideo.com' in file_url or 'youtube.com' in file_url:
-            # YouTube streaming strategies
-            strategies = [
-                {**get_random_headers(), 'Origin': 'https://www.youtube.com', 'Referer': 'https://www.youtube.com/'},
-                {**get_random_headers(), 'Range': 'bytes=0-1023', 'Origin': 'https://www.youtube.com'},
-                {**get_random_headers(), 'Connection': 'keep-alive', 'Origin': 'https://www.youtube.com'},
-            ]
-            streaming_strategies.extend(strategies)
-        else:
-            # Other platforms
-            streaming_strategies.extend([
-                get_random_headers(),
-                {**get_random_headers(), 'Range': 'bytes=0-1023'},
-                {**get_random_headers(), 'Connection': 'keep-alive'},
-            ])
+        print(f"🎬 Enhanced streaming request for: {file_url[:100]}... (Range: {request.headers.get('Range')})")
         
-        for attempt, headers in enumerate(streaming_strategies):
+        for attempt, headers in enumerate(stream_header_strategies(file_url)):
             try:
-                if attempt > 0:
-                    delay = random.uniform(0.5, 2.0)
-                    time.sleep(delay)
-                
-                response = requests.get(
-                    file_url, 
-                    headers=headers, 
-                    stream=True, 
-                    timeout=20,
-                    allow_redirects=True
-                )
+                response = open_relay_upstream(file_url, headers, read_timeout=20)
                 
                 print(f"📡 Stream attempt {attempt + 1} status: {response.status_code}")
                 
-                if response.status_code in [200, 206]:  # Accept partial content too
-                    def generate():
-                        try:
-                            for chunk in response.iter_content(chunk_size=32768):
-                                if chunk:
-                                    yield chunk
-                        except Exception as e:
-                            print(f"🚨 Streaming error: {e}")
-                            return
-                    
-                    content_type = response.headers.get('Content-Type', 'video/mp4')
-                    print(f"🎭 Streaming content type: {content_type}")
-                    
-                    return Response(
-                        generate(), 
-                        content_type=content_type,
-                        headers={
-                            'Accept-Ranges': 'bytes',
-                            'Cache-Control': 'no-cache, no-store, must-revalidate',
-                            'Pragma': 'no-cache',
-                            'Expires': '0',
-                            'Access-Control-Allow-Origin': '*',
-                        }
-                    )
-                elif response.status_code in [403, 429]:
+                if response.status_code in [200, 206, 416]:  # Partial content and bad ranges go straight back
+                    return relay_response(response, 'video/mp4', extra_headers=STREAM_MEDIA_HEADERS)
+                
+                response.close()
+                if response.status_code in [403, 429]:
                     continue
                 else:
                     print(f"❌ Stream status: {response.status_code}")
                     continue
                     
+            except HostThrottled as e:
+                return throttled_response(e)
             except Exception as e:
                 print(f"🚨 Stream attempt {attempt + 1} error: {e}")
                 continue
@@ -711,56 +3613,1095 @@ def proxy_download():
     file_url = request.args.get('url')
     if not file_url or not file_url.startswith('http'):
         return abort(400)
+    redirected = relay_redirect()
+    if redirected:
+        return redirected
     
     headers = get_random_headers()
     if 'googlevideo.com' in file_url:
         headers.update({'Origin': 'https://www.youtube.com', 'Referer': 'https://www.youtube.com/'})
     
     try:
-        r = requests.get(file_url, stream=True, headers=headers, timeout=45)
+        r = http_get(file_url, headers=headers, read_timeout=45)
         if r.status_code != 200:
+            r.close()
             return abort(r.status_code)
         
         def generate():
-            for chunk in r.iter_content(chunk_size=16384):
-                yield chunk
+            sent = counted = 0
+            try:
+                for chunk in r.iter_content(chunk_size=16384):
+                    yield chunk
+                    sent += len(chunk)
+                    if sent - counted >= METRICS_BYTES_BATCH:
+                        counted = count_proxied_bytes('/proxy_download', sent, counted)
+            finally:
+                count_proxied_bytes('/proxy_download', sent, counted)
+                r.close()  # hand the pooled connection back even when the client disconnects mid-download
                 
         return Response(generate(), content_type=r.headers.get('Content-Type', 'application/octet-stream'))
+    except HostThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         print(f"❌ Proxy download error: {e}")
         return abort(500)
 
-@app.route('/proxy_media')
+@app.route('/proxy_media', methods=['GET', 'HEAD'])
 def proxy_media():
     file_url = request.args.get('url')
     if not file_url or not file_url.startswith('http'):
         return abort(400)
+    redirected = relay_redirect()
+    if redirected:
+        return redirected
     
     headers = get_random_headers()
     if 'googlevideo.com' in file_url:
         headers.update({'Origin': 'https://www.youtube.com', 'Referer': 'https://www.youtube.com/'})
     
     try:
-        r = requests.get(file_url, stream=True, headers=headers, timeout=20)
-        if r.status_code not in [200, 206]:
+        r = open_relay_upstream(file_url, headers, read_timeout=20)
+        if r.status_code not in [200, 206, 416]:
+            r.close()
             return abort(r.status_code)
         
-        def generate():
-            for chunk in r.iter_content(chunk_size=16384):
-                yield chunk
-                
-        content_type = r.headers.get('Content-Type', 'application/octet-stream')
-        return Response(generate(), content_type=content_type)
+        return relay_response(r, 'application/octet-stream', chunk_size=16384)
+    except HostThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         print(f"❌ Proxy media error: {e}")
         return abort(500)
 
+# ADAPTIVE STREAMING (HLS/DASH manifests rewritten to our proxy, segment prefetch)
+SEGMENT_PREFETCH = int(os.environ.get('SEGMENT_PREFETCH', 3))  # segments fetched ahead of the player
+SEGMENT_PREFETCH_WORKERS = int(os.environ.get('SEGMENT_PREFETCH_WORKERS', 4))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+SEGMENT_CACHE_TTL = float(os.environ.get('SEGMENT_CACHE_TTL', 60))
+# Anything bigger (single-file "segments", byte-range playlists) is relayed instead of cached
+SEGMENT_MAX_BYTES = int(os.environ.get('SEGMENT_MAX_BYTES', 16 * 1024 * 1024))
+MANIFEST_MAX_BYTES = int(os.environ.get('MANIFEST_MAX_BYTES', 8 * 1024 * 1024))
+SEGMENT_SEQUENCE_TTL = float(os.environ.get('SEGMENT_SEQUENCE_TTL', 3600))
+ADAPTIVE_PROTOCOLS = ('m3u8', 'm3u8_native', 'http_dash_segments', 'http_dash_segments_generator')
+
+def adaptive_manifest_path(fmt):
+    """/manifest link that plays an HLS/DASH yt-dlp format through this server, or None"""
+    protocol = fmt.get('protocol') or ''
+    if protocol not in ADAPTIVE_PROTOCOLS:
+        return None
+    target = fmt.get('url') if protocol.startswith('m3u8') else fmt.get('manifest_url')
+    return f"/manifest?url={quote(target, safe='')}" if target else None
+
+def proxied_path(route, url, **params):
+    query = f"url={quote(url, safe='')}"
+    for name, value in params.items():
+        query += f'&{name}={value}'
+    return f'{route}?{query}'
+
+class SegmentSequences:
+    """Segment order of every rewritten playlist, kept under TEMP_DIR so /segment on any worker knows what comes next"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = {}  # key -> (mtime, record)
+        self._pruned = 0.0
+
+    def directory(self):
+        return os.path.join(TEMP_DIR, 'sequences')
+
+    @staticmethod
+    def key(manifest_url, index=0):
+        return hashlib.sha1(f'{manifest_url}#{index}'.encode()).hexdigest()[:20]
+
+    def register(self, key, record):
+        os.makedirs(self.directory(), exist_ok=True)
+        path = os.path.join(self.directory(), f'{key}.json')
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self):
+        now = time.time()
+        with self._lock:
+            if now - self._pruned < 60:
+                return
+            self._pruned = now
+        for entry in os.listdir(self.directory()):
+            path = os.path.join(self.directory(), entry)
+            try:
+                if now - os.stat(path).st_mtime > SEGMENT_SEQUENCE_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _load(self, key):
+        if not re.fullmatch(r'[0-9a-f]{20}', key or ''):
+            return None
+        path = os.path.join(self.directory(), f'{key}.json')
+        try:
+            mtime = os.stat(path).st_mtime
+            with self._lock:
+                loaded = self._loaded.get(key)
+            if loaded and loaded[0] == mtime:
+                return loaded[1]
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if len(self._loaded) >= 1024:
+                self._loaded.clear()
+            self._loaded[key] = (mtime, record)
+        return record
+
+    def following(self, args, count):
+        """URLs of up to `count` segments after the one a /segment request asked for"""
+        record = self._load(args.get('seq'))
+        if record is None or count <= 0:
+            return []
+        try:
+            if 'urls' in record:
+                start = int(args['n']) - record['first'] + 1
+                return record['urls'][max(start, 0):max(start + count, 0)]
+            values = {'RepresentationID': args.get('rep'), 'Bandwidth': args.get('bw')}
+            if 'times' in record:
+                times = record['times']
+                start = bisect.bisect_right(times, int(args['t']))
+                return [expand_dash_template(record['template'], {**values, 'Time': t})
+                        for t in times[start:start + count]]
+            number = int(args['n'])
+            return [expand_dash_template(record['template'], {**values, 'Number': number + i})
+                    for i in range(1, count + 1)]
+        except (KeyError, TypeError, ValueError):
+            return []
+
+SEQUENCES = SegmentSequences()
+
+class SegmentCache:
+    """Small per-worker LRU of media segments, filled on demand and ahead of the player"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # url -> (expires, body, content_type, prefetched)
+        self._bytes = 0
+        self._flights = SingleFlight()
+        self._executor = None
+        self._pending = set()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_dropped = 0
+        self.evictions = 0
+
+    def _lookup(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            expires, body, content_type, prefetched = entry
+            if expires < time.time():
+                del self._entries[url]
+                self._bytes -= len(body)
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            if prefetched:
+                self.prefetch_hits += 1
+                self._entries[url] = (expires, body, content_type, False)
+            return body, content_type
+
+    def _store(self, url, body, content_type, prefetched):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old:
+                self._bytes -= len(old[1])
+            self._entries[url] = (time.time() + self.ttl, body, content_type, prefetched)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _fetch(self, url, prefetched):
+        """(status, body, content_type); status 'relay' when the segment is too big to cache"""
+        response = http_get(url, headers=media_request_headers(url), read_timeout=20)
+        with response:
+            if response.status_code != 200:
+                return response.status_code, None, None
+            if int(response.headers.get('Content-Length') or 0) > SEGMENT_MAX_BYTES:
+                return 'relay', None, None
+            chunks, size = [], 0
+            for chunk in response.iter_content(chunk_size=65536):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > SEGMENT_MAX_BYTES:
+                    return 'relay', None, None
+        body = b''.join(chunks)
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        self._store(url, body, content_type, prefetched)
+        return 200, body, content_type
+
+    def get(self, url):
+        """(status, body, content_type, source) for a segment; source is hit, miss or shared"""
+        cached = self._lookup(url)
+        if cached is not None:
+            return 200, *cached, 'hit'
+        (status, body, content_type), shared = self._flights.do(url, lambda: self._fetch(url, False))
+        with self._lock:
+            if shared:
+                self.shared += 1
+            else:
+                self.misses += 1
+        return status, body, content_type, 'shared' if shared else 'miss'
+
+    def prefetch(self, urls):
+        for url in urls:
+            with self._lock:
+                if url in self._entries or url in self._pending:
+                    continue
+                if len(self._pending) >= SEGMENT_PREFETCH_WORKERS * 4:
+                    self.prefetch_dropped += 1
+                    continue
+                self._pending.add(url)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=SEGMENT_PREFETCH_WORKERS,
+                                                        thread_name_prefix='prefetch')
+            self._executor.submit(self._prefetch_one, url)
+
+    def _prefetch_one(self, url):
+        try:
+            (status, _, _), shared = self._flights.do(url, lambda: self._fetch(url, True))
+            if status == 200 and not shared:
+                with self._lock:
+                    self.prefetched += 1
+        except HostThrottled:
+            pass  # the player's own request will get the 503
+        except Exception as e:
+            print(f"⚠️ Segment prefetch failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes_cached': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'prefetched': self.prefetched,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_pending': len(self._pending),
+                'prefetch_dropped': self.prefetch_dropped,
+                'evictions': self.evictions,
+                'flights': self._flights.stats(),
+            }
+
+SEGMENTS = SegmentCache(SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_TTL)
+
+_HLS_URI = re.compile(r'URI="([^"]*)"')
+# Tags whose URI is another playlist rather than a segment, key or init section
+_HLS_PLAYLIST_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:', '#EXT-X-RENDITION-REPORT:')
+
+def rewrite_hls(text, manifest_url):
+    """Point every playlist, segment, key and init section of an M3U8 at /manifest or /segment"""
+    lines = text.splitlines()
+    master = any(line.startswith('#EXT-X-STREAM-INF') for line in lines)
+    media_sequence = 0
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            try:
+                media_sequence = int(line.split(':', 1)[1].strip() or 0)
+            except ValueError:
+                pass  # the line is passed through as-is; /segment numbering just starts at 0
+    key = SegmentSequences.key(manifest_url)
+    segments, out = [], []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            route = '/manifest' if stripped.startswith(_HLS_PLAYLIST_TAGS) else '/segment'
+            out.append(_HLS_URI.sub(
+                lambda m: f'URI="{proxied_path(route, urljoin(manifest_url, m.group(1)))}"', line))
+        elif not stripped:
+            out.append(line)
+        elif master:
+            out.append(proxied_path('/manifest', urljoin(manifest_url, stripped)))
+        else:
+            segments.append(urljoin(manifest_url, stripped))
+            out.append(proxied_path('/segment', segments[-1], seq=key, n=media_sequence + len(segments) - 1))
+    if segments:
+        SEQUENCES.register(key, {'first': media_sequence, 'urls': segments})
+    return '\n'.join(out) + '\n'
+
+_DASH_IDENTIFIER = re.compile(r'\$(RepresentationID|Number|Bandwidth|Time)(?:%0(\d+)d)?\$')
+_DASH_QUERY = {'Number': 'n', 'Time': 't', 'RepresentationID': 'rep', 'Bandwidth': 'bw'}
+
+def expand_dash_template(template, values):
+    def substitute(match):
+        value = values.get(match.group(1))
+        if value is None:
+            return match.group(0)
+        return str(value).zfill(int(match.group(2) or 0))
+    return _DASH_IDENTIFIER.sub(substitute, template).replace('$$', '$')
+
+def dash_template_path(template, **params):
+    """/segment path for a DASH URL template, leaving its $identifiers$ for the player to fill in.
+
+    The identifiers are also repeated as query parameters so /segment can
+    rebuild the following segments' URLs.
+    """
+    query, last = [], 0
+    for match in _DASH_IDENTIFIER.finditer(template):
+        query.append(quote(template[last:match.start()], safe=''))
+        query.append(match.group(0))
+        last = match.end()
+    query.append(quote(template[last:], safe=''))
+    path = f"/segment?url={''.join(query)}"
+    for name, value in params.items():
+        path += f'&{name}={value}'
+    if params:
+        for name in dict.fromkeys(match.group(1) for match in _DASH_IDENTIFIER.finditer(template)):
+            path += f'&{_DASH_QUERY[name]}=${name}$'
+    return path
+
+def _timeline_times(timeline, limit=10000):
+    times, t = [], 0
+    for s in timeline:
+        t = int(s.get('t', t))
+        duration = int(s.get('d'))
+        for _ in range(max(int(s.get('r', 0)), 0) + 1):  # r=-1 (repeat until the next S) counts once
+            times.append(t)
+            t += duration
+            if len(times) >= limit:
+                return times
+    return times
+
+_XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+def xml_to_string(root, declarations):
+    """Serialize an element tree with the document's own namespace prefixes"""
+    # Not ET.tostring: it takes prefixes from ElementTree's process-wide registry, which
+    # untrusted manifests must not write to
+    prefixes, taken = {_XML_NAMESPACE: 'xml'}, {'xml'}
+    for prefix, uri in declarations:
+        if uri not in prefixes and prefix not in taken:
+            prefixes[uri] = prefix
+            taken.add(prefix)
+    attribute_prefixes, used = {}, {}
+
+    def qualify(name, attribute=False):
+        if not name.startswith('{'):
+            return name
+        uri, local = name[1:].split('}', 1)
+        prefix = prefixes.get(uri)
+        if attribute and not prefix:
+            # Attributes never take the default namespace
+            prefix = attribute_prefixes.get(uri)
+            if prefix is None:
+                prefix = next(f'ns{n}' for n in range(len(taken) + 1) if f'ns{n}' not in taken)
+                attribute_prefixes[uri] = prefix
+                taken.add(prefix)
+        elif prefix is None:
+            prefix = next(f'ns{n}' for n in range(len(taken) + 1) if f'ns{n}' not in taken)
+            prefixes[uri] = prefix
+            taken.add(prefix)
+        if uri != _XML_NAMESPACE:
+            used[prefix] = uri
+        return f'{prefix}:{local}' if prefix else local
+
+    def attribute(value):
+        return escape(value, {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#09;'})
+
+    parts = []
+
+    def write(node):
+        tag = qualify(node.tag)
+        attributes = ''.join(f' {qualify(k, True)}="{attribute(v)}"' for k, v in node.items())
+        parts.append(f'<{tag}{attributes}')
+        if len(node) or node.text:
+            parts.append('>' + escape(node.text or ''))
+            for child in node:
+                write(child)
+            parts.append(f'</{tag}>')
+        else:
+            parts.append(' />')
+        parts.append(escape(node.tail or ''))
+
+    write(root)
+    xmlns = ''.join(f' xmlns:{p}="{attribute(u)}"' if p else f' xmlns="{attribute(u)}"'
+                    for p, u in sorted(used.items()))
+    root_tag = parts[0]
+    return root_tag + xmlns + ''.join(parts[1:])
+
+def rewrite_dash(text, manifest_url):
+    """Point every segment and init section of an MPD at /segment, single-file representations at /proxy_media"""
+    declarations = [ns for _, ns in ET.iterparse(io.StringIO(text), events=['start-ns'])]
+    root = ET.fromstring(text)
+    ns = root.tag[1:].split('}')[0] if root.tag.startswith('{') else ''
+
+    def q(name):
+        return f'{{{ns}}}{name}' if ns else name
+
+    counter = [0]
+
+    def rewrite_template(template, base):
+        timeline = template.find(q('SegmentTimeline'))
+        if template.get('initialization'):
+            template.set('initialization', dash_template_path(urljoin(base, template.get('initialization'))))
+        media = template.get('media')
+        if not media:
+            return
+        absolute = urljoin(base, media)
+        key = SegmentSequences.key(manifest_url, counter[0])
+        counter[0] += 1
+        if '$Time$' in absolute and timeline is not None:
+            SEQUENCES.register(key, {'template': absolute, 'times': _timeline_times(timeline)})
+        elif _DASH_IDENTIFIER.search(absolute) and '$Number' in absolute:
+            SEQUENCES.register(key, {'template': absolute})
+        else:
+            key = None
+        template.set('media', dash_template_path(absolute, **({'seq': key} if key else {})))
+
+    def rewrite_list(segment_list, base):
+        initialization = segment_list.find(q('Initialization'))
+        if initialization is not None and initialization.get('sourceURL'):
+            initialization.set('sourceURL', proxied_path('/segment', urljoin(base, initialization.get('sourceURL'))))
+        urls = [urljoin(base, s.get('media')) for s in segment_list.findall(q('SegmentURL')) if s.get('media')]
+        key = SegmentSequences.key(manifest_url, counter[0])
+        counter[0] += 1
+        first = int(segment_list.get('startNumber', 1))
+        if urls:
+            SEQUENCES.register(key, {'first': first, 'urls': urls})
+        index = first
+        for s in segment_list.findall(q('SegmentURL')):
+            if s.get('media'):
+                s.set('media', proxied_path('/segment', urljoin(base, s.get('media')), seq=key, n=index))
+                index += 1
+
+    def visit(node, parent_base, inherited):
+        base_elements = node.findall(q('BaseURL'))
+        base = urljoin(parent_base, base_elements[0].text.strip()) if base_elements and base_elements[0].text \
+            else parent_base
+        template, segment_list = node.find(q('SegmentTemplate')), node.find(q('SegmentList'))
+        representation = node.tag == q('Representation')
+        if representation and base_elements and template is None and segment_list is None \
+                and inherited is not None and inherited.tag == q('SegmentTemplate'):
+            # The shared template resolves against this representation's own BaseURL
+            template = copy.deepcopy(inherited)
+            node.insert(0, template)
+        for element in base_elements:
+            node.remove(element)
+        if template is not None:
+            pristine = copy.deepcopy(template)  # what representations below copy, before our rewrite
+            rewrite_template(template, base)
+        if segment_list is not None:
+            rewrite_list(segment_list, base)
+        segment_base = node.find(q('SegmentBase'))
+        if segment_base is not None:
+            for child in segment_base:
+                if child.get('sourceURL'):
+                    child.set('sourceURL', proxied_path('/segment', urljoin(base, child.get('sourceURL'))))
+        scoped = pristine if template is not None else segment_list if segment_list is not None else inherited
+        if representation and scoped is None:
+            # Single-file representation fetched with Range requests: relay it, don't cache it
+            element = ET.Element(q('BaseURL'))
+            element.text = proxied_path('/proxy_media', base)
+            node.insert(0, element)
+        for child in node:
+            if child.tag in (q('Period'), q('AdaptationSet'), q('Representation')):
+                visit(child, base, scoped)
+
+    for location in root.findall(q('Location')):
+        location.text = proxied_path('/manifest', urljoin(manifest_url, (location.text or '').strip()))
+    visit(root, manifest_url, None)
+    return '<?xml version="1.0" encoding="utf-8"?>\n' + xml_to_string(root, declarations)
+
+@app.route('/manifest')
+def manifest():
+    """HLS playlist or DASH MPD with every URL rewritten to go through this server"""
+    manifest_url = request.args.get('url')
+    if not manifest_url or not manifest_url.startswith('http'):
+        return abort(400)
+    try:
+        with span('upstream', 'manifest'):
+            r = http_get(manifest_url, headers=media_request_headers(manifest_url), read_timeout=20)
+            with r:
+                body = b''.join(islice(r.iter_content(chunk_size=65536), MANIFEST_MAX_BYTES // 65536 + 1)) \
+                    if r.status_code == 200 else b''
+        if r.status_code != 200:
+            return jsonify({'error': f'Manifest request failed with {r.status_code}'}), r.status_code
+        if len(body) > MANIFEST_MAX_BYTES:
+            return jsonify({'error': 'Manifest too large'}), 502
+        text = body.decode('utf-8-sig', errors='replace')
+        # Relative URLs resolve against where the manifest ended up after redirects
+        with span('rewrite'):
+            if text.lstrip().startswith('#EXTM3U'):
+                rewritten, mimetype = rewrite_hls(text, r.url), 'application/vnd.apple.mpegurl'
+            elif '<MPD' in text[:4096]:
+                rewritten, mimetype = rewrite_dash(text, r.url), 'application/dash+xml'
+            else:
+                return jsonify({'error': 'Not an HLS or DASH manifest'}), 502
+    except HostThrottled as e:
+        return throttled_response(e)
+    except ET.ParseError as e:
+        print(f"❌ Bad DASH manifest: {e}")
+        return jsonify({'error': 'Malformed DASH manifest'}), 502
+    except Exception as e:
+        print(f"❌ Manifest error: {e}")
+        return abort(500)
+    # Live playlists change every few seconds
+    return Response(rewritten, mimetype=mimetype, headers={'Cache-Control': 'no-cache'})
+
+@app.route('/segment', methods=['GET', 'HEAD'])
+def segment():
+    """One media segment from the segment cache; starts prefetching the next SEGMENT_PREFETCH"""
+    file_url = request.args.get('url')
+    if not file_url or not file_url.startswith('http'):
+        return abort(400)
+    if request.headers.get('Range'):
+        # Byte-range segments share one file; /proxy_media (or the relay) serves ranges
+        return redirect(proxied_path('/proxy_media', file_url), 307)
+    SEGMENTS.prefetch(SEQUENCES.following(request.args, SEGMENT_PREFETCH))
+    try:
+        with span('segment'):
+            status, body, content_type, source = SEGMENTS.get(file_url)
+    except HostThrottled as e:
+        return throttled_response(e)
+    except Exception as e:
+        print(f"❌ Segment error: {e}")
+        return abort(502)
+    if status == 'relay':
+        return redirect(proxied_path('/proxy_media', file_url), 307)
+    if status != 200:
+        return jsonify({'error': f'Segment request failed with {status}'}), status
+    count_proxied_bytes('/segment', len(body), 0)
+    return Response(body, content_type=content_type, headers={'X-Segment-Cache': source})
+
 # SUPER ENHANCED MERGE (Works with all platforms)
+# 'file' downloads both inputs then muxes to disk, 'pipe' streams fragmented MP4 while downloading
+MERGE_MODE = os.environ.get('MERGE_MODE', 'file')
+
+def media_request_headers(url):
+    headers = get_random_headers()
+    if 'googlevideo.com' in url:
+        headers.update({
+            'Origin': 'https://www.youtube.com',
+            'Referer': 'https://www.youtube.com/',
+        })
+    return headers
+
+def enhanced_download(url, filename, file_type="video", progress=None):
+    for attempt in range(5):  # 5 attempts
+        try:
+            headers = media_request_headers(url)
+            r, segmented_total = open_download(url, headers, read_timeout=60)
+            
+            if segmented_total is not None:
+                print(f"📥 Downloading {file_type} ({segment_settings(url)[0]} connections)...")
+                on_bytes = None
+                if progress:
+                    progress.start_stream(file_type, segmented_total)
+                    on_bytes = lambda count: progress.add_bytes(file_type, count)
+                downloaded = download_segments_to_file(url, headers, filename, r, segmented_total, read_timeout=60,
+                                                       on_bytes=on_bytes)
+                print(f"✅ {file_type} downloaded: {sizeof_fmt(downloaded)}")
+                return True
+            elif r.status_code == 200:
+                print(f"📥 Downloading {file_type}...")
+                if progress:
+                    length = r.headers.get('Content-Length')
+                    progress.start_stream(file_type, int(length) if length and length.isdigit() else None)
+                with open(filename, 'wb') as f:
+                    downloaded = 0
+                    for chunk in r.iter_content(chunk_size=32768):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            if progress:
+                                progress.add_bytes(file_type, len(chunk))
+                
+                print(f"✅ {file_type} downloaded: {sizeof_fmt(downloaded)}")
+                return True
+            else:
+                r.close()
+                print(f"❌ {file_type} attempt {attempt + 1} failed with status {r.status_code}")
+                
+        except HostThrottled:
+            raise
+        except Exception as e:
+            print(f"❌ {file_type} attempt {attempt + 1} error: {e}")
+            
+    return False
+
+def _iter_response(r, chunk_size=65536):
+    try:
+        yield from r.iter_content(chunk_size=chunk_size)
+    finally:
+        r.close()
+
+def open_media_stream(url, file_type="video"):
+    """Open an upstream body as an in-order chunk iterator, or None.
+
+    Same retry ladder as enhanced_download(), but only up to the response
+    headers: once the iterator is handed out nothing can be retried.
+    """
+    for attempt in range(5):  # 5 attempts
+        try:
+            headers = media_request_headers(url)
+            r, segmented_total = open_download(url, headers, read_timeout=60)
+            
+            if segmented_total is not None:
+                return iter_segments(url, headers, r, segmented_total, read_timeout=60)
+            elif r.status_code == 200:
+                return _iter_response(r)
+            else:
+                r.close()
+                print(f"❌ {file_type} stream attempt {attempt + 1} failed with status {r.status_code}")
+                
+        except HostThrottled:
+            raise
+        except Exception as e:
+            print(f"❌ {file_type} stream attempt {attempt + 1} error: {e}")
+            
+    return None
+
+# CODEC-AWARE MERGE PLANNER (stream-copy whenever the container allows it)
+MERGE_DEFAULT_CONTAINER = os.environ.get('MERGE_DEFAULT_CONTAINER', 'auto')
+# Rough AAC encode speed (x realtime) used to estimate what a skipped transcode would have cost
+MERGE_AAC_ENCODE_SPEED = float(os.environ.get('MERGE_AAC_ENCODE_SPEED', 60))
+
+VIDEO_CODEC_FAMILIES = {
+    'avc1': 'h264', 'avc3': 'h264', 'h264': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc', 'hevc': 'hevc', 'h265': 'hevc',
+    'av01': 'av1', 'av1': 'av1',
+    'vp09': 'vp9', 'vp9': 'vp9', 'vp8': 'vp8',
+}
+AUDIO_CODEC_FAMILIES = {
+    'mp4a': 'aac', 'aac': 'aac', 'opus': 'opus', 'vorbis': 'vorbis',
+    'mp3': 'mp3', 'ac-3': 'ac3', 'ac3': 'ac3', 'ec-3': 'eac3', 'eac3': 'eac3', 'flac': 'flac',
+}
+MERGE_CONTAINERS = {
+    # container: (ffmpeg muxer, extension, mimetype, copyable video, copyable audio)
+    'mp4': ('mp4', 'mp4', 'video/mp4', {'h264', 'hevc', 'av1', 'vp9'}, {'aac', 'mp3', 'ac3', 'eac3'}),
+    'webm': ('webm', 'webm', 'video/webm', {'vp8', 'vp9', 'av1'}, {'opus', 'vorbis'}),
+    'mkv': ('matroska', 'mkv', 'video/x-matroska', set(VIDEO_CODEC_FAMILIES.values()), set(AUDIO_CODEC_FAMILIES.values())),
+}
+# What each container transcodes audio to when the source can't be copied
+MERGE_AUDIO_FALLBACK = {
+    'mp4': ('aac', ['-c:a', 'aac', '-b:a', '128k']),
+    'webm': ('opus', ['-c:a', 'libopus', '-b:a', '128k']),
+    'mkv': ('aac', ['-c:a', 'aac', '-b:a', '128k']),
+}
+
+def codec_family(codec, families):
+    """Normalise a yt-dlp codec string ('avc1.640028', 'mp4a.40.2') or ffprobe name"""
+    if not codec or codec == 'none':
+        return None
+    return families.get(codec.lower().split('.')[0])
+
+def probe_media(path):
+    """(codec_name, duration) of the first stream in a file via ffprobe, or (None, None)"""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_name:format=duration', '-of', 'json', path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+        probed = json.loads(result.stdout or b'{}')
+        streams = probed.get('streams') or [{}]
+        duration = probed.get('format', {}).get('duration')
+        return streams[0].get('codec_name'), float(duration) if duration else None
+    except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+        print(f"ffprobe unavailable for {os.path.basename(path)}: {e}")
+        return None, None
+
+def plan_merge(vcodec, acodec, container='auto', duration=None):
+    """Pick the output container and per-stream copy/transcode for a video+audio pair.
+
+    'auto' prefers an all-copy mp4, then an all-copy webm, then mkv (which
+    holds any pair). An explicit container copies what it can and transcodes
+    only the audio it cannot carry. Video is never re-encoded; if the
+    requested container can't hold it, the plan moves to mkv. Unknown codecs
+    fall back to the historical mp4 + AAC plan.
+    """
+    video = codec_family(vcodec, VIDEO_CODEC_FAMILIES)
+    audio = codec_family(acodec, AUDIO_CODEC_FAMILIES)
+
+    if container not in MERGE_CONTAINERS:
+        if video is None or audio is None:
+            container = 'mp4'
+        else:
+            container = next(
+                (name for name in ('mp4', 'webm', 'mkv')
+                 if video in MERGE_CONTAINERS[name][3] and audio in MERGE_CONTAINERS[name][4]),
+                'mkv')
+    if video is not None and video not in MERGE_CONTAINERS[container][3]:
+        container = 'mkv'
+
+    muxer, ext, mimetype, _, audio_ok = MERGE_CONTAINERS[container]
+    copy_audio = audio is not None and audio in audio_ok
+    out_audio, audio_args = ('copy', ['-c:a', 'copy']) if copy_audio else MERGE_AUDIO_FALLBACK[container]
+
+    return {
+        'container': container,
+        'muxer': muxer,
+        'ext': ext,
+        'mimetype': mimetype,
+        'vcodec': video or 'unknown',
+        'acodec': audio or 'unknown',
+        'video': 'copy',
+        'audio': out_audio,
+        'codec_args': ['-c:v', 'copy'] + audio_args,
+        'transcode_saved_est': round(duration / MERGE_AAC_ENCODE_SPEED, 2) if copy_audio and duration else None,
+    }
+
+def merge_hints(data):
+    """Codec hints and container preference a /merge client may pass through from /get_info"""
+    hints = {key: data.get(key) for key in ('vcodec', 'acodec', 'duration') if data.get(key)}
+    hints['container'] = data.get('container', MERGE_DEFAULT_CONTAINER)
+    return hints
+
+def merge_plan_headers(plan, ffmpeg_seconds=None):
+    headers = {
+        'X-Merge-Plan': (f"container={plan['container']}; video={plan['video']}; "
+                         f"audio={plan['audio']}; source={plan['vcodec']}+{plan['acodec']}"),
+    }
+    if ffmpeg_seconds is not None:
+        headers['X-Merge-Ffmpeg-Seconds'] = f'{ffmpeg_seconds:.2f}'
+    if plan['transcode_saved_est'] is not None:
+        headers['X-Merge-Transcode-Saved-Est'] = f"{plan['transcode_saved_est']:.2f}"
+    return headers
+
+# CPU-heavy ffmpeg runs are capped separately from request and job concurrency
+FFMPEG_CONCURRENCY = int(os.environ.get('FFMPEG_CONCURRENCY', max(1, (os.cpu_count() or 2) // 2)))
+
+class FFmpegSlots:
+    """Counting semaphore around ffmpeg runs that also records how long callers queue for it"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._sem = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.runs = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self):
+        with self._lock:
+            self.waiting += 1
+        started = time.monotonic()
+        self._sem.acquire()
+        waited = time.monotonic() - started
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.runs += 1
+            self.wait_seconds += waited
+        if waited > 1:
+            print(f"⏳ Waited {waited:.1f}s for an ffmpeg slot")
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._sem.release()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': self.waiting,
+                'runs': self.runs,
+                'avg_wait_seconds': round(self.wait_seconds / self.runs, 3) if self.runs else 0.0,
+            }
+
+FFMPEG_SLOTS = FFmpegSlots(FFMPEG_CONCURRENCY)
+
+# Seconds a finished merge dir waits for MERGE_FLIGHTS waiters to pin it
+MERGE_SHARE_GRACE = float(os.environ.get('MERGE_SHARE_GRACE', 30))
+
+def merge_media(video_url, audio_url, hints, progress=None):
+    """Download both inputs and mux them with ffmpeg.
+
+    Returns (result, error_message, status) with result holding the output
+    path, merge plan and ffmpeg wall time. The work directory is handed to
+    the janitor with MERGE_SHARE_GRACE seconds for every caller sharing this
+    result through MERGE_FLIGHTS to pin it with JANITOR.pin().
+    """
+    td = make_work_dir('merge-')
+
+    result = None
+    try:
+        try:
+            result, error, status = _merge_into(td, video_url, audio_url, hints, progress)
+        except Exception as e:
+            if progress:
+                progress.finish(str(e))
+            raise
+        if progress:
+            progress.finish(error)
+        if result:
+            # The rename into the cache happens before any waiter opens the file
+            artifact_key = ArtifactCache.key(
+                'merge', canonical_media_key(video_url), canonical_media_key(audio_url), hints['container'])
+            cached_path = ARTIFACTS.publish(
+                artifact_key, result['path'], f"merged_video.{result['plan']['ext']}", result['plan']['mimetype'])
+            if cached_path:
+                ARTIFACTS.annotate(cached_path, plan=result['plan'])
+                result.update(path=cached_path, cached=True)
+        return result, error, status
+    finally:
+        JANITOR.schedule(td, 0 if (result or {}).get('cached') else MERGE_SHARE_GRACE)
+
+def _merge_into(td, video_url, audio_url, hints, progress=None):
+    video_path = os.path.join(td, 'video.input')
+    audio_path = os.path.join(td, 'audio.input')
+
+    # Download both files concurrently, each with its own retry ladder
+    if progress:
+        progress.phase('downloading')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        video_ok = submit_timed(executor, 'download', 'video', enhanced_download, video_url, video_path, "Video", progress)
+        audio_ok = submit_timed(executor, 'download', 'audio', enhanced_download, audio_url, audio_path, "Audio", progress)
+        video_ok, audio_ok = video_ok.result(), audio_ok.result()
+
+    if not video_ok:
+        return None, 'Failed to download video after multiple attempts', 400
+
+    if not audio_ok:
+        return None, 'Failed to download audio after multiple attempts', 400
+
+    # What ffprobe sees beats client hints, which may describe a different format
+    with span('probe'):
+        vcodec, _ = probe_media(video_path)
+        acodec, duration = probe_media(audio_path)
+    plan = plan_merge(
+        vcodec or hints.get('vcodec'),
+        acodec or hints.get('acodec'),
+        hints.get('container'),
+        duration or hints.get('duration'),
+    )
+    output_path = os.path.join(td, f"merged.{plan['ext']}")
+    print(f"🧭 {merge_plan_headers(plan)['X-Merge-Plan']}")
+
+    print("🔧 Starting enhanced FFmpeg merge...")
+
+    # Enhanced FFmpeg command
+    cmd = [
+        'ffmpeg', '-y',
+        '-i', video_path,
+        '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        *plan['codec_args'],
+        *(['-movflags', 'faststart'] if plan['container'] == 'mp4' else []),
+        '-avoid_negative_ts', 'make_zero',
+        '-fflags', '+genpts',
+        '-f', plan['muxer'],
+        output_path
+    ]
+
+    if progress:
+        progress.ffmpeg_duration(duration or hints.get('duration'))
+        progress.phase('queued_for_ffmpeg' if FFMPEG_SLOTS.waiting or FFMPEG_SLOTS.active >= FFMPEG_SLOTS.limit
+                       else 'merging')
+    with FFMPEG_SLOTS.slot():
+        if progress:
+            progress.phase('transcoding' if plan['audio'] != 'copy' or plan['video'] != 'copy' else 'merging')
+        started = time.time()
+        with span('ffmpeg', plan['video'] if plan['video'] == plan['audio'] else 'transcode'):
+            returncode, stderr = run_ffmpeg(cmd, progress, timeout=300)
+        ffmpeg_seconds = time.time() - started
+
+    if returncode != 0:
+        error_msg = stderr.decode(errors='replace')
+        print(f"💥 FFmpeg error: {error_msg}")
+        return None, f'FFmpeg merge failed: {error_msg[:200]}', 500
+
+    if not os.path.exists(output_path):
+        return None, 'Merged file not created', 500
+
+    file_size = os.path.getsize(output_path)
+    print(f"✅ Enhanced merge completed successfully ({sizeof_fmt(file_size)}, ffmpeg {ffmpeg_seconds:.1f}s)")
+    return {'path': output_path, 'plan': plan, 'ffmpeg_seconds': ffmpeg_seconds}, None, 200
+
+def _feed_pipe(chunks, write_fd, file_type, progress=None):
+    """Copy an upstream chunk iterator into one of ffmpeg's input pipes"""
+    fed = 0
+    try:
+        with os.fdopen(write_fd, 'wb') as pipe:
+            for chunk in chunks:
+                if chunk:
+                    pipe.write(chunk)
+                    fed += len(chunk)
+                    if progress:
+                        progress.add_bytes(file_type, len(chunk))
+        print(f"✅ {file_type} piped: {sizeof_fmt(fed)}")
+    except BrokenPipeError:
+        print(f"🔌 ffmpeg closed the {file_type} pipe after {sizeof_fmt(fed)}")
+    except Exception as e:
+        print(f"❌ {file_type} pipe error after {sizeof_fmt(fed)}: {e}")
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def stream_merge(video_url, audio_url, hints, progress=None):
+    """Mux while downloading: upstream bodies -> ffmpeg pipes -> fragmented output -> client.
+
+    Inputs are fed through two pipes and ffmpeg writes to stdout, so
+    download, mux and delivery overlap and no merged file is ever written.
+    Inputs must be streamable (fragmented MP4 / WebM, as YouTube's DASH
+    formats are). Pipes can't be probed, so the plan comes from the
+    client's codec hints alone.
+    """
+    plan = plan_merge(hints.get('vcodec'), hints.get('acodec'), hints.get('container'), hints.get('duration'))
+    print(f"🧭 {merge_plan_headers(plan)['X-Merge-Plan']}")
+
+    if progress:
+        progress.phase('connecting')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        opens = [submit_timed(executor, 'connect', 'video', open_media_stream, video_url, "Video"),
+                 submit_timed(executor, 'connect', 'audio', open_media_stream, audio_url, "Audio")]
+    throttled = next((f.exception() for f in opens if isinstance(f.exception(), HostThrottled)), None)
+    video_chunks, audio_chunks = (None if f.exception() else f.result() for f in opens)
+
+    if video_chunks is None or audio_chunks is None:
+        for chunks in (video_chunks, audio_chunks):
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if throttled:
+            if progress:
+                progress.finish(str(throttled))
+            return throttled_response(throttled)
+        for future in opens:
+            if future.exception():
+                raise future.exception()
+        failed = 'video' if video_chunks is None else 'audio'
+        if progress:
+            progress.finish(f'Failed to download {failed} after multiple attempts')
+        return jsonify({'error': f'Failed to download {failed} after multiple attempts'}), 400
+
+    if progress:
+        progress.phase('queued_for_ffmpeg' if FFMPEG_SLOTS.waiting or FFMPEG_SLOTS.active >= FFMPEG_SLOTS.limit
+                       else 'merging')
+    # Piped merges may transcode too, so they count against the same cap; the slot is
+    # held until the response closes (see finish() below)
+    FFMPEG_SLOTS.acquire()
+    video_read, video_write = os.pipe()
+    audio_read, audio_write = os.pipe()
+    progress_read, progress_write = os.pipe()
+    cmd = [
+        'ffmpeg', '-y', '-nostdin',
+        '-progress', f'pipe:{progress_write}', '-nostats',
+        '-i', f'pipe:{video_read}',
+        '-i', f'pipe:{audio_read}',
+        '-map', '0:v:0', '-map', '1:a:0',
+        *plan['codec_args'],
+        *(['-movflags', 'frag_keyframe+empty_moov+default_base_moof'] if plan['container'] == 'mp4' else []),
+        '-avoid_negative_ts', 'make_zero',
+        '-fflags', '+genpts',
+        '-f', plan['muxer'], 'pipe:1'
+    ]
+    print("🔧 Starting piped FFmpeg merge...")
+    started = time.time()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                pass_fds=(video_read, audio_read, progress_write))
+    except OSError:
+        FFMPEG_SLOTS.release()
+        for fd in (video_read, video_write, audio_read, audio_write, progress_read, progress_write):
+            os.close(fd)
+        for chunks in (video_chunks, audio_chunks):
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        raise
+    os.close(video_read)
+    os.close(audio_read)
+    os.close(progress_write)
+    if progress:
+        progress.ffmpeg_duration(hints.get('duration'))
+        progress.phase('transcoding' if plan['audio'] != 'copy' or plan['video'] != 'copy' else 'merging')
+    threading.Thread(target=follow_ffmpeg_progress, args=(progress_read, progress), daemon=True).start()
+
+    stderr_tail = deque(maxlen=40)
+    threading.Thread(target=lambda: stderr_tail.extend(proc.stderr), daemon=True).start()
+    threading.Thread(target=_feed_pipe, args=(video_chunks, video_write, "Video", progress), daemon=True).start()
+    threading.Thread(target=_feed_pipe, args=(audio_chunks, audio_write, "Audio", progress), daemon=True).start()
+
+    with span('ffmpeg', 'first chunk'):
+        first_chunk = proc.stdout.read1(65536)
+    if not first_chunk:
+        proc.wait()
+        FFMPEG_SLOTS.release()
+        METRICS.observe('downloader_ffmpeg_seconds', time.time() - started, mode='pipe', outcome='error')
+        error_msg = b''.join(stderr_tail).decode(errors='replace')
+        print(f"💥 FFmpeg error: {error_msg}")
+        if progress:
+            progress.finish(f'FFmpeg merge failed: {error_msg[-200:]}')
+        return jsonify({'error': f'FFmpeg merge failed: {error_msg[-200:]}'}), 500
+
+    def generate():
+        sent = len(first_chunk)
+        counted = 0
+        try:
+            yield first_chunk
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                yield chunk
+                if sent - counted >= METRICS_BYTES_BATCH:
+                    counted = count_proxied_bytes('/merge', sent, counted)
+            if proc.wait() == 0:
+                print(f"✅ Piped merge completed successfully ({sizeof_fmt(sent)})")
+                if progress:
+                    progress.finish()
+            else:
+                print(f"💥 FFmpeg exited with {proc.returncode} after {sizeof_fmt(sent)}")
+        finally:
+            count_proxied_bytes('/merge', sent, counted)
+            if progress and progress.state['phase'] != 'done':
+                progress.finish('Piped merge ended early')
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            outcome = 'ok' if proc.returncode == 0 else 'aborted' if proc.returncode < 0 else 'error'
+            METRICS.observe('downloader_ffmpeg_seconds', time.time() - started, mode='pipe', outcome=outcome)
+
+    def finish():
+        # Runs even if the body was never iterated, when generate()'s cleanup would not
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        FFMPEG_SLOTS.release()
+
+    resp = Response(generate(), mimetype=plan['mimetype'], headers=merge_plan_headers(plan),
+                    direct_passthrough=True)
+    cleanup_on_close(resp, finish)
+    return log_send_timing(set_attachment_filename(resp, f"merged_video.{plan['ext']}"), 'piped merge')
+
 @app.route('/merge', methods=['POST'])
 def merge_video_audio():
     try:
         video_url = request.json.get('video_url')
         audio_url = request.json.get('audio_url')
+        mode = request.json.get('mode', MERGE_MODE)
 
         print(f"🎬+🔊 SUPER MERGE - Video: {video_url[:100] if video_url else 'None'}...")
         print(f"🎬+🔊 SUPER MERGE - Audio: {audio_url[:100] if audio_url else 'None'}...")
@@ -768,99 +4709,426 @@ def merge_video_audio():
         for link in (video_url, audio_url):
             if not (link and link.startswith('http')):
                 return jsonify({'error': 'Invalid URL'}), 400
+        if mode not in ('file', 'pipe'):
+            return jsonify({'error': "mode must be 'file' or 'pipe'"}), 400
 
-        def enhanced_download(url, filename, file_type="video"):
-            for attempt in range(5):  # 5 attempts
-                try:
-                    headers = get_random_headers()
-                    if 'googlevideo.com' in url:
-                        headers.update({
-                            'Origin': 'https://www.youtube.com',
-                            'Referer': 'https://www.youtube.com/',
-                        })
-                    
-                    if attempt > 0:
-                        delay = random.uniform(1.0, 4.0)
-                        print(f"⏳ {file_type} download attempt {attempt + 1}, delay: {delay:.1f}s")
-                        time.sleep(delay)
-                    
-                    r = requests.get(url, stream=True, headers=headers, timeout=60)
-                    
-                    if r.status_code == 200:
-                        print(f"📥 Downloading {file_type}...")
-                        with open(filename, 'wb') as f:
-                            downloaded = 0
-                            for chunk in r.iter_content(chunk_size=32768):
-                                if chunk:
-                                    f.write(chunk)
-                                    downloaded += len(chunk)
-                        
-                        print(f"✅ {file_type} downloaded: {sizeof_fmt(downloaded)}")
-                        return True
-                    else:
-                        print(f"❌ {file_type} attempt {attempt + 1} failed with status {r.status_code}")
-                        
-                except Exception as e:
-                    print(f"❌ {file_type} attempt {attempt + 1} error: {e}")
-                    
-            return False
+        hints = merge_hints(request.json)
 
-        with tempfile.TemporaryDirectory() as td:
-            video_path = os.path.join(td, 'video.mp4')
-            audio_path = os.path.join(td, 'audio.m4a')
-            output_path = os.path.join(td, 'merged.mp4')
+        if request.json.get('async'):
+            # Jobs always produce a file; a piped merge has no client to stream to
+            params = {'video_url': video_url, 'audio_url': audio_url, 'hints': hints}
+            return submit_job('merge', params, float(hints.get('duration') or JOB_DEFAULT_COST))
 
-            # Download both files with retry
-            if not enhanced_download(video_url, video_path, "Video"):
-                return jsonify({'error': 'Failed to download video after multiple attempts'}), 400
+        progress_id = request_progress_id(request.json)
+        if mode == 'pipe':
+            # A live ffmpeg stream cannot be shared, so piped merges skip MERGE_FLIGHTS
+            return stream_merge(video_url, audio_url, hints, PROGRESS.track(None, progress_id))
 
-            if not enhanced_download(audio_url, audio_path, "Audio"):
-                return jsonify({'error': 'Failed to download audio after multiple attempts'}), 400
+        artifact_key = ArtifactCache.key(
+            'merge', canonical_media_key(video_url), canonical_media_key(audio_url), hints['container'])
+        cached_path, cached_meta = ARTIFACTS.lookup(artifact_key)
+        if cached_path:
+            print("⚡ Serving cached merge")
+            PROGRESS.track(None, progress_id).finish()
+            response = ARTIFACTS.send(cached_path, cached_meta)
+            if cached_meta.get('plan'):
+                response.headers.update(merge_plan_headers(cached_meta['plan']))
+            return log_send_timing(response, 'merge')
 
-            print("🔧 Starting enhanced FFmpeg merge...")
-            
-            # Enhanced FFmpeg command
-            cmd = [
-                'ffmpeg', '-y',
-                '-i', video_path,
-                '-i', audio_path,
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-movflags', 'faststart',
-                '-avoid_negative_ts', 'make_zero',
-                '-fflags', '+genpts',
-                output_path
-            ]
-            
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
-            
-            if result.returncode != 0:
-                error_msg = result.stderr.decode()
-                print(f"💥 FFmpeg error: {error_msg}")
-                return jsonify({'error': f'FFmpeg merge failed: {error_msg[:200]}'}), 500
+        flight_key = (video_url, audio_url, hints['container'])
+        progress = PROGRESS.track(flight_key, progress_id)
+        started = time.perf_counter()
+        (result, error, status), shared = MERGE_FLIGHTS.do(
+            flight_key, lambda: merge_media(video_url, audio_url, hints, progress))
+        if shared:
+            add_span('merge', time.perf_counter() - started, 'shared')
+            print("🤝 Shared in-flight merge result")
+        if error:
+            return jsonify({'error': error}), status
 
-            if not os.path.exists(output_path):
-                return jsonify({'error': 'Merged file not created'}), 500
-                
-            file_size = os.path.getsize(output_path)
-            print(f"✅ Enhanced merge completed successfully ({sizeof_fmt(file_size)})")
-            
-            return send_file(output_path, as_attachment=True, download_name='merged_video.mp4')
+        plan = result['plan']
+        download_name = f"merged_video.{plan['ext']}"
+        if result.get('cached'):
+            response = ARTIFACTS.send(result['path'], {'mimetype': plan['mimetype']}, download_name)
+        else:
+            response = send_file(result['path'], as_attachment=True, mimetype=plan['mimetype'],
+                                 download_name=download_name)
+            # Other MERGE_FLIGHTS waiters may still be opening it; merge_media scheduled the delete
+            JANITOR.pin(response, os.path.dirname(result['path']))
+        response.headers.update(merge_plan_headers(plan, result['ffmpeg_seconds']))
+        return log_send_timing(response, 'merge')
             
     except subprocess.TimeoutExpired:
         return jsonify({'error': 'Merge timeout - files too large'}), 408
+    except HostThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         print(f"💥 Enhanced merge error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# BACKGROUND JOBS (long downloads and merges off the request threads)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 64))
+# Finished job results are kept this long, then handed to the janitor
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 3600))
+# Assumed media duration (seconds) when a job's cost can't be estimated
+JOB_DEFAULT_COST = float(os.environ.get('JOB_DEFAULT_COST', 300))
+# Times a job may be parked for a rate-limited host before it fails with 503
+JOB_MAX_DEFERRALS = int(os.environ.get('JOB_MAX_DEFERRALS', 5))
+
+class JobError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+def job_dir(job_id):
+    return os.path.join(TEMP_DIR, f'job-{job_id}')
+
+def write_job(job):
+    path = os.path.join(job_dir(job['id']), 'job.json')
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(tmp, path)
+
+def read_job(job_id):
+    """Job state as written by whichever worker owns it, or None"""
+    try:
+        with open(os.path.join(job_dir(job_id), 'job.json'), encoding='utf-8') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # The queue lives in the owner's memory: if that worker died, nobody will ever finish the job
+    owner = job.get('owner') or ''
+    host, _, pid = owner.rpartition('-')
+    if job['state'] in ('queued', 'running') and host == socket.gethostname() and pid.isdigit() \
+            and not _pid_alive(int(pid)):
+        job['state'], job['status'] = 'failed', 500
+        job['error'] = 'The worker running this job exited; submit it again'
+        job['finished_at'] = time.time()
+        try:
+            write_job(job)
+        except OSError:
+            return job
+        PROGRESS.track(None, job_id).finish(job['error'])
+        JANITOR.schedule(job_dir(job_id), JOB_RESULT_TTL)
+        print(f"🗂️ Job {job_id} failed: owner {owner} is gone")
+    return job
+
+class JobQueue:
+    """Bounded shortest-expected-first queue of background jobs, with a job.json any worker can answer from"""
+
+    def __init__(self, workers, max_queued, runners):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.runners = runners
+        self._heap = []
+        self._deferred = []  # (not_before, seq, priority, job) for throttled jobs
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deferrals = 0
+        self.waits = deque(maxlen=500)
+
+    def _ensure_threads(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name='job-worker', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, params, cost):
+        """Queue a job; returns its state dict, or None when the queue is full"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'params': params,
+            'state': 'queued',
+            'cost_est': round(cost, 1),
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+            'status': None,
+            'result': None,
+            'not_before': None,
+            'deferrals': 0,
+            'owner': _worker_name(),
+        }
+        with self._cond:
+            if len(self._heap) + len(self._deferred) >= self.max_queued:
+                self.rejected += 1
+                return None
+            os.makedirs(job_dir(job_id))
+            write_job(job)
+            # The job id doubles as its progress id
+            PROGRESS.track(None, job_id).phase('queued')
+            self._seq += 1
+            heapq.heappush(self._heap, (job['submitted_at'] + cost, self._seq, job))
+            self.submitted += 1
+            self._ensure_threads()
+            self._cond.notify()
+        print(f"🗂️ Queued {kind} job {job_id} (est {cost:.0f}s, depth {len(self._heap)})")
+        return job
+
+    def position(self, job_id):
+        with self._cond:
+            for index, (_, _, job) in enumerate(sorted(self._heap, key=lambda item: item[:2])):
+                if job['id'] == job_id:
+                    return index
+        return None
+
+    def _defer(self, job, retry_after):
+        """Park a throttled job until its host's Retry-After passes"""
+        job['state'], job['started_at'] = 'queued', None
+        job['not_before'] = time.time() + retry_after
+        job['deferrals'] += 1
+        write_job(job)
+        PROGRESS.track(None, job['id']).phase('queued', retry_at=job['not_before'])
+        with self._cond:
+            self.running -= 1
+            self.deferrals += 1
+            self._seq += 1
+            heapq.heappush(self._deferred, (job['not_before'], self._seq, job['submitted_at'] + job['cost_est'], job))
+            self._cond.notify()
+        print(f"🧯 Job {job['id']} deferred {retry_after:.0f}s (host rate limited)")
+
+    def _next_job(self):
+        """Pop the best runnable job, waiting for deferred ones to come due. Holds _cond"""
+        while True:
+            now = time.time()
+            while self._deferred and self._deferred[0][0] <= now:
+                _, seq, priority, job = heapq.heappop(self._deferred)
+                heapq.heappush(self._heap, (priority, seq, job))
+            if self._heap:
+                return heapq.heappop(self._heap)[2]
+            self._cond.wait(self._deferred[0][0] - now if self._deferred else None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                self.running += 1
+            job['state'] = 'running'
+            job['started_at'] = time.time()
+            self.waits.append(job['started_at'] - job['submitted_at'])
+            write_job(job)
+            try:
+                job['result'] = self.runners[job['kind']](job_dir(job['id']), job['params'], job['id'])
+                job['state'], job['status'] = 'done', 200
+            except HostThrottled as e:
+                if job['deferrals'] < JOB_MAX_DEFERRALS:
+                    self._defer(job, e.retry_after)
+                    continue
+                job['state'], job['status'], job['error'] = 'failed', 503, str(e)
+            except JobError as e:
+                job['state'], job['status'], job['error'] = 'failed', e.status, str(e)
+            except Exception as e:
+                job['state'], job['status'], job['error'] = 'failed', 500, str(e)
+            job['finished_at'] = time.time()
+            write_job(job)
+            PROGRESS.track(None, job['id']).finish(job['error'])
+            JANITOR.schedule(job_dir(job['id']), JOB_RESULT_TTL)
+            with self._cond:
+                self.running -= 1
+                if job['state'] == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            print(f"🗂️ Job {job['id']} {job['state']} in {job['finished_at'] - job['started_at']:.1f}s")
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self.waits)
+            return {
+                'workers': self.workers,
+                'queue_depth': len(self._heap),
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'deferred': len(self._deferred),
+                'deferrals': self.deferrals,
+                'avg_wait_seconds': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'p95_wait_seconds': round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                'max_wait_seconds': round(waits[-1], 3) if waits else 0.0,
+            }
+
+def _keep_result(path, dest_dir):
+    """Hard-link (or copy) a result that other requests may still be reading into the job dir"""
+    dest = os.path.join(dest_dir, os.path.basename(path))
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copyfile(path, dest)
+    return dest
+
+def run_youtube_job(dest_dir, params, progress_id):
+    artifact_key = youtube_artifact_key(params['url'], params['format_id'], params['audio_only'])
+    cached_path, cached_meta = ARTIFACTS.lookup(artifact_key)
+    if cached_path:
+        return {'digest': artifact_key, 'download_name': cached_meta.get('download_name')}
+
+    progress = PROGRESS.track(None, progress_id)
+    file_path, filename, work_dir = fetch_youtube_file(
+        params['url'], params['format_id'], params['audio_only'], progress)
+    try:
+        if not file_path:
+            raise JobError('Downloaded file not found')
+        if ARTIFACTS.publish(artifact_key, file_path, filename):
+            return {'digest': artifact_key, 'download_name': filename}
+        dest = os.path.join(dest_dir, os.path.basename(file_path))
+        os.replace(file_path, dest)
+        return {'path': dest, 'download_name': filename}
+    finally:
+        JANITOR.schedule(work_dir)
+
+def run_merge_job(dest_dir, params, progress_id):
+    video_url, audio_url, hints = params['video_url'], params['audio_url'], params['hints']
+    artifact_key = ArtifactCache.key(
+        'merge', canonical_media_key(video_url), canonical_media_key(audio_url), hints['container'])
+    cached_path, cached_meta = ARTIFACTS.lookup(artifact_key)
+    if cached_path:
+        return {'digest': artifact_key, 'download_name': cached_meta.get('download_name'),
+                'headers': merge_plan_headers(cached_meta['plan']) if cached_meta.get('plan') else {}}
+
+    flight_key = (video_url, audio_url, hints['container'])
+    progress = PROGRESS.track(flight_key, progress_id)
+    (result, error, status), _ = MERGE_FLIGHTS.do(
+        flight_key, lambda: merge_media(video_url, audio_url, hints, progress))
+    if error:
+        raise JobError(error, status)
+    plan = result['plan']
+    out = {
+        'download_name': f"merged_video.{plan['ext']}",
+        'mimetype': plan['mimetype'],
+        'headers': merge_plan_headers(plan, result['ffmpeg_seconds']),
+    }
+    if result.get('cached'):
+        out['digest'] = artifact_key
+    else:
+        # Synchronous /merge callers sharing this flight may still be opening the file
+        out['path'] = _keep_result(result['path'], dest_dir)
+    return out
+
+JOBS = JobQueue(JOB_WORKERS, JOB_QUEUE_MAX, {
+    'youtube_download': run_youtube_job,
+    'merge': run_merge_job,
+})
+
+def youtube_job_cost(video_url):
+    """Expected duration in seconds, from a cached /get_info response when there is one"""
+    _, platform, canonical_id = normalize_video_url(video_url)
+    cached = INFO_CACHE.get((platform, canonical_id))
+    return float((cached or {}).get('duration') or JOB_DEFAULT_COST)
+
+def submit_job(kind, params, cost):
+    job = JOBS.submit(kind, params, cost)
+    if job is None:
+        return jsonify({'error': 'Job queue is full, try again later'}), 503, {'Retry-After': '30'}
+    status_url = f"/jobs/{job['id']}"
+    return jsonify({
+        'job_id': job['id'],
+        'state': job['state'],
+        'status_url': status_url,
+        'result_url': f'{status_url}/result',
+        'progress_url': f"/progress/{job['id']}",
+    }), 202, {'Location': status_url}
+
+def job_view(job):
+    """Public status of a job.
+
+    queue_position counts jobs ahead in the queue of the gunicorn worker
+    holding the job; it is left out when another worker answers.
+    """
+    view = {key: job[key] for key in ('id', 'kind', 'state', 'cost_est', 'error', 'status')}
+    now = time.time()
+    started, finished = job['started_at'], job['finished_at']
+    view['wait_seconds'] = round((started or now) - job['submitted_at'], 3)
+    if started:
+        view['run_seconds'] = round((finished or now) - started, 3)
+    if job['state'] == 'queued':
+        position = JOBS.position(job['id'])
+        if position is not None:
+            view['queue_position'] = position
+        if job.get('not_before'):
+            view['retry_at'] = job['not_before']
+    if job['state'] == 'done':
+        view['result_url'] = f"/jobs/{job['id']}/result"
+    return view
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = read_job(job_id) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_view(job))
+
+@app.route('/jobs/<job_id>/result', methods=['GET', 'HEAD'])
+def job_result(job_id):
+    job = read_job(job_id) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['state'] in ('queued', 'running'):
+        return jsonify(job_view(job)), 202, {'Retry-After': '5'}
+    if job['state'] == 'failed':
+        return jsonify({'error': job['error']}), job['status'] or 500
+
+    result = job['result']
+    if result.get('digest'):
+        path, meta = ARTIFACTS.lookup(result['digest'])
+        if not path:
+            return jsonify({'error': 'Job result was evicted from the cache'}), 410
+        response = ARTIFACTS.send(path, meta, result.get('download_name'))
+    else:
+        if not os.path.exists(result['path']):
+            return jsonify({'error': 'Job result has expired'}), 410
+        response = send_file(result['path'], as_attachment=True, download_name=result['download_name'],
+                             mimetype=result.get('mimetype'), conditional=True)
+    response.headers.update(result.get('headers') or {})
+    return response
+
+@app.route('/progress/<op_id>')
+def progress_events(op_id):
+    """Progress of one operation, as JSON or as Server-Sent Events.
+
+    Pass the same progress_id in the /youtube_download or /merge body (or
+    use a job id). EventSource requests never hold a request thread: with
+    RELAY_URL set they are 307'd to the relay, which streams; otherwise the
+    newest state is sent once (if it changed since Last-Event-ID, terminal
+    states always) and EventSource reconnects after PROGRESS_RETRY_MS.
+    """
+    if not PROGRESS_ID_RE.fullmatch(op_id):
+        return jsonify({'error': 'Invalid progress id'}), 400
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        state = read_progress(op_id)
+        if state is None:
+            return jsonify({'error': 'Unknown progress id'}), 404
+        return jsonify(state)
+
+    redirected = relay_redirect()
+    if redirected:
+        return redirected
+    body = f"retry: {PROGRESS_RETRY_MS}\n\n"
+    state = read_progress(op_id)
+    if state and (progress_event_id(state) != request.headers.get('Last-Event-ID') or progress_finished(state)):
+        body += progress_event(state)
+    return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 # COOKIE MANAGEMENT (Enhanced for all platforms)
 @app.route('/update_cookies/<platform>', methods=['POST'])
 def update_cookies(platform):
     if platform not in ['youtube', 'insta', 'facebook', 'pinterest']:
         return jsonify({'error': 'Invalid platform'}), 400
     
-    path = f'cookies_{platform}.txt'
+    path = cookie_file_for(platform)
     content = request.data.decode('utf-8')
     
     if not content.strip():
@@ -870,10 +5138,18 @@ def update_cookies(platform):
         with open(path, 'w', encoding='utf-8') as f:
             f.write(content)
         print(f"🍪 Updated cookies for {platform.upper()}")
+        YDL_POOL.reload(platform)
         return jsonify({'status': f'{platform} cookies updated successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Background threads (metrics flush, profiler, janitor, job workers, segment prefetch) start on first
+# use, never at import: a fork keeps no threads, so with gunicorn --preload they would be missing in
+# every worker. The same goes for the pre-warm below, which runs in each worker that imports the app.
+# Build option templates and pre-warm the extractor pool in every worker
+if os.environ.get('YDL_PREWARM', '1') == '1':
+    threading.Thread(target=YDL_POOL.warm, daemon=True).start()
+
 if __name__ == '__main__':
     print("🚀 Starting SUPER ENHANCED ALL-PLATFORM DOWNLOADER...")
     print("✨ Features:")
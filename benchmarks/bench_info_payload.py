@@ -0,0 +1,115 @@
+"""/get_info payload size and encode time per response mode.
+
+Builds a synthetic YouTube info dict shaped like yt-dlp's (DASH formats
+with long signed URLs, http_headers and storyboard fragments), runs it
+through build_info_response() and compares the full response with the
+compact and projected views.
+
+    python benchmarks/bench_info_payload.py [--iterations 200]
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('YDL_PREWARM', '0')
+
+import app  # noqa: E402
+
+HEIGHTS = (144, 240, 360, 480, 720, 1080, 1440, 2160)
+
+
+def synthetic_info(seed=0):
+    rng = random.Random(seed)
+
+    def url(itag):
+        token = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789_-') for _ in range(700))
+        return (f'https://rr3---sn-abc.googlevideo.com/videoplayback?expire=1999999999&itag={itag}'
+                f'&clen={rng.randint(10 ** 6, 10 ** 9)}&lmt=1700000000000000&sig={token}')
+
+    headers = {
+        'User-Agent': app.USER_AGENTS[0],
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+        'Sec-Fetch-Mode': 'navigate',
+    }
+    formats = []
+    for index, (name, fragments) in enumerate((('sb3', 1), ('sb2', 30), ('sb1', 120), ('sb0', 120))):
+        formats.append({
+            'format_id': name, 'format_note': 'storyboard', 'ext': 'mhtml', 'protocol': 'mhtml',
+            'vcodec': 'none', 'acodec': 'none', 'url': url(900 + index), 'http_headers': headers,
+            'fragments': [{'url': url(900 + index), 'duration': 10.0} for _ in range(fragments)],
+        })
+    for itag, abr, ext, codec in ((139, 48, 'm4a', 'mp4a.40.5'), (140, 129, 'm4a', 'mp4a.40.2'),
+                                  (249, 50, 'webm', 'opus'), (250, 70, 'webm', 'opus'), (251, 135, 'webm', 'opus')):
+        formats.append({
+            'format_id': str(itag), 'ext': ext, 'acodec': codec, 'vcodec': 'none', 'abr': abr, 'tbr': abr,
+            'asr': 48000, 'filesize': rng.randint(10 ** 6, 10 ** 7), 'protocol': 'https', 'url': url(itag),
+            'http_headers': headers, 'downloader_options': {'http_chunk_size': 10485760},
+            'format_note': 'medium', 'quality': 3, 'container': f'{ext}_dash',
+        })
+    for offset, height in enumerate(HEIGHTS):
+        for itag, ext, codec in ((160 + offset, 'mp4', 'avc1.4d401e'), (278 + offset, 'webm', 'vp9'),
+                                 (394 + offset, 'mp4', 'av01.0.05M.08')):
+            formats.append({
+                'format_id': str(itag), 'ext': ext, 'vcodec': codec, 'acodec': 'none', 'height': height,
+                'width': height * 16 // 9, 'fps': 30, 'tbr': height * 3.1, 'protocol': 'https',
+                'filesize': rng.randint(10 ** 6, 10 ** 9), 'url': url(itag), 'http_headers': headers,
+                'downloader_options': {'http_chunk_size': 10485760}, 'format_note': f'{height}p',
+                'dynamic_range': 'SDR', 'quality': offset, 'container': f'{ext}_dash',
+            })
+    formats.append({
+        'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360,
+        'width': 640, 'fps': 30, 'tbr': 500, 'protocol': 'https', 'url': url(18), 'http_headers': headers,
+    })
+    return {
+        'id': 'dQw4w9WgXcQ', 'title': 'Synthetic benchmark video', 'thumbnail': 'https://i.ytimg.com/vi/x/maxres.jpg',
+        'duration': 212, 'uploader': 'bench', 'view_count': 10 ** 9, 'like_count': 10 ** 7,
+        'upload_date': '20091025', 'formats': formats,
+    }
+
+
+def timed(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - started) / iterations, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help='timed runs per measurement')
+    iterations = parser.parse_args().iterations
+    with contextlib.redirect_stdout(io.StringIO()):
+        resp = app.build_info_response(synthetic_info(), 'youtube')
+
+    modes = {
+        'full': lambda: resp,
+        'compact': lambda: app.compact_info_response(resp),
+        'projected': lambda: app.compact_info_response(
+            resp, ['title', 'duration', 'thumbnail', 'formats', 'video_formats', 'audio_formats'],
+            ['format_id', 'ext', 'height', 'vcodec', 'acodec', 'filesize', 'url']),
+    }
+    encoders = {'json': lambda payload: json.dumps(payload).encode()}
+    if app.orjson is not None:
+        encoders['orjson'] = app.orjson.dumps
+
+    print(f"{'mode':<10} {'encoder':<7} {'build+encode (ms)':>17} {'raw KB':>8} {'gzip KB':>8} {'br KB':>7}")
+    for mode, view in modes.items():
+        for name, encode in encoders.items():
+            seconds, body = timed(lambda: encode(view()), iterations)
+            gz = len(gzip.compress(body, compresslevel=app.GZIP_LEVEL))
+            br = len(app.brotli.compress(body, quality=app.BROTLI_QUALITY)) if app.brotli else None
+            print(f"{mode:<10} {name:<7} {seconds * 1000:>17.3f} {len(body) / 1024:>8.1f} {gz / 1024:>8.1f} "
+                  f"{br / 1024 if br else float('nan'):>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
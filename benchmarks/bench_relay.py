@@ -0,0 +1,165 @@
+"""Concurrent /stream_media streams through the asyncio relay vs. gunicorn threads.
+
+Starts a throttled stand-in origin and the server under test as separate
+processes, opens N simultaneous streams per level and reports wall time,
+time to first byte, and the server's CPU time. streams/core extrapolates
+how many streams at this per-stream rate one fully busy core would carry.
+The load generator shares the machine, so run it on a box with spare cores
+for the cleanest numbers.
+
+    python benchmarks/bench_relay.py [--streams 64,256,1024] [--size 256K] [--rate 128K] [--flask-threads 8]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from origin import parse_size  # noqa: E402
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    pids = [pid]
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def cpu_seconds(pid):
+    """User + system CPU of a process and its children so far (Linux /proc)"""
+    total = 0
+    for member in process_tree(pid):
+        with open(f'/proc/{member}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def rss_mib(pid):
+    total = 0
+    for member in process_tree(pid):
+        with open(f'/proc/{member}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+    return total / 1024
+
+
+def spawn(cmd, port, env=None):
+    proc = subprocess.Popen(cmd, cwd=tempfile.mkdtemp(prefix='bench-relay-'), stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, env={**os.environ, **(env or {})})
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{cmd[0]} did not start listening on {port}')
+
+
+async def one_stream(session, url, expected):
+    started = time.perf_counter()
+    first = None
+    received = 0
+    async with session.get(url) as resp:
+        async for chunk in resp.content.iter_any():
+            if first is None:
+                first = time.perf_counter() - started
+            received += len(chunk)
+    if received != expected:
+        raise RuntimeError(f'stream ended after {received} of {expected} bytes')
+    return first
+
+
+async def run_level(url, streams, expected):
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*(one_stream(session, url, expected) for _ in range(streams)))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench(name, proc, url, levels, size, rate):
+    for streams in levels:
+        cpu_before = cpu_seconds(proc.pid)
+        started = time.perf_counter()
+        firsts = asyncio.run(run_level(url, streams, size))
+        wall = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu_before
+        per_core = streams * size / rate / cpu if cpu else float('inf')
+        print(f"{name:<16} {streams:>7} {wall:>8.2f} {percentile(firsts, 0.5) * 1000:>9.0f} "
+              f"{percentile(firsts, 0.95) * 1000:>9.0f} {cpu:>7.2f} {rss_mib(proc.pid):>8.1f} {per_core:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', default='64,256,1024', help='concurrent streams per level')
+    parser.add_argument('--size', default='256K', help='bytes per stream')
+    parser.add_argument('--rate', default='128K', help='origin bytes/second per connection')
+    parser.add_argument('--flask-threads', type=int, default=0,
+                        help='also run the Flask routes under one gunicorn worker with this many threads')
+    args = parser.parse_args()
+
+    size, rate = parse_size(args.size), parse_size(args.rate)
+    levels = [int(n) for n in args.streams.split(',')]
+    env = {'YDL_PREWARM': '0', 'TEMP_DIR': tempfile.mkdtemp(prefix='bench-relay-'), 'PYTHONPATH': ROOT,
+           'RATE_LIMIT_DEFAULT': '100000:100000'}  # measure relaying, not the origin's rate limit
+
+    origin_port = free_port()
+    origin = spawn([sys.executable, os.path.join(HERE, 'origin.py'), '--size', args.size, '--rate', args.rate,
+                    '--port', str(origin_port)], origin_port)
+    media = f'http://127.0.0.1:{origin_port}/media.mp4'
+
+    servers = []
+    relay_port = free_port()
+    servers.append(('asyncio relay', [sys.executable, os.path.join(ROOT, 'relay.py')], relay_port,
+                    {'RELAY_PORT': str(relay_port)}))
+    if args.flask_threads:
+        flask_port = free_port()
+        servers.append((f'gunicorn {args.flask_threads}thr',
+                        [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(args.flask_threads),
+                         '--timeout', '600', '--bind', f'127.0.0.1:{flask_port}', 'app:app'], flask_port, {}))
+
+    print(f"{args.size} per stream, origin throttled to {args.rate}/s per connection "
+          f"({size / rate:.1f}s per stream), {os.cpu_count()} CPU(s)")
+    print(f"{'server':<16} {'streams':>7} {'wall s':>8} {'ttfb p50':>9} {'ttfb p95':>9} {'cpu s':>7} "
+          f"{'rss MiB':>8} {'streams/core':>12}")
+    try:
+        for name, cmd, port, extra in servers:
+            proc = spawn(cmd, port, {**env, **extra})
+            try:
+                bench(name, proc, f'http://127.0.0.1:{port}/stream_media?url={media}', levels, size, rate)
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        origin.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Offline end-to-end scenarios against the real server, a stand-in origin and the stub extractor.
+
+Each scenario gets a fresh, warmed-up gunicorn (stub_server:app, the Dockerfile's
+worker/thread layout by default) with its own TEMP_DIR, then fires
+--requests requests at --concurrency and reports throughput, time to first
+byte, p50/p99 latency, peak server RSS, and peak/leftover TEMP_DIR usage.
+The origin can throttle connections and inject 403/429s, so retry ladders
+and the host limiter show up in the numbers. --json saves a run and
+--compare prints the change against an earlier one.
+
+    python benchmarks/bench_scenarios.py [--scenarios get_info,merge] [--requests 50] [--concurrency 8]
+        [--size 8M] [--rate 0] [--fail-403 0.02] [--fail-429 0.02] [--json run.json] [--compare base.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+from urllib.parse import quote
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+from bench_relay import free_port, percentile, rss_mib, spawn  # noqa: E402
+
+WATCH_URL = 'https://www.youtube.com/watch?v={}'
+WARMUP_OFFSET = 10 ** 6  # warm-up requests use their own ids/URLs so measured ones stay cold
+
+
+def media_url(origin, path, n):
+    return f'{origin}{path}?n={n}'
+
+
+# name -> (method, path, json body or None) for request n
+SCENARIOS = {
+    'get_info': lambda origin, n: ('POST', '/get_info', {'url': WATCH_URL.format(f'cold{n:07d}')}),
+    'get_info_cached': lambda origin, n: ('POST', '/get_info', {'url': WATCH_URL.format('warm0000001')}),
+    'download_file': lambda origin, n: (
+        'POST', '/download_file', {'url': media_url(origin, '/media.mp4', n), 'filename': 'bench.mp4'}),
+    'stream_media': lambda origin, n: (
+        'GET', f"/stream_media?url={quote(media_url(origin, '/media.mp4', n), safe='')}", None),
+    'proxy_media': lambda origin, n: (
+        'GET', f"/proxy_media?url={quote(media_url(origin, '/media.mp4', n), safe='')}", None),
+    'proxy_download': lambda origin, n: (
+        'GET', f"/proxy_download?url={quote(media_url(origin, '/media.mp4', n), safe='')}", None),
+    'merge': lambda origin, n: ('POST', '/merge', {
+        'video_url': media_url(origin, '/video.mp4', n), 'audio_url': media_url(origin, '/audio.m4a', n)}),
+}
+
+# Metrics compared by --compare, and whether a bigger number is better
+COMPARED = (('req_per_s', True), ('mib_per_s', True), ('ttfb_p50_ms', False), ('latency_p50_ms', False),
+            ('latency_p99_ms', False), ('peak_rss_mib', False), ('peak_temp_mib', False))
+
+
+def make_media(directory, seconds):
+    """A real H.264 clip and AAC track for /merge (needs ffmpeg)"""
+    video, audio = os.path.join(directory, 'video.mp4'), os.path.join(directory, 'audio.m4a')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30',
+                    '-t', str(seconds), '-c:v', 'libx264', '-preset', 'ultrafast', video], check=True)
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=frequency=440',
+                    '-t', str(seconds), '-c:a', 'aac', audio], check=True)
+    return video, audio
+
+
+def dir_bytes(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass  # deleted while we walked
+    return total
+
+
+class ResourceSampler:
+    """Polls the server's RSS and TEMP_DIR size in the background and keeps the peaks"""
+
+    def __init__(self, pid, temp_dir, interval=0.05):
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0.0
+        self.peak_temp = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        try:
+            self.peak_rss = max(self.peak_rss, rss_mib(self.pid))
+        except OSError:
+            pass  # a worker exited between listing and reading
+        self.peak_temp = max(self.peak_temp, dir_bytes(self.temp_dir))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+async def one_request(session, base, method, path, body):
+    started = time.perf_counter()
+    first = None
+    received = 0
+    try:
+        async with session.request(method, base + path, json=body) as resp:
+            async for chunk in resp.content.iter_any():
+                if first is None:
+                    first = time.perf_counter() - started
+                received += len(chunk)
+            status = resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status = type(e).__name__
+    latency = time.perf_counter() - started
+    return status, first if first is not None else latency, latency, received
+
+
+async def run_load(base, requests_, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async def limited(session, request_):
+        async with semaphore:
+            return await one_request(session, base, *request_)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        return await asyncio.gather(*(limited(session, request_) for request_ in requests_))
+
+
+def origin_stats(origin):
+    with urllib.request.urlopen(f'{origin}/_origin_stats', timeout=10) as resp:
+        return Counter(json.load(resp))
+
+
+def run_scenario(name, args, origin, server_env):
+    temp_dir = tempfile.mkdtemp(prefix=f'bench-{name}-')
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+           '--timeout', '600', '--bind', f'127.0.0.1:{port}', '--pythonpath', f'{HERE},{ROOT}', 'stub_server:app']
+    server = spawn(cmd, port, {**server_env, 'TEMP_DIR': temp_dir})
+    base = f'http://127.0.0.1:{port}'
+    try:
+        build = SCENARIOS[name]
+        # Unmeasured requests first: lazy imports, extractor templates and pools (and the cache, for get_info_cached)
+        warmup = [build(origin, WARMUP_OFFSET + n) for n in range(args.warmup)]
+        asyncio.run(run_load(base, warmup, args.concurrency))
+        before = origin_stats(origin)
+        with ResourceSampler(server.pid, temp_dir) as sampler:
+            started = time.perf_counter()
+            results = asyncio.run(run_load(base, [build(origin, n) for n in range(args.requests)], args.concurrency))
+            wall = time.perf_counter() - started
+        upstream = origin_stats(origin) - before
+        time.sleep(args.settle)
+        leftover = dir_bytes(temp_dir)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    statuses = Counter(str(status) for status, _, _, _ in results)
+    ok = [result for result in results if isinstance(result[0], int) and result[0] < 400]
+    ttfbs = [ttfb for _, ttfb, _, _ in ok] or [0.0]
+    latencies = [latency for _, _, latency, _ in ok] or [0.0]
+    received = sum(size for _, _, _, size in ok)
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'statuses': dict(sorted(statuses.items())),
+        'upstream_responses': dict(sorted(upstream.items())),
+        'wall_s': round(wall, 3),
+        'req_per_s': round(len(ok) / wall, 2),
+        'mib_per_s': round(received / wall / 1024 ** 2, 2),
+        'ttfb_p50_ms': round(percentile(ttfbs, 0.5) * 1000, 1),
+        'ttfb_p99_ms': round(percentile(ttfbs, 0.99) * 1000, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_rss_mib': round(sampler.peak_rss, 1),
+        'peak_temp_mib': round(sampler.peak_temp / 1024 ** 2, 1),
+        'leftover_temp_mib': round(leftover / 1024 ** 2, 1),
+    }
+
+
+def print_results(results):
+    print(f"{'scenario':<16} {'ok/req':>9} {'req/s':>8} {'MiB/s':>8} {'ttfb p50':>9} {'ttfb p99':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'rss MiB':>8} {'tmp MiB':>8} {'left':>6}")
+    for name, r in results.items():
+        print(f"{name:<16} {r['ok']:>4}/{r['requests']:<4} {r['req_per_s']:>8.2f} {r['mib_per_s']:>8.2f} "
+              f"{r['ttfb_p50_ms']:>9.1f} {r['ttfb_p99_ms']:>9.1f} {r['latency_p50_ms']:>8.1f} "
+              f"{r['latency_p99_ms']:>8.1f} {r['peak_rss_mib']:>8.1f} {r['peak_temp_mib']:>8.1f} "
+              f"{r['leftover_temp_mib']:>6.1f}")
+        if set(r['statuses']) - {'200', '206'} or set(r['upstream_responses']) - {'200', '206'}:
+            print(f"{'':<16} client statuses {r['statuses']}, origin {r['upstream_responses']}")
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['scenarios']
+    print(f"\nchange vs {baseline_path} (+ is better)")
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED:
+            old, new = baseline[name].get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100 * (1 if higher_is_better else -1)
+            changes.append(f"{metric} {change:+.1f}%")
+        print(f"{name:<16} {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=8, help='unmeasured requests before each scenario')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--size', default='8M', help='size of the origin payload')
+    parser.add_argument('--rate', default='0', help='origin bytes/second per connection, 0 = unthrottled')
+    parser.add_argument('--fail-403', type=float, default=0.0, help='fraction of origin requests answered 403')
+    parser.add_argument('--fail-429', type=float, default=0.0, help='fraction of origin requests answered 429')
+    parser.add_argument('--ydl-latency', type=float, default=0.0, help='seconds the stub extractor takes per call')
+    parser.add_argument('--ydl-fail-rate', type=float, default=0.0, help='fraction of extractions failing with 429')
+    parser.add_argument('--merge-seconds', type=int, default=10, help='length of the clip /merge muxes')
+    parser.add_argument('--production-limits', action='store_true',
+                        help="keep the per-host rate limits instead of lifting them for the load test")
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait before measuring leftover temp')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    media_dir = tempfile.mkdtemp(prefix='bench-media-')
+    origin_port = free_port()
+    origin_cmd = [sys.executable, os.path.join(HERE, 'origin.py'), '--size', args.size, '--rate', args.rate,
+                  '--port', str(origin_port), '--fail-403', str(args.fail_403), '--fail-429', str(args.fail_429)]
+    if 'merge' in names:
+        if shutil.which('ffmpeg') is None:
+            print("ffmpeg not found, skipping merge")
+            names.remove('merge')
+        else:
+            video, audio = make_media(media_dir, args.merge_seconds)
+            origin_cmd += ['--file', f'/video.mp4={video}', '--file', f'/audio.m4a={audio}']
+    origin = spawn(origin_cmd, origin_port)
+    origin_url = f'http://127.0.0.1:{origin_port}'
+
+    server_env = {'YDL_PREWARM': '0', 'PYTHONPATH': ROOT, 'STUB_ORIGIN': origin_url,
+                  'STUB_YDL_LATENCY': str(args.ydl_latency), 'STUB_YDL_FAIL_RATE': str(args.ydl_fail_rate)}
+    if not args.production_limits:
+        server_env.update(RATE_LIMITS='', RATE_LIMIT_DEFAULT='100000:100000')
+
+    print(f"{args.requests} requests x {args.concurrency} concurrent, {args.workers} workers x {args.threads} "
+          f"threads, payload {args.size} at {args.rate}/s, faults 403={args.fail_403} 429={args.fail_429}, "
+          f"{os.cpu_count()} CPU(s)")
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_scenario(name, args, origin_url, server_env)
+    finally:
+        origin.terminate()
+        origin.wait()
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        meta = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+        meta.update(cpu_count=os.cpu_count(), started=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'scenarios': results}, f, indent=2)
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Single-connection vs. segmented downloads against a per-connection-throttled origin.
+
+    python benchmarks/bench_segmented.py [--size 32M] [--rate 2M] [--connections 1,2,4,8]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('YDL_PREWARM', '0')
+
+import app  # noqa: E402
+from origin import parse_size, start_origin  # noqa: E402
+
+
+def timed_download(url, path):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not app.enhanced_download(url, path, 'Bench'):
+            raise RuntimeError('download failed')
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='32M')
+    parser.add_argument('--rate', default='2M', help='bytes/second per connection')
+    parser.add_argument('--segment', default='2M')
+    parser.add_argument('--connections', default='1,2,4,8')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    origin = start_origin(size, parse_size(args.rate))
+    url = f'{origin.url}/media.mp4'
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-seg-'), 'out.bin')
+
+    print(f"payload {args.size}, origin throttled to {args.rate}/s per connection")
+    print(f"{'connections':>11} {'seconds':>8} {'MiB/s':>7}")
+    for connections in (int(c) for c in args.connections.split(',')):
+        app.SEGMENT_HOSTS['127.0.0.1'] = (connections, parse_size(args.segment))
+        elapsed = timed_download(url, path)
+        assert open(path, 'rb').read() == origin.payload, 'payload mismatch'
+        print(f"{connections:>11} {elapsed:>8.2f} {size / elapsed / 1024 ** 2:>7.2f}")
+    os.remove(path)
+    origin.shutdown()
+
+
+if __name__ == '__main__':
+    main()
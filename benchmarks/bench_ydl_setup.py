@@ -0,0 +1,69 @@
+"""Per-request YoutubeDL setup cost: fresh instance per attempt vs. the pool.
+
+Measures only the work done before extract_info() starts talking to the
+network: building option dicts, constructing YoutubeDL and parsing cookies.
+
+    python benchmarks/bench_ydl_setup.py [--iterations 200]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('YDL_PREWARM', '0')
+
+import yt_dlp  # noqa: E402
+import app  # noqa: E402
+
+
+def fresh_setup(platform):
+    """What every attempt used to do: rebuild opts, new YoutubeDL, load cookies"""
+    opts = app.get_enhanced_ydl_opts(platform)
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.cookiejar
+
+
+def pooled_setup(platform):
+    strategy, opts = app.YDL_POOL.templates(platform)[0]
+    with app.YDL_POOL.checkout(platform, strategy, opts) as ydl:
+        ydl.cookiejar
+
+
+def bench(fn, platform, iterations):
+    fn(platform)  # first call pays one-off imports/template builds
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(platform)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help='timed runs per measurement')
+    iterations = parser.parse_args().iterations
+    workdir = tempfile.mkdtemp(prefix='bench-ydl-')
+    # Work on copies: YoutubeDL.close() writes the cookie jar back to disk
+    for name in os.listdir(ROOT):
+        if name.startswith('cookies_') and name.endswith('.txt'):
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    os.chdir(workdir)
+    try:
+        print(f"{'platform':<10} {'fresh (ms)':>11} {'pooled (ms)':>12} {'speedup':>8}")
+        for platform in ('youtube', 'insta', 'facebook', 'pinterest'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                fresh = bench(fresh_setup, platform, iterations)
+                pooled = bench(pooled_setup, platform, iterations)
+            print(f"{platform:<10} {fresh * 1000:>11.3f} {pooled * 1000:>12.3f} {fresh / pooled:>7.0f}x")
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
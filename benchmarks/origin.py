@@ -0,0 +1,196 @@
+"""Local stand-in media origin for offline benchmarks.
+
+Serves a deterministic payload at any path with HEAD and single Range
+support, and throttles every connection to a fixed byte rate the way
+googlevideo does, so per-connection limits can be measured without
+touching the real CDNs. Real media files can be mounted at fixed paths
+(for /merge, which needs something ffmpeg can read), and a fraction of
+requests can be answered with 403 or 429 + Retry-After to exercise the
+retry ladders and the host limiter. GET /_origin_stats returns the
+response counts by status.
+
+    python benchmarks/origin.py --size 64M --rate 2M --port 8901 [--fail-403 0.05] [--fail-429 0.02]
+                                [--file /video.mp4=clip.mp4]
+"""
+import argparse
+import json
+import mimetypes
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+WRITE_SIZE = 16384
+
+
+def parse_size(value):
+    value = str(value).strip().upper()
+    for suffix, factor in (('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _byte_range(self, total):
+        """(status, start, end) for the request, or None for an unsatisfiable range"""
+        header = self.headers.get('Range')
+        if not header:
+            return 200, 0, total - 1
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return 200, 0, total - 1
+        if not match.group(1):
+            start, end = max(total - int(match.group(2)), 0), total - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+        if start >= total or start > end:
+            return None
+        return 206, start, end
+
+    def _send_empty(self, status, headers=()):
+        self.server.count(status)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _serve(self, send_body):
+        path = urlsplit(self.path).path
+        if path == '/_origin_stats':
+            body = json.dumps(self.server.stats()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        fault = self.server.fault()
+        if fault == 429:
+            self._send_empty(429, [('Retry-After', str(self.server.retry_after))])
+            return
+        if fault == 403:
+            self._send_empty(403)
+            return
+
+        payload, content_type = self.server.files.get(path, (self.server.payload, self.server.content_type))
+        total = len(payload)
+        byte_range = self._byte_range(total)
+        if byte_range is None:
+            self._send_empty(416, [('Content-Range', f'bytes */{total}')])
+            return
+
+        status, start, end = byte_range
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        self.end_headers()
+        if send_body:
+            self._write_throttled(memoryview(payload)[start:end + 1])
+
+    def _write_throttled(self, body):
+        rate = self.server.rate
+        started = time.monotonic()
+        for offset in range(0, len(body), WRITE_SIZE):
+            self.wfile.write(body[offset:offset + WRITE_SIZE])
+            if rate:
+                # Sleep until this connection is back under its byte budget
+                ahead = (offset + WRITE_SIZE) / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+
+class OriginServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # load tests open hundreds of connections at once
+
+    def __init__(self, address, size, rate=0, content_type='video/mp4', seed=0, files=None, fail_403=0.0,
+                 fail_429=0.0, retry_after=1):
+        super().__init__(address, OriginHandler)
+        self.payload = random.Random(seed).randbytes(size)
+        self.rate = rate
+        self.content_type = content_type
+        self.files = {}  # path -> (bytes, content type), served instead of the payload
+        for path, filename in (files or {}).items():
+            with open(filename, 'rb') as f:
+                self.files[path] = (f.read(), mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        self.fail_403 = fail_403
+        self.fail_429 = fail_429
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.responses = Counter()
+
+    def fault(self):
+        """403, 429 or None for the next request, drawn from a seeded RNG so runs are repeatable"""
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.fail_403:
+            return 403
+        if draw < self.fail_403 + self.fail_429:
+            return 429
+        return None
+
+    def count(self, status):
+        with self._lock:
+            self.responses[status] += 1
+
+    def stats(self):
+        with self._lock:
+            return {str(status): count for status, count in sorted(self.responses.items())}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_origin(size, rate=0, host='127.0.0.1', port=0, **kwargs):
+    """Start an origin in a daemon thread; rate is bytes/second per connection"""
+    server = OriginServer((host, port), size, rate, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='64M')
+    parser.add_argument('--rate', default='0', help='bytes/second per connection, 0 = unthrottled')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--fail-403', type=float, default=0.0, help='fraction of requests answered 403')
+    parser.add_argument('--fail-429', type=float, default=0.0, help='fraction of requests answered 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--file', action='append', default=[], metavar='PATH=FILE',
+                        help='serve a local file at PATH instead of the payload (repeatable)')
+    args = parser.parse_args()
+    files = dict(mount.split('=', 1) for mount in args.file)
+    server = OriginServer((args.host, args.port), parse_size(args.size), parse_size(args.rate), files=files,
+                          fail_403=args.fail_403, fail_429=args.fail_429, retry_after=args.retry_after)
+    print(f"Serving {args.size} at {server.url}/ (rate {args.rate}/s per connection)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
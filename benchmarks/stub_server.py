@@ -0,0 +1,17 @@
+"""app.py with the stub extractor installed, for the offline scenario benchmarks.
+
+    STUB_ORIGIN=http://127.0.0.1:8901 gunicorn --pythonpath benchmarks,. stub_server:app
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.setdefault('YDL_PREWARM', '0')
+
+import app as service  # noqa: E402
+import stub_ydl  # noqa: E402
+
+stub_ydl.install(service)
+app = service.app
@@ -0,0 +1,134 @@
+"""Stand-in for yt_dlp.YoutubeDL that answers extract_info() from recorded info dicts.
+
+install() swaps it into app.py, so /get_info runs the real strategy ladder,
+pool, limiter, cache and format post-processing without touching the
+network. Fixtures are JSON info dicts in STUB_YDL_FIXTURES (one per
+platform, picked by extractor_key; the synthetic YouTube dict from
+bench_info_payload when there are none). Every format URL is rewritten to
+STUB_ORIGIN so downloads and merges of the extracted formats stay local.
+STUB_YDL_LATENCY adds a fixed extraction delay and STUB_YDL_FAIL_RATE makes
+that fraction of calls fail with an HTTP 429, like a bot-checked attempt.
+
+    python benchmarks/stub_ydl.py record URL [--out benchmarks/fixtures/youtube.json]   # needs network, once
+"""
+import argparse
+import copy
+import glob
+import http.cookiejar
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import yt_dlp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STUB_YDL_FIXTURES = os.environ.get('STUB_YDL_FIXTURES', os.path.join(HERE, 'fixtures'))
+STUB_ORIGIN = os.environ.get('STUB_ORIGIN', 'http://127.0.0.1:8901')
+STUB_YDL_LATENCY = float(os.environ.get('STUB_YDL_LATENCY', 0.0))
+STUB_YDL_FAIL_RATE = float(os.environ.get('STUB_YDL_FAIL_RATE', 0.0))
+
+_fixtures = None
+_fixtures_lock = threading.Lock()
+_random = random.Random(0)
+
+
+def load_fixtures():
+    """extractor name -> recorded info dict, loaded once"""
+    global _fixtures
+    with _fixtures_lock:
+        if _fixtures is None:
+            fixtures = {}
+            for path in sorted(glob.glob(os.path.join(STUB_YDL_FIXTURES, '*.json'))):
+                with open(path, encoding='utf-8') as f:
+                    info = json.load(f)
+                fixtures.setdefault((info.get('extractor_key') or 'generic').lower(), info)
+            if not fixtures:
+                from bench_info_payload import synthetic_info
+                fixtures['youtube'] = synthetic_info()
+            _fixtures = fixtures
+    return _fixtures
+
+
+def video_id(url):
+    match = re.search(r'(?:[?&]v=|youtu\.be/|/(?:shorts|reel|p|pin|videos)/)([\w-]+)', url)
+    return match.group(1) if match else re.sub(r'\W+', '_', url)[-32:]
+
+
+def localize(info, vid):
+    """Copy of a recorded info dict for `vid`, with every media URL pointing at the stand-in origin"""
+    info = copy.deepcopy(info)
+    info['id'] = vid
+    for fmt in info.get('formats') or []:
+        name = f"{fmt.get('format_id', 'media')}.{fmt.get('ext') or 'bin'}"
+        fmt['url'] = f'{STUB_ORIGIN}/{name}?id={vid}'
+        for index, fragment in enumerate(fmt.get('fragments') or []):
+            fragment['url'] = f'{STUB_ORIGIN}/{name}?id={vid}&fragment={index}'
+        fmt.pop('manifest_url', None)
+    if info.get('url'):
+        info['url'] = f"{STUB_ORIGIN}/{info['id']}.{info.get('ext') or 'mp4'}"
+    return info
+
+
+class StubYoutubeDL:
+    """The slice of the YoutubeDL API that app.py uses"""
+
+    def __init__(self, params=None, auto_init=True):
+        self.params = dict(params or {})
+        self.cookiejar = http.cookiejar.CookieJar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False, **kwargs):
+        if STUB_YDL_LATENCY:
+            time.sleep(STUB_YDL_LATENCY)
+        if STUB_YDL_FAIL_RATE and _random.random() < STUB_YDL_FAIL_RATE:
+            raise yt_dlp.utils.DownloadError('ERROR: [stub] Unable to download webpage: HTTP Error 429: Too Many Requests')
+        fixtures = load_fixtures()
+        host = re.sub(r'^www\.', '', re.sub(r'^\w+://', '', url).split('/', 1)[0])
+        info = next((info for name, info in fixtures.items() if name in host), None)
+        return localize(info or next(iter(fixtures.values())), video_id(url))
+
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return info
+
+
+def install(app_module):
+    """Make app.py build StubYoutubeDL instances instead of real extractors"""
+    app_module.yt_dlp.YoutubeDL = StubYoutubeDL
+
+
+def record(url, out):
+    """Save a real extraction as a fixture"""
+    with yt_dlp.YoutubeDL({'quiet': True, 'skip_download': True}) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    print(f"Recorded {info.get('extractor_key')} {info.get('id')}: {len(info.get('formats') or [])} formats -> {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    rec = sub.add_parser('record', help='record a real info dict as a fixture')
+    rec.add_argument('url')
+    rec.add_argument('--out')
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.url, args.out or os.path.join(STUB_YDL_FIXTURES, f'{video_id(args.url)}.json'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Asyncio media relay for /stream_media, /proxy_media, /proxy_download and /progress.
+
+The Flask routes hold a gunicorn thread for as long as a player keeps a
+stream open, so 2 workers x 4 threads tops out at eight concurrent streams.
+This relay serves the same three routes from one event loop: every stream
+is a coroutine parked on socket readiness, and each chunk is only read from
+upstream after the previous one has been handed to the client transport
+(StreamResponse.write() waits for the socket to drain), so a slow player
+slows its own upstream read instead of piling bytes up in memory.
+Progress event streams are long-lived too, so they are served here as well.
+
+Range capping, header strategies and mirrored response headers come from
+app.py, so both paths answer identically. Point the Flask app at the relay
+with RELAY_URL and it 307s the relay routes here.
+
+    python relay.py                                       # RELAY_PORT, default 10001
+    gunicorn relay:create_app --bind 0.0.0.0:10001 --worker-class aiohttp.GunicornWebWorker
+"""
+import asyncio
+import functools
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+os.environ.setdefault('YDL_PREWARM', '0')  # the relay never touches yt-dlp
+
+from app import (  # noqa: E402
+    HOST_LIMITS, METRICS, METRICS_BYTES_BATCH, PROGRESS_ID_RE, PROGRESS_POLL, PROGRESS_RETRY_MS,
+    PROGRESS_STREAM_SECONDS, RELAY_RESPONSE_HEADERS, STREAM_MEDIA_HEADERS, HostThrottled, cap_range_header,
+    count_proxied_bytes, media_request_headers, progress_event, progress_event_id, progress_finished,
+    progress_path, read_progress, sizeof_fmt, stream_header_strategies,
+)
+
+RELAY_PORT = int(os.environ.get('RELAY_PORT', 10001))
+RELAY_BACKLOG = int(os.environ.get('RELAY_BACKLOG', 1024))
+RELAY_UPSTREAM_LIMIT = int(os.environ.get('RELAY_UPSTREAM_LIMIT', 1000))  # pooled upstream connections, 0 = no cap
+RELAY_READ_BUFFER = int(os.environ.get('RELAY_READ_BUFFER', 65536))  # per-stream upstream read buffer
+RELAY_CONNECT_TIMEOUT = 10
+
+
+class RelayStats:
+    """Live and lifetime stream counters for /relay_stats"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.active = 0
+        self.peak = 0
+        self.streams = 0
+        self.completed = 0
+        self.aborted = 0
+        self.bytes = 0
+
+    def open(self):
+        self.active += 1
+        self.streams += 1
+        self.peak = max(self.peak, self.active)
+
+    def close(self, sent, completed):
+        self.active -= 1
+        self.bytes += sent
+        if completed:
+            self.completed += 1
+        else:
+            self.aborted += 1
+
+    def snapshot(self):
+        return {
+            'active_streams': self.active,
+            'peak_streams': self.peak,
+            'streams': self.streams,
+            'completed': self.completed,
+            'aborted': self.aborted,
+            'bytes_relayed': self.bytes,
+            'uptime': round(time.time() - self.started, 1),
+        }
+
+
+STATS = RelayStats()
+
+
+async def open_upstream(request, file_url, headers, read_timeout, forward_range=True):
+    """Open the upstream side of a relay for a GET/HEAD request.
+
+    Goes through the same per-host limiter as app.http_request(); the token
+    wait is an asyncio sleep, and HostThrottled is raised instead of waiting
+    past RATE_LIMIT_MAX_WAIT. The limiter syncs blocks through files under
+    TEMP_DIR, so its calls run in the default executor, off the event loop.
+    """
+    headers = {**headers, 'Accept-Encoding': 'identity'}  # byte offsets must match the file
+    range_header = cap_range_header(request.headers.get('Range')) if forward_range else None
+    if range_header:
+        headers['Range'] = range_header
+    else:
+        headers.pop('Range', None)
+    loop = asyncio.get_running_loop()
+    limiter = HOST_LIMITS.for_url(file_url)
+    wait = await loop.run_in_executor(None, limiter.reserve)
+    if wait:
+        await asyncio.sleep(wait)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=RELAY_CONNECT_TIMEOUT, sock_read=read_timeout)
+    try:
+        upstream = await request.app['session'].request(request.method, file_url, headers=headers, timeout=timeout)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        await loop.run_in_executor(None, functools.partial(limiter.record, failed=True))
+        METRICS.inc('downloader_upstream_responses_total', host=limiter.label, status='error')
+        raise
+    try:
+        await loop.run_in_executor(None, limiter.record, upstream.status, upstream.headers.get('Retry-After'))
+    except BaseException:
+        upstream.release()  # cancelled while recording: the caller never gets to release it
+        raise
+    METRICS.inc('downloader_upstream_responses_total', host=limiter.label, status=upstream.status)
+    return upstream
+
+
+def throttled_response(error):
+    """503 with Retry-After for a request the host limiter refused"""
+    retry_after = max(int(error.retry_after + 0.999), 1)
+    print(f"🧯 {error}")
+    return web.json_response({'error': str(error), 'retry_after': retry_after}, status=503,
+                             headers={'Retry-After': str(retry_after)})
+
+
+async def relay_response(request, upstream, default_content_type, chunk_size=32768, extra_headers=None,
+                         mirror_status=True):
+    """Mirror an upstream 200/206/416 to the client, one chunk in flight at a time"""
+    names = RELAY_RESPONSE_HEADERS if mirror_status else ('Content-Type', 'Content-Length')
+    headers = {name: upstream.headers[name] for name in names if name in upstream.headers}
+    headers.setdefault('Content-Type', default_content_type)
+    if mirror_status:
+        headers['Accept-Ranges'] = 'bytes'
+    if extra_headers:
+        headers.update(extra_headers)
+
+    response = web.StreamResponse(status=upstream.status if mirror_status else 200, headers=headers)
+    if request.method == 'HEAD' or upstream.status == 416:
+        upstream.release()
+        await response.prepare(request)
+        await response.write_eof()
+        return response
+
+    STATS.open()
+    sent = counted = 0
+    completed = False
+    try:
+        await response.prepare(request)
+        async for chunk in upstream.content.iter_chunked(chunk_size):
+            await response.write(chunk)  # waits here while the client's socket buffer is full
+            sent += len(chunk)
+            if sent - counted >= METRICS_BYTES_BATCH:
+                counted = count_proxied_bytes(request.path, sent, counted)
+        await response.write_eof()
+        completed = True
+    except ConnectionResetError:
+        print(f"🔌 Client left after {sizeof_fmt(sent)}")
+    except asyncio.CancelledError:
+        print(f"🔌 Relay cancelled after {sizeof_fmt(sent)}")
+        raise
+    except Exception as e:
+        print(f"🚨 Streaming error: {e}")
+    finally:
+        count_proxied_bytes(request.path, sent, counted)
+        STATS.close(sent, completed)
+        if completed:
+            upstream.release()
+        else:
+            upstream.close()  # half-read body, the connection can't go back to the pool
+    return response
+
+
+async def stream_media(request):
+    file_url = request.query.get('url')
+    if not file_url:
+        raise web.HTTPBadRequest()
+
+    print(f"🎬 Relay streaming request for: {file_url[:100]}... (Range: {request.headers.get('Range')})")
+    for attempt, headers in enumerate(stream_header_strategies(file_url)):
+        try:
+            upstream = await open_upstream(request, file_url, headers, read_timeout=20)
+            print(f"📡 Stream attempt {attempt + 1} status: {upstream.status}")
+            if upstream.status in (200, 206, 416):
+                return await relay_response(request, upstream, 'video/mp4', extra_headers=STREAM_MEDIA_HEADERS)
+
+            upstream.release()
+            if upstream.status not in (403, 429):
+                print(f"❌ Stream status: {upstream.status}")
+        except HostThrottled as e:
+            return throttled_response(e)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"🚨 Stream attempt {attempt + 1} error: {e}")
+
+    raise web.HTTPServiceUnavailable()
+
+
+async def proxy_media(request):
+    file_url = request.query.get('url')
+    if not file_url or not file_url.startswith('http'):
+        raise web.HTTPBadRequest()
+
+    try:
+        upstream = await open_upstream(request, file_url, media_request_headers(file_url), read_timeout=20)
+    except HostThrottled as e:
+        return throttled_response(e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"❌ Proxy media error: {e}")
+        raise web.HTTPInternalServerError()
+    if upstream.status not in (200, 206, 416):
+        upstream.release()
+        return web.Response(status=upstream.status)
+    return await relay_response(request, upstream, 'application/octet-stream', chunk_size=16384)
+
+
+async def proxy_download(request):
+    file_url = request.query.get('url')
+    if not file_url or not file_url.startswith('http'):
+        raise web.HTTPBadRequest()
+
+    try:
+        upstream = await open_upstream(request, file_url, media_request_headers(file_url), read_timeout=45,
+                                       forward_range=False)
+    except HostThrottled as e:
+        return throttled_response(e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"❌ Proxy download error: {e}")
+        raise web.HTTPInternalServerError()
+    if upstream.status != 200:
+        upstream.release()
+        return web.Response(status=upstream.status)
+    return await relay_response(request, upstream, 'application/octet-stream', chunk_size=16384,
+                                mirror_status=False)
+
+
+async def progress_events(request):
+    """Server-Sent Events for one operation's progress state file.
+
+    Intermediate states are coalesced: each poll sends only the newest
+    write. The stream ends with a done/failed event, or after
+    PROGRESS_STREAM_SECONDS, when EventSource reconnects on its own.
+    """
+    op_id = request.match_info['op_id']
+    if not PROGRESS_ID_RE.fullmatch(op_id):
+        raise web.HTTPBadRequest()
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    await response.prepare(request)
+    await response.write(f"retry: {PROGRESS_RETRY_MS}\n\n".encode())
+    path = progress_path(op_id)
+    deadline = time.monotonic() + PROGRESS_STREAM_SECONDS
+    last_mtime, last_id = None, request.headers.get('Last-Event-ID')
+    quiet_since = time.monotonic()
+    try:
+        while time.monotonic() < deadline:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            state = read_progress(op_id) if mtime is not None and mtime != last_mtime else None
+            last_mtime = mtime
+            if state:
+                # Terminal states are always re-sent so a reconnecting client can stop
+                if progress_event_id(state) != last_id or progress_finished(state):
+                    last_id = progress_event_id(state)
+                    await response.write(progress_event(state).encode())
+                    quiet_since = time.monotonic()
+                if progress_finished(state):
+                    break
+            if time.monotonic() - quiet_since > 15:
+                await response.write(b": keepalive\n\n")
+                quiet_since = time.monotonic()
+            await asyncio.sleep(PROGRESS_POLL)
+    except ConnectionResetError:
+        return response
+    await response.write_eof()
+    return response
+
+
+async def preflight(request):
+    """CORS preflight, matching flask-cors' allow-everything defaults on the Flask app"""
+    return web.Response(status=204, headers={
+        'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
+        'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '*'),
+    })
+
+
+async def relay_stats(request):
+    return web.json_response({**STATS.snapshot(), 'rate_limits': HOST_LIMITS.stats()})
+
+
+async def metrics(request):
+    # render() reads every worker's snapshot file under a lock shared with other scrapes
+    text = await asyncio.get_running_loop().run_in_executor(None, METRICS.render)
+    return web.Response(text=text, content_type='text/plain', charset='utf-8')
+
+
+async def allow_any_origin(request, response):
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+
+
+async def upstream_session(app):
+    connector = aiohttp.TCPConnector(limit=RELAY_UPSTREAM_LIMIT, ttl_dns_cache=300)
+    app['session'] = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                           read_bufsize=RELAY_READ_BUFFER)
+    yield
+    await app['session'].close()
+
+
+async def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(upstream_session)
+    app.on_response_prepare.append(allow_any_origin)
+    for path, handler in (('/stream_media', stream_media), ('/proxy_media', proxy_media)):
+        app.router.add_get(path, handler)  # add_get registers HEAD as well
+        app.router.add_route('OPTIONS', path, preflight)
+    app.router.add_get('/proxy_download', proxy_download, allow_head=False)
+    app.router.add_route('OPTIONS', '/proxy_download', preflight)
+    app.router.add_get('/progress/{op_id}', progress_events, allow_head=False)
+    app.router.add_get('/relay_stats', relay_stats)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+
+if __name__ == '__main__':
+    print(f"🚀 Starting asyncio media relay on port {RELAY_PORT}...")
+    web.run_app(create_app(), host='0.0.0.0', port=RELAY_PORT, backlog=RELAY_BACKLOG, access_log=None,
+                print=None)